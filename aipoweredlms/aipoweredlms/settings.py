@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',    
     'rest_framework',
+    'adrf',
     'quiz_api',
     'corsheaders',
 ]
@@ -52,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'quiz_api.metrics.MetricsMiddleware',
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -135,3 +138,101 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Maximum number of concurrent Gemini/S3-bound requests per ASGI worker
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+
+# Semantic response cache for RAG chat answers (quizzes are generated fresh every time)
+SEMANTIC_CACHE = {
+    'THRESHOLD': float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95')),  # cosine similarity
+    'TTL': int(os.getenv('SEMANTIC_CACHE_TTL', '3600')),  # seconds
+    'MAX_ENTRIES': int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000')),
+}
+
+# Content-addressed cache of extracted PDF text and Gemini results for uploads
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', BASE_DIR / 'pdf_cache')
+PDF_CACHE_MAX_BYTES = int(os.getenv('PDF_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Context assembly for RAG prompts: candidates fetched, MMR diversity and prompt token budget
+RAG_CONTEXT = {
+    'FETCH_K': int(os.getenv('RAG_FETCH_K', '40')),
+    'MAX_CHUNKS': int(os.getenv('RAG_MAX_CHUNKS', '15')),
+    'MMR_LAMBDA': float(os.getenv('RAG_MMR_LAMBDA', '0.5')),
+    'TOKEN_BUDGET': int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '3000')),
+    'DEDUPE_THRESHOLD': float(os.getenv('RAG_DEDUPE_THRESHOLD', '0.8')),
+    'RRF_K': int(os.getenv('RAG_RRF_K', '60')),
+}
+
+# Bulk question-bank generation (quiz_api.bulk_quiz)
+BULK_QUIZ = {
+    'PARALLELISM': int(os.getenv('BULK_QUIZ_PARALLELISM', '8')),
+    'BATCH_SIZE': int(os.getenv('BULK_QUIZ_BATCH_SIZE', '10')),
+    'CHUNKS_PER_BATCH': int(os.getenv('BULK_QUIZ_CHUNKS_PER_BATCH', '3')),
+    'MAX_QUESTIONS': int(os.getenv('BULK_QUIZ_MAX_QUESTIONS', '500')),
+    'DEDUPE_THRESHOLD': float(os.getenv('BULK_QUIZ_DEDUPE_THRESHOLD', '0.75')),
+}
+
+# Map-reduce over long PDFs for structuring and summarization (quiz_api.map_reduce)
+MAP_REDUCE = {
+    'PARALLELISM': int(os.getenv('MAP_REDUCE_PARALLELISM', '8')),
+    'CHUNK_TOKENS': int(os.getenv('MAP_CHUNK_TOKENS', '4000')),
+    'CHUNK_OVERLAP': int(os.getenv('MAP_CHUNK_OVERLAP', '200')),  # characters
+    'REDUCE_TOKEN_BUDGET': int(os.getenv('REDUCE_TOKEN_BUDGET', '16000')),
+}
+
+# Coalescing of identical in-flight quiz and equation requests (quiz_api.single_flight).
+# Workers on one host share leaders through lock files in DIRECTORY; set it empty to
+# coalesce within each worker only
+SINGLE_FLIGHT = {
+    'DIRECTORY': os.getenv('SINGLE_FLIGHT_DIR', str(BASE_DIR / 'single_flight')),
+    'WAIT_SECONDS': float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '120')),  # then duplicates run on their own
+}
+
+# Persisted MCQ bank behind /api/quiz/ (quiz_api.question_bank)
+QUESTION_BANK = {
+    'QUESTIONS_PER_QUIZ': int(os.getenv('QUIZ_QUESTIONS_PER_REQUEST', '10')),
+    # Most recent banked questions of a topic that new questions are deduplicated against
+    'DEDUPE_WINDOW': int(os.getenv('QUIZ_DEDUPE_WINDOW', '2000')),
+}
+
+# Multi-turn chat memory per session (quiz_api.conversation)
+CONVERSATION = {
+    # Exchanges kept verbatim; past MAX_TURNS the oldest are folded into the summary down to KEEP_TURNS
+    'MAX_TURNS': int(os.getenv('CHAT_MAX_TURNS', '8')),
+    'KEEP_TURNS': int(os.getenv('CHAT_KEEP_TURNS', '4')),
+    'SUMMARY_WORDS': int(os.getenv('CHAT_SUMMARY_WORDS', '200')),
+    'MAX_ANSWER_CHARS': int(os.getenv('CHAT_MAX_ANSWER_CHARS', '2000')),  # per answer kept in history
+    # Cosine similarity to the topic's query above which the previous turn's chunks are reused
+    'REUSE_THRESHOLD': float(os.getenv('CHAT_REUSE_THRESHOLD', '0.8')),
+    'IDLE_SECONDS': int(os.getenv('CHAT_IDLE_SECONDS', '86400')),  # idle conversations start over
+    # Gemini context caching only accepts prefixes of at least this many tokens
+    'CONTEXT_CACHE_MIN_TOKENS': int(os.getenv('CHAT_CONTEXT_CACHE_MIN_TOKENS', '32768')),
+    'CONTEXT_CACHE_TTL': int(os.getenv('CHAT_CONTEXT_CACHE_TTL', '600')),  # seconds
+}
+
+# S3 uploads: multipart transfers for server-side uploads, presigned direct-to-S3 uploads (quiz_api.upload)
+UPLOADS = {
+    'MULTIPART_THRESHOLD': int(os.getenv('UPLOAD_MULTIPART_THRESHOLD', str(16 * 1024 * 1024))),
+    'PART_SIZE': int(os.getenv('UPLOAD_PART_SIZE', str(16 * 1024 * 1024))),  # S3 minimum is 5 MiB
+    'CONCURRENCY': int(os.getenv('UPLOAD_CONCURRENCY', '8')),
+    'PRESIGN_EXPIRES': int(os.getenv('UPLOAD_PRESIGN_EXPIRES', '3600')),  # seconds
+    'TOKEN_MAX_AGE': int(os.getenv('UPLOAD_TOKEN_MAX_AGE', str(24 * 3600))),  # seconds to complete or abort
+    'MAX_SIZE': int(os.getenv('UPLOAD_MAX_SIZE', str(5 * 1024 ** 3))),
+}
+
+# Background jobs for PDF structuring, summarization and upload indexing (quiz_api.jobs)
+JOBS = {
+    'CONCURRENCY': int(os.getenv('JOB_CONCURRENCY', '2')),
+    'MAX_ATTEMPTS': int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+    'RETRY_BASE_SECONDS': float(os.getenv('JOB_RETRY_BASE_SECONDS', '5')),
+    # A running job's lease is renewed every HEARTBEAT_SECONDS; one not renewed for LEASE_SECONDS
+    # belongs to a dead worker and is requeued
+    'LEASE_SECONDS': int(os.getenv('JOB_LEASE_SECONDS', '120')),
+    'HEARTBEAT_SECONDS': float(os.getenv('JOB_HEARTBEAT_SECONDS', '30')),
+    'POLL_SECONDS': float(os.getenv('JOB_POLL_SECONDS', '1')),
+    # Finished jobs (and their results) are deleted this long after finishing, swept every PRUNE_SECONDS
+    'RETENTION_SECONDS': int(os.getenv('JOB_RETENTION_SECONDS', str(7 * 24 * 3600))),
+    'PRUNE_SECONDS': float(os.getenv('JOB_PRUNE_SECONDS', '3600')),
+    # Run workers inside the web process; set to 0 when using manage.py run_jobs instead
+    'RUN_IN_PROCESS': os.getenv('JOB_RUN_IN_PROCESS', '1') == '1',
+}
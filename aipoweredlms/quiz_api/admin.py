@@ -1,3 +1,30 @@
 from django.contrib import admin
+from .models import Conversation, Document, Job, MCQ
 
 # Register your models here.
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('id', 'pdf_digest')
+    exclude = ('input_text',)
+
+
+@admin.register(MCQ)
+class MCQAdmin(admin.ModelAdmin):
+    list_display = ('question', 'topic', 'difficulty', 'document', 'created_at')
+    list_filter = ('difficulty',)
+    search_fields = ('topic', 'question')
+    raw_id_fields = ('document', 'chunks')
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('session_key', 'course', 'document', 'updated_at')
+    search_fields = ('session_key',)
+    exclude = ('topic_embedding',)
+
+
+admin.site.register(Document)
@@ -1,6 +1,31 @@
+import os
+import sys
 from django.apps import AppConfig
 
 
+def _is_serving():
+    """True when running under a web server rather than a one-off manage.py command."""
+    argv = sys.argv
+    if not argv or not os.path.basename(argv[0]).startswith("manage"):
+        return True  # gunicorn, uvicorn, daphne, ...
+    if len(argv) > 1 and argv[1] == "runserver":
+        # The autoreloader parent process never serves requests
+        return os.environ.get("RUN_MAIN") == "true" or "--noreload" in argv
+    return False
+
+
 class QuizApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quiz_api'
+
+    def ready(self):
+        # Build the RAG index in the background so workers accept requests immediately
+        if _is_serving() and os.getenv("RAG_WARMUP_ON_START", "1") == "1":
+            from .ragchat import start_warmup
+            start_warmup()
+
+        # Process queued PDF jobs in this process unless dedicated run_jobs workers do it
+        from django.conf import settings
+        if _is_serving() and settings.JOBS['RUN_IN_PROCESS']:
+            from .jobs import start_workers
+            start_workers()
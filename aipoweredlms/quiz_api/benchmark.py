@@ -0,0 +1,124 @@
+import asyncio
+import random
+import time
+import numpy as np
+
+# Building blocks for the offline benchmark (manage.py benchmark): synthetic course PDFs,
+# latency percentiles, and a concurrent driver that calls the real views in-process.
+
+COURSE_TERMS = {
+    "ml": ["backpropagation", "gradient descent", "regularization", "overfitting", "activation function",
+           "convolution", "attention", "embedding", "loss function", "learning rate", "decision tree",
+           "random forest", "support vector machine", "clustering", "dropout", "batch normalization"],
+    "physics": ["momentum", "kinetic energy", "thermodynamics", "entropy", "electric field", "magnetic flux",
+                "wave interference", "refraction", "quantum tunnelling", "special relativity", "torque",
+                "angular momentum", "ideal gas law", "capacitance", "induction", "diffraction"],
+    "biology": ["photosynthesis", "mitosis", "meiosis", "enzyme kinetics", "cellular respiration", "natural selection",
+                "gene expression", "transcription", "translation", "homeostasis", "osmosis", "protein folding",
+                "immune response", "ecosystem", "nervous system", "hormone signalling"],
+}
+FILLER = ["describes", "depends on", "is measured by", "explains", "is related to", "changes with",
+          "is derived from", "limits", "improves", "is an example of"]
+
+
+def course_text(course, seed, words):
+    """Deterministic study-material prose about a course's terms, about words long."""
+    rng = random.Random(seed)
+    terms = COURSE_TERMS[course]
+    sentences, length = [], 0
+    while length < words:
+        sentence = f"{rng.choice(terms).capitalize()} {rng.choice(FILLER)} {rng.choice(terms)}"
+        if rng.random() < 0.5:
+            sentence += f" when {rng.choice(terms)} {rng.choice(FILLER)} {rng.choice(terms)}"
+        sentences.append(sentence + ".")
+        length += len(sentence.split())
+    return " ".join(sentences)
+
+
+def synthetic_pdf(course, index, pages=10, words_per_page=350):
+    """A text PDF of pages pages of course material; the same arguments always give the same bytes."""
+    import fitz
+    document = fitz.open()
+    for page_number in range(pages):
+        seed = f"{course}-{index}-{page_number}"
+        heading = f"Chapter {index}.{page_number + 1}: {random.Random(seed).choice(COURSE_TERMS[course]).title()}"
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), heading + "\n\n" + course_text(course, seed, words_per_page),
+                            fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def course_queries(count, seed=0):
+    """Student-style questions over the synthetic courses, as (course, question) pairs."""
+    rng = random.Random(seed)
+    templates = ["What is {0}?", "Explain how {0} relates to {1}.", "Give an example of {0}.",
+                 "Why does {0} matter for {1}?", "Compare {0} and {1}."]
+    queries = []
+    for _ in range(count):
+        course = rng.choice(sorted(COURSE_TERMS))
+        first, second = rng.sample(COURSE_TERMS[course], 2)
+        queries.append((course, rng.choice(templates).format(first, second)))
+    return queries
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean/max in milliseconds."""
+    if not len(seconds):
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+async def _timed_call(view, request):
+    """(status, seconds to first chunk or None, total seconds, failed) for one view call; streams are read to the end."""
+    start = time.perf_counter()
+    response = await view(request)
+    first_byte = None
+    failed = response.status_code >= 400
+    if getattr(response, "streaming", False):
+        async for chunk in response.streaming_content:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            if b"event: error" in (chunk if isinstance(chunk, bytes) else chunk.encode()):
+                failed = True
+    return response.status_code, first_byte, time.perf_counter() - start, failed
+
+
+async def drive(view, make_request, requests, concurrency):
+    """Calls view with make_request(i) for i in range(requests), concurrency at a time; returns endpoint stats."""
+    slots = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(i):
+        async with slots:
+            try:
+                results.append(await _timed_call(view, make_request(i)))
+            except Exception as e:
+                print(f"❌ Benchmark request failed: {e}")
+                results.append((None, None, 0.0, True))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    ok = [result for result in results if not result[3]]
+    stats = {
+        "requests": requests,
+        "ok": len(ok),
+        "errors": requests - len(ok),
+        "statuses": {str(status): sum(1 for r in results if r[0] == status) for status in {r[0] for r in results}},
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(requests / elapsed, 2) if elapsed else 0.0,
+        **latency_summary([total for _, _, total, _ in ok]),
+    }
+    first_bytes = [first for _, first, _, failed in ok if first is not None]
+    if first_bytes:
+        stats["first_byte"] = latency_summary(first_bytes)
+    return stats
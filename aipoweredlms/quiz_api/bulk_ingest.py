@@ -0,0 +1,179 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from collections import deque
+from .indexing import (
+    chunk_ids, chunk_metadata, is_unchanged, list_pdf_objects, load_manifest, manifest_lock,
+    object_fingerprint, retag_chunks, save_manifest,
+)
+from .keyword_index import open_keyword_index
+from .pdf_ingest import iter_pdf_chunks
+
+# Checkpoint the manifest every N ingested PDFs; rewriting it per PDF is quadratic on large buckets
+MANIFEST_SAVE_EVERY = 50
+
+
+def parse_pdf(key, pdf_bytes, text_splitter):
+    """Parses and chunks one PDF. Runs in a worker process, so it only takes picklable arguments."""
+    chunks = [
+        (chunk.page_content, chunk.metadata)
+        for chunk in iter_pdf_chunks(pdf_bytes, text_splitter, chunk_metadata(key))
+    ]
+    pages = {page for _, metadata in chunks for page in range(metadata["page"], metadata.get("page_end", metadata["page"]) + 1)}
+    return key, len(pages), chunks
+
+
+def download_pdf(s3_client, bucket_name, key):
+    return key, s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+
+
+def batches_of(texts, batch_size):
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def bulk_ingest(s3_client, bucket_name, vectorstore, embeddings, text_splitter, persist_directory,
+                prefix="pdfs/", download_workers=16, parse_workers=None, embed_batch_size=100,
+                embed_concurrency=4, max_in_flight=None, log=print):
+    """Brings the vector index in line with every PDF under prefix, using all cores.
+
+    Downloads run on a thread pool sharing one pooled S3 client, parsing and chunking
+    run on a process pool, and embeddings go out in batches with bounded concurrency.
+    The stages overlap as a pipeline: at most max_in_flight PDFs are downloading or
+    parsing at once (default: download_workers + 2 * parse_workers), so memory does not
+    grow with the bucket, and parsed chunks from several PDFs are pooled into full
+    embedding batches while later PDFs are still being fetched. Returns throughput stats.
+    """
+    start = time.perf_counter()
+    with manifest_lock(persist_directory):  # uploads indexed meanwhile wait, rather than be overwritten
+        retag_chunks(vectorstore, persist_directory)
+        manifest = load_manifest(persist_directory)
+        entries = manifest["objects"]
+        collection = vectorstore._collection
+        keyword_index = open_keyword_index(persist_directory)
+
+        if not entries and collection.count() > 0:
+            log("⚠️ Vector store has no manifest, rebuilding it from S3.")
+            vectorstore.reset_collection()
+            keyword_index.clear()
+            collection = vectorstore._collection
+
+        objects = list_pdf_objects(s3_client, bucket_name, prefix)
+        fingerprints = {obj["Key"]: object_fingerprint(obj, text_splitter) for obj in objects}
+        pending = [key for key, fingerprint in fingerprints.items() if not is_unchanged(entries.get(key), fingerprint)]
+        removed = [key for key in entries if key not in fingerprints]
+
+        stats = {
+            "listed": len(objects), "added": 0, "updated": 0, "removed": len(removed),
+            "failed": 0, "pages": 0, "chunks": 0,
+        }
+
+        # Forget stale entries before re-ingesting, so an interrupted run never leaves a
+        # manifest entry pointing at deleted vectors
+        updated = {key for key in pending if key in entries}
+        for key in removed + sorted(updated):
+            if entries[key]["ids"]:
+                vectorstore.delete(ids=entries[key]["ids"])
+                keyword_index.delete(entries[key]["ids"])
+            del entries[key]
+        if removed or updated:
+            save_manifest(persist_directory, manifest)
+
+        log(f"{len(objects)} PDFs listed, {len(pending)} to ingest, {len(removed)} removed")
+
+        parse_workers = parse_workers or os.cpu_count() or 1
+        window = max_in_flight or download_workers + 2 * parse_workers
+        group_texts = embed_batch_size * embed_concurrency  # one embedding round keeps every embed worker busy
+        queue = deque(pending)
+        in_flight = {}  # future -> (stage, payload)
+        parsed, parsed_texts = [], 0  # (key, pages, chunks) waiting for the next embedding round
+        open_pdfs = 0  # downloading or parsing
+        embedding_rounds = 0
+
+        def store(round_pdfs, vectors):
+            """Writes embedded PDFs to the index; a PDF only enters the manifest once all its chunks are in."""
+            offset = 0
+            for key, pages, chunks in round_pdfs:
+                texts = [text for text, _ in chunks]
+                ids = chunk_ids(key, len(chunks))
+                if chunks:
+                    collection.upsert(ids=ids, embeddings=vectors[offset:offset + len(chunks)], documents=texts,
+                                      metadatas=[metadata for _, metadata in chunks])
+                    keyword_index.add(ids, texts)
+                    offset += len(chunks)
+
+                stats["updated" if key in updated else "added"] += 1
+                stats["pages"] += pages
+                stats["chunks"] += len(chunks)
+                entries[key] = {**fingerprints[key], "ids": ids}
+                if (stats["added"] + stats["updated"]) % MANIFEST_SAVE_EVERY == 0:
+                    save_manifest(persist_directory, manifest)
+
+        try:
+            with ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+                    ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+                    ThreadPoolExecutor(max_workers=embed_concurrency) as embed_pool:
+
+                def embed_parsed():
+                    """Starts an embedding round over every parsed PDF, batching chunks across PDF boundaries."""
+                    nonlocal parsed, parsed_texts, embedding_rounds
+                    round_pdfs, parsed, parsed_texts = parsed, [], 0
+                    batches = batches_of([text for _, _, chunks in round_pdfs for text, _ in chunks], embed_batch_size)
+                    if not batches:
+                        store(round_pdfs, [])
+                        return
+                    embedding_round = {"pdfs": round_pdfs, "vectors": [None] * len(batches), "left": len(batches)}
+                    for index, batch in enumerate(batches):
+                        in_flight[embed_pool.submit(embeddings.embed_documents, batch)] = ("embed", (embedding_round, index))
+                    embedding_rounds += 1
+
+                def top_up():
+                    # Embedding is the back-pressure point: no new downloads while two rounds are outstanding
+                    nonlocal open_pdfs
+                    while queue and open_pdfs < window and embedding_rounds < 2:
+                        key = queue.popleft()
+                        in_flight[download_pool.submit(download_pdf, s3_client, bucket_name, key)] = ("download", key)
+                        open_pdfs += 1
+
+                top_up()
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage, payload = in_flight.pop(future)
+                        if stage in ("download", "parse"):
+                            try:
+                                result = future.result()
+                            except Exception as e:  # one bad PDF must not abort the whole run
+                                open_pdfs -= 1
+                                stats["failed"] += 1
+                                log(f"⚠️ Skipping {payload} ({stage} failed): {e}")
+                                continue
+                        if stage == "download":
+                            key, pdf_bytes = result
+                            in_flight[parse_pool.submit(parse_pdf, key, pdf_bytes, text_splitter)] = ("parse", key)
+                        elif stage == "parse":
+                            open_pdfs -= 1
+                            parsed.append(result)
+                            parsed_texts += len(parsed[-1][2])
+                            if parsed_texts >= group_texts:
+                                embed_parsed()
+                        else:
+                            embedding_round, index = payload
+                            embedding_round["vectors"][index] = future.result()
+                            embedding_round["left"] -= 1
+                            if not embedding_round["left"]:
+                                embedding_rounds -= 1
+                                store(embedding_round["pdfs"], [vector for batch in embedding_round["vectors"] for vector in batch])
+                    if parsed and not queue and not open_pdfs:
+                        embed_parsed()  # the last, partial round
+                    top_up()
+        finally:
+            # Keep whatever was stored before an error; skipped PDFs stay out of the manifest and are retried next run
+            if pending or removed:
+                manifest["version"] += 1
+                save_manifest(persist_directory, manifest)
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 3)
+    stats["pages_per_sec"] = round(stats["pages"] / elapsed, 1) if elapsed else 0.0
+    stats["chunks_per_sec"] = round(stats["chunks"] / elapsed, 1) if elapsed else 0.0
+    return stats
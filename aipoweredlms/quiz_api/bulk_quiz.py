@@ -0,0 +1,155 @@
+import asyncio
+import math
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .concurrency import llm_slot
+from .keyword_index import tokenize
+from .metrics import span
+from .ragchat import _aparse_mcq_response, astream_mcq_reply, require_pipeline, scoped_retriever
+from .structured_output import count as count_output
+
+DIFFICULTIES = ("Easy", "Medium", "Hard")
+
+
+def parse_difficulties(value):
+    """Accepts a list or comma-separated string of difficulties; defaults to all three."""
+    if not value:
+        return list(DIFFICULTIES)
+    names = value.split(",") if isinstance(value, str) else value
+    difficulties = []
+    for name in names:
+        difficulty = str(name).strip().capitalize()
+        if difficulty not in DIFFICULTIES:
+            raise ValueError(f"Unknown difficulty: {name}")
+        if difficulty not in difficulties:
+            difficulties.append(difficulty)
+    return difficulties
+
+
+# Question stems every MCQ shares; they carry no signal about what is being asked
+QUESTION_STOPWORDS = frozenset("following best describes describe true false correct statement not".split())
+
+
+def question_terms(text):
+    return frozenset(term for term in tokenize(text) if term not in QUESTION_STOPWORDS)
+
+
+class McqDeduper:
+    """Drops MCQs whose question repeats, or nearly repeats, one already accepted.
+
+    Questions are compared as sets of content words (Jaccard similarity), so
+    "Which best describes mitosis?" and "... meiosis?" both survive.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.kept_terms = []
+
+    def is_duplicate(self, terms):
+        for other in self.kept_terms:
+            if terms == other or len(terms & other) / len(terms | other) >= self.threshold:
+                return True
+        return False
+
+    def filter(self, mcqs):
+        kept = []
+        for mcq in mcqs:
+            terms = question_terms(str(mcq.get("question", "")))
+            if not terms or self.is_duplicate(terms):
+                continue
+            self.kept_terms.append(terms)
+            kept.append(mcq)
+        return kept
+
+
+def plan_batches(topic, difficulties, count, course=None, document=None):
+    """Retrieves a diverse chunk pool for the topic and splits the work into (difficulty, context, size) batches.
+
+    Batches cycle through the difficulties, and each difficulty cycles through
+    different chunk groups, so parallel batches ask about different material.
+    """
+    options = settings.BULK_QUIZ
+    batch_size = options['BATCH_SIZE']
+    chunks_per_batch = options['CHUNKS_PER_BATCH']
+    batch_count = math.ceil(count / batch_size)
+    pool_size = math.ceil(batch_count / len(difficulties)) * chunks_per_batch
+
+    retriever = scoped_retriever(course, document)
+    retriever = retriever.model_copy(update={"max_chunks": pool_size, "fetch_k": max(pool_size * 2, retriever.fetch_k)})
+    docs = retriever.candidates(topic)
+    if not docs:
+        return []
+
+    groups = ["\n\n".join(doc.page_content for doc in docs[i:i + chunks_per_batch])
+              for i in range(0, len(docs), chunks_per_batch)]
+    return [
+        (
+            difficulties[i % len(difficulties)],
+            groups[(i // len(difficulties)) % len(groups)],
+            min(batch_size, count - i * batch_size),
+        )
+        for i in range(batch_count)
+    ]
+
+
+async def _generate_batch(pipeline, semaphore, topic, difficulty, context, size):
+    """One bulk MCQ call; an unusable reply is retried once without holding up other batches.
+
+    semaphore caps this request's parallel batches; each running batch also takes a worker-wide
+    LLM slot, so a bulk quiz counts against LLM_MAX_CONCURRENCY once per Gemini call.
+    """
+    async with semaphore, llm_slot():
+        for attempt in range(2):
+            try:
+                messages = await pipeline.bulk_mcq_prompt.ainvoke({
+                    "topic": topic,
+                    "context": context,
+                    "difficulty": difficulty,
+                    "count": size,
+                })
+                reply = await astream_mcq_reply(pipeline, messages)
+                mcqs = await _aparse_mcq_response(pipeline, messages, reply.text, reply.mcqs)
+                if mcqs:
+                    return difficulty, mcqs
+                count_output("full_retries")
+                print(f"⚠️ Invalid MCQ batch format. Retrying... ({attempt+1}/2)")
+            except Exception as e:
+                print(f"❌ MCQ batch failed: {e}")
+                break
+    return difficulty, []
+
+
+async def astream_bulk_quiz(topic, difficulties, count, course=None, document=None):
+    """Generates MCQ batches in parallel and yields each one, deduplicated, as soon as it completes."""
+    pipeline = require_pipeline()
+    options = settings.BULK_QUIZ
+    with span("retrieve"):
+        batches = await sync_to_async(plan_batches, thread_sensitive=False)(topic, difficulties, count, course, document)
+    if not batches:
+        print(f"❌ No relevant content found for topic: {topic}")
+        return
+
+    semaphore = asyncio.Semaphore(options['PARALLELISM'])
+    deduper = McqDeduper(options['DEDUPE_THRESHOLD'])
+    tasks = [
+        asyncio.ensure_future(_generate_batch(pipeline, semaphore, topic, difficulty, context, size))
+        for difficulty, context, size in batches
+    ]
+    try:
+        for next_batch in asyncio.as_completed(tasks):
+            difficulty, mcqs = await next_batch
+            mcqs = deduper.filter(mcqs)
+            if mcqs:
+                yield {"difficulty": difficulty, "mcqs": mcqs}
+    finally:
+        # The client may disconnect mid-stream; stop paying for batches nobody will read
+        for task in tasks:
+            task.cancel()
+
+
+async def aget_bulk_quiz(topic, difficulties, count, course=None, document=None):
+    """Collects every batch from astream_bulk_quiz into one deduplicated MCQ list."""
+    mcqs = []
+    async for batch in astream_bulk_quiz(topic, difficulties, count, course, document):
+        mcqs.extend(batch["mcqs"])
+    return mcqs
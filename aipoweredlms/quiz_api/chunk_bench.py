@@ -0,0 +1,81 @@
+import random
+import re
+import time
+import numpy as np
+from .pdf_ingest import extract_text, iter_pdf_chunks, open_pdf
+
+# Chunker comparison on real PDFs (manage.py bench_chunkers): index size and how often
+# retrieval finds the passage a question was written from. Queries are whole sentences
+# sampled from each PDF's text blocks (so none runs into a page number, caption or
+# heading); a query hits when a retrieved chunk contains its sentence.
+SENTENCE = re.compile(r"(?<=[.?!])\s+(?=[A-Z])")
+CHARS_PER_TOKEN = 4
+
+
+def normalize(text):
+    """Lowercase alphanumerics only, so hyphenation, spacing and reading order do not matter."""
+    return re.sub(r"[^a-z0-9]+", "", text.lower())
+
+
+def sample_queries(pdfs, per_pdf, seed=0):
+    """(name, sentence) pairs: complete prose sentences of 8-40 words from each PDF."""
+    rng = random.Random(seed)
+    queries = []
+    for name, data in pdfs:
+        with open_pdf(data) as doc:
+            blocks = [re.sub(r"\s+", " ", block[4]).strip() for page in doc for block in page.get_text("blocks")]
+        sentences = [s for block in blocks for s in SENTENCE.split(block)
+                     if 8 <= len(s.split()) <= 40 and s[:1].isupper() and s.endswith((".", "?", "!"))
+                     and sum(c.isalpha() for c in s) > 0.7 * len(s)]
+        queries += [(name, sentence) for sentence in rng.sample(sentences, min(per_pdf, len(sentences)))]
+    return queries
+
+
+def chunk_corpus(pdfs, text_splitter):
+    """All chunks of the corpus as (name, text) and the seconds spent chunking."""
+    start = time.perf_counter()
+    chunks = [(name, chunk.page_content) for name, data in pdfs
+              for chunk in iter_pdf_chunks(data, text_splitter, {"source": name})]
+    return chunks, time.perf_counter() - start
+
+
+def compare(pdfs, text_splitter, embeddings, queries, k, budget_chars):
+    """Index size and retrieval hit rates for one chunker."""
+    chunks, seconds = chunk_corpus(pdfs, text_splitter)
+    texts = [text for _, text in chunks]
+    lengths = np.array([len(text) for text in texts])
+    source_chars = sum(len(normalize(extract_text(data))) for _, data in pdfs)
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query_vectors = np.asarray(embeddings.embed_documents([sentence for _, sentence in queries]), dtype=np.float32)
+    query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    ranked = np.argsort(-(query_vectors @ vectors.T), axis=1)
+    normalized = [normalize(text) for text in texts]
+
+    covered = hits = budget_hits = 0
+    for (_, sentence), order in zip(queries, ranked):
+        needle = normalize(sentence)
+        covered += any(needle in text for text in normalized)  # ceiling: the sentence survived chunking intact
+        hits += any(needle in normalized[i] for i in order[:k])
+        # Same prompt size for every chunker: as many top chunks as fit RAG_CONTEXT's token budget
+        used = 0
+        for i in order:
+            if used and used + lengths[i] > budget_chars:
+                break
+            used += lengths[i]
+            if needle in normalized[i]:
+                budget_hits += 1
+                break
+    return {
+        "chunks": len(texts),
+        "chars": int(lengths.sum()),
+        "est_tokens": int(lengths.sum()) // CHARS_PER_TOKEN,
+        "mean_chars": round(float(lengths.mean()), 1),
+        "max_chars": int(lengths.max()),
+        "duplication": round(sum(len(text) for text in normalized) / source_chars, 3),
+        "index_mb": round((lengths.sum() + vectors.nbytes) / 2**20, 2),
+        "chunk_seconds": round(seconds, 3),
+        "coverage": round(covered / len(queries), 3),
+        f"hit_at_{k}": round(hits / len(queries), 3),
+        "hit_at_budget": round(budget_hits / len(queries), 3),
+    }
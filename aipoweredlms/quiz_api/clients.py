@@ -0,0 +1,314 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Process-wide clients for Gemini and S3: one pooled S3 client, one handle per Gemini
+# model, and per-model rate limiting and circuit breaking so bursts queue instead of
+# piling failed requests onto an overloaded provider.
+GEMINI_RPM = {
+    "gemini-1.5-pro": float(os.getenv("GEMINI_PRO_RPM", "60")),
+    "gemini-1.5-flash": float(os.getenv("GEMINI_FLASH_RPM", "300")),
+}
+DEFAULT_RPM = float(os.getenv("GEMINI_DEFAULT_RPM", "60"))
+# Longest a call queues for a rate-limit token before the request is turned away
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+RETRY_ATTEMPTS = int(os.getenv("GEMINI_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_SECONDS = 20
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+
+TRANSIENT_ERRORS = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+                    "InternalServerError", "DeadlineExceeded", "GatewayTimeout")
+
+
+class ServiceBusy(Exception):
+    """Raised instead of calling a provider that is rate limited or failing; retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limited(error):
+    """True if the error (or anything it wraps) is a 429 / quota-exhausted response."""
+    while error is not None:
+        if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+            return True
+        message = str(error)
+        if "429" in message or "quota" in message.lower() or "rate limit" in message.lower():
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def is_transient(error):
+    """True for errors worth retrying: rate limits, 5xx responses, timeouts and dropped connections."""
+    if is_rate_limited(error) or isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERRORS
+
+
+def backoff_delay(attempt, base=None):
+    """Exponential backoff with full jitter, so retrying callers do not hit the provider in lockstep."""
+    return random.uniform(0, min((base or RETRY_BASE_SECONDS) * 2 ** attempt, RETRY_MAX_SECONDS))
+
+
+class TokenBucket:
+    """Requests-per-minute limiter. Callers reserve the next free slot and wait for it in
+    arrival order; a caller that would wait longer than max_wait is refused instead."""
+
+    def __init__(self, rate_per_minute, burst=None, max_wait=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1.0, self.rate * 5)
+        self.max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """Takes a token; returns the seconds to wait before using it, or raises ServiceBusy."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                raise ServiceBusy("Too many requests to the AI provider, please retry shortly.", wait)
+            self.tokens -= 1
+        return wait
+
+    # acquire / aacquire follow LangChain's BaseRateLimiter interface
+    def acquire(self, *, blocking=True):
+        try:
+            wait = self.reserve(None if blocking else 0)
+        except ServiceBusy:
+            if blocking:
+                raise
+            return False
+        time.sleep(wait)
+        return True
+
+    async def aacquire(self, *, blocking=True):
+        try:
+            wait = self.reserve(None if blocking else 0)
+        except ServiceBusy:
+            if blocking:
+                raise
+            return False
+        await asyncio.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """Stops calling a provider after consecutive transient failures; one trial call is let
+    through every reset_seconds, and any answer from the provider closes the circuit again."""
+
+    def __init__(self, failures=None, reset_seconds=None):
+        self.failure_threshold = failures or BREAKER_FAILURES
+        self.reset_seconds = reset_seconds or BREAKER_RESET_SECONDS
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None  # when the current trial call started
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            since = self.opened_at if self._trial_at is None else max(self.opened_at, self._trial_at)
+            remaining = since + self.reset_seconds - now
+            if remaining > 0:
+                raise ServiceBusy("The AI provider is failing, please retry shortly.", max(remaining, 1))
+            self._trial_at = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_at = None
+
+    def record_failure(self, error):
+        if isinstance(error, ServiceBusy):
+            return  # turned away locally; says nothing about the provider
+        if not is_transient(error):
+            # The provider answered, it just rejected this request
+            self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            if self._trial_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"⚠️ Circuit opened after {self.failures} failures: {error}")
+                self.opened_at = time.monotonic()
+                self._trial_at = None
+
+
+_lock = threading.Lock()
+_limiters = {}
+_breakers = {}
+_models = {}
+_s3_client = None
+_genai_configured = False
+
+
+def rate_limiter(model_name):
+    with _lock:
+        if model_name not in _limiters:
+            _limiters[model_name] = TokenBucket(GEMINI_RPM.get(model_name, DEFAULT_RPM))
+        return _limiters[model_name]
+
+
+def circuit_breaker(model_name):
+    with _lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker()
+        return _breakers[model_name]
+
+
+def _guarded(model_name, call):
+    """Runs call() behind the model's breaker and rate limiter, retrying transient errors."""
+    limiter, breaker = rate_limiter(model_name), circuit_breaker(model_name)
+    for attempt in range(RETRY_ATTEMPTS):
+        breaker.before_call()
+        limiter.acquire()
+        try:
+            result = call()
+        except Exception as e:
+            breaker.record_failure(e)
+            if attempt == RETRY_ATTEMPTS - 1 or not is_transient(e):
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        breaker.record_success()
+        return result
+
+
+async def _aguarded(model_name, call):
+    """Async variant of _guarded; call is a coroutine function."""
+    limiter, breaker = rate_limiter(model_name), circuit_breaker(model_name)
+    for attempt in range(RETRY_ATTEMPTS):
+        breaker.before_call()
+        await limiter.aacquire()
+        try:
+            result = await call()
+        except Exception as e:
+            breaker.record_failure(e)
+            if attempt == RETRY_ATTEMPTS - 1 or not is_transient(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        breaker.record_success()
+        return result
+
+
+class GeminiModel:
+    """A shared google.generativeai model handle whose calls are rate limited, retried and circuit broken.
+
+    For streamed calls only opening the stream is retried.
+    """
+
+    def __init__(self, model_name, handle):
+        self.model_name = model_name
+        self.handle = handle
+
+    def generate_content(self, contents, **kwargs):
+        return _guarded(self.model_name, lambda: self.handle.generate_content(contents, **kwargs))
+
+    async def generate_content_async(self, contents, **kwargs):
+        return await _aguarded(self.model_name, lambda: self.handle.generate_content_async(contents, **kwargs))
+
+
+def gemini_model(model_name="gemini-1.5-pro"):
+    """Returns the process-wide GeminiModel for model_name; genai is imported and configured on first use."""
+    global _genai_configured
+    with _lock:
+        if model_name not in _models:
+            import google.generativeai as genai
+            if not _genai_configured:
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                _genai_configured = True
+            _models[model_name] = GeminiModel(model_name, genai.GenerativeModel(model_name))
+        return _models[model_name]
+
+
+def use_model_handle(model_name, handle):
+    """Serves model_name from handle (anything with generate_content / generate_content_async),
+    e.g. a fake for offline benchmarks; calls still go through the model's limiter and breaker."""
+    with _lock:
+        _models[model_name] = GeminiModel(model_name, handle)
+
+
+def chat_model_guards(model_name):
+    """rate_limiter and callbacks kwargs that put a LangChain chat model behind the same limiter and breaker."""
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.rate_limiters import BaseRateLimiter
+
+    limiter, breaker = rate_limiter(model_name), circuit_breaker(model_name)
+
+    class SharedRateLimiter(BaseRateLimiter):
+        def acquire(self, *, blocking=True):
+            return limiter.acquire(blocking=blocking)
+
+        async def aacquire(self, *, blocking=True):
+            return await limiter.aacquire(blocking=blocking)
+
+    class BreakerCallback(BaseCallbackHandler):
+        raise_error = True  # lets before_call's ServiceBusy abort the request
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            breaker.before_call()
+
+        def on_llm_end(self, response, **kwargs):
+            breaker.record_success()
+
+        def on_llm_error(self, error, **kwargs):
+            breaker.record_failure(error)
+
+    return {"rate_limiter": SharedRateLimiter(), "callbacks": [BreakerCallback()]}
+
+
+def s3_client():
+    """Returns the process-wide S3 client (boto3 clients are thread-safe) with a connection pool
+    sized for concurrent uploads and downloads, and adaptive retries."""
+    global _s3_client
+    with _lock:
+        if _s3_client is None:
+            import boto3
+            from botocore.config import Config
+            _s3_client = boto3.session.Session().client(
+                's3',
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                              retries={'max_attempts': 5, 'mode': 'adaptive'}),
+            )
+        return _s3_client
+
+
+def client_stats():
+    """Limiter and breaker state per model, for /api/rag_status/."""
+    with _lock:
+        names = sorted(set(_limiters) | set(_breakers))
+    return {
+        name: {
+            "rpm": rate_limiter(name).rate * 60,
+            "circuit": circuit_breaker(name).state,
+            "consecutive_failures": circuit_breaker(name).failures,
+        }
+        for name in names
+    }
@@ -0,0 +1,23 @@
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from django.conf import settings
+
+# One semaphore per event loop: each ASGI worker runs its own loop
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Limits how many LLM-bound requests a worker runs at once; the rest wait their turn."""
+    async with _get_semaphore():
+        yield
@@ -0,0 +1,170 @@
+import re
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from .indexing import scope_filter
+from .keyword_index import is_lexical_query
+from .metrics import span
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def is_near_duplicate(shingles, kept_shingles, threshold):
+    """True if the chunk mostly repeats one already kept (Jaccard or containment)."""
+    for other in kept_shingles:
+        overlap = len(shingles & other)
+        if not overlap:
+            continue
+        if overlap / len(shingles | other) >= threshold or overlap / len(shingles) >= threshold:
+            return True
+    return False
+
+
+def trim_overlap(neighbour, text, probe=50, window=600):
+    """Strips the part of text that repeats neighbour because of the splitter's chunk_overlap.
+
+    Handles both orders: text continuing after neighbour, and text running into it.
+    """
+    if len(neighbour) < probe or len(text) < probe:
+        return text
+
+    position = text.find(neighbour[-probe:], 0, window + probe)
+    if position != -1:
+        overlap = position + probe
+        if text[:overlap] == neighbour[-overlap:]:
+            return text[overlap:].lstrip()
+
+    position = text.find(neighbour[:probe], max(len(text) - window - probe, 0))
+    if position != -1 and neighbour.startswith(text[position:]):
+        return text[:position].rstrip()
+    return text
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merges ranked ID lists into one ranking by summing 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def build_context(docs, token_budget, dedupe_threshold=0.8):
+    """Drops near-duplicates and splitter overlap, then packs docs in rank order into the token budget."""
+    kept, kept_shingles, used = [], [], 0
+    page_texts = {}  # (source, page) -> original texts of kept chunks from that page
+
+    for doc in docs:
+        text = doc.page_content
+        location = (doc.metadata.get("source"), doc.metadata.get("page"))
+        for neighbour in page_texts.get(location, []):
+            text = trim_overlap(neighbour, text)
+        if not text.strip():
+            continue
+
+        shingles = _shingles(text)
+        if is_near_duplicate(shingles, kept_shingles, dedupe_threshold):
+            continue
+
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            continue  # a smaller, lower-ranked chunk may still fit
+
+        kept.append(Document(page_content=text, metadata=doc.metadata, id=doc.id))
+        kept_shingles.append(shingles)
+        page_texts.setdefault(location, []).append(doc.page_content)
+        used += tokens
+
+    return kept
+
+
+class BudgetedRetriever(BaseRetriever):
+    """Over-fetches by vector similarity, diversifies with MMR and returns a token-budgeted context.
+
+    Replaces a plain top-k similarity retriever, which stuffs every overlapping
+    3000-character chunk into the prompt. With a keyword index, BM25 hits are fused
+    in by reciprocal rank, and lexical look-ups skip the embedding call entirely.
+    Setting course and/or document limits both searches to that slice of the corpus.
+    """
+
+    vectorstore: VectorStore
+    fetch_k: int = 40
+    max_chunks: int = 15
+    lambda_mult: float = 0.5
+    token_budget: int = 3000
+    dedupe_threshold: float = 0.8
+    keyword_index: Optional[Any] = None
+    rrf_k: int = 60
+    course: Optional[str] = None
+    document: Optional[str] = None
+    search_kwargs: Dict[str, Any] = {}
+
+    def scoped(self, course=None, document=None):
+        """Copy of this retriever restricted to a course and/or document."""
+        if not course and not document:
+            return self
+        return self.model_copy(update={"course": course or None, "document": document or None})
+
+    def vector_candidates(self, query, embedding=None):
+        """MMR-selected candidates for the query, in similarity order."""
+        search_kwargs = dict(self.search_kwargs)
+        scope = scope_filter(self.course, self.document)
+        if scope:
+            search_kwargs["filter"] = scope
+        if embedding is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+        return self.vectorstore.max_marginal_relevance_search_by_vector(
+            embedding, k=self.max_chunks, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+            **search_kwargs,
+        )
+
+    def fetch_by_ids(self, ids):
+        """Loads chunks from the vector store by ID, keeping the given order."""
+        if not ids:
+            return []
+        found = self.vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        docs = {
+            doc_id: Document(page_content=text, metadata=metadata or {}, id=doc_id)
+            for doc_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+    def context_for_ids(self, ids):
+        """Token-budgeted context from chunks retrieved earlier, e.g. on a previous turn of a conversation."""
+        return build_context(self.fetch_by_ids(ids), self.token_budget, self.dedupe_threshold)
+
+    def candidates(self, query, embedding=None):
+        """Ranked candidates: vector MMR results, fused with BM25 hits when a keyword index is set."""
+        if self.keyword_index is None or self.search_kwargs:
+            # Arbitrary metadata filters only apply to the vector store
+            return self.vector_candidates(query, embedding)
+
+        with span("keyword"):
+            hits = self.keyword_index.search(query, self.fetch_k, course=self.course, document=self.document)
+        lexical_ids = [doc_id for doc_id, _ in hits]
+        if lexical_ids and is_lexical_query(query):
+            return self.fetch_by_ids(lexical_ids[:self.max_chunks])
+
+        vector_docs = self.vector_candidates(query, embedding)
+        fused = reciprocal_rank_fusion([[doc.id for doc in vector_docs], lexical_ids], self.rrf_k)[:self.max_chunks]
+        by_id = {doc.id: doc for doc in vector_docs}
+        missing = self.fetch_by_ids([doc_id for doc_id in fused if doc_id not in by_id])
+        by_id.update((doc.id, doc) for doc in missing)
+        return [by_id[doc_id] for doc_id in fused if doc_id in by_id]
+
+    def context(self, query, embedding=None):
+        """Token-budgeted context for query; pass the query's embedding if the caller already has it."""
+        return build_context(self.candidates(query, embedding), self.token_budget, self.dedupe_threshold)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.context(query)
@@ -0,0 +1,209 @@
+import re
+import threading
+from datetime import timedelta
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .context_builder import estimate_tokens
+from .metrics import span
+from .models import Conversation
+
+# Session memory for multi-turn chat: a bounded window of recent exchanges plus a rolling
+# summary of older ones, standalone rewrites of follow-up questions for retrieval, reuse of
+# the previous turn's chunks while the topic holds, and Gemini context caching of the
+# system prompt + chunks prefix when it is large enough to qualify.
+
+# Messages that lean on earlier turns ("explain that with an example", "why?")
+FOLLOW_UP = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|he|she|above|previous|earlier|same|"
+    r"more|again|another|example|examples|elaborate|further|else|also|why|how so)\b",
+    re.IGNORECASE,
+)
+SHORT_PROMPT_WORDS = 5
+
+REWRITE_PROMPT = """Rewrite the student's latest message as a standalone question that can be understood without the conversation, for searching their study material.
+Keep it short and keep the student's wording where possible. Return only the question.
+
+Conversation so far:
+{history}
+
+Latest message: {prompt}"""
+
+SUMMARY_PROMPT = """Update the running summary of a tutoring conversation with the exchanges below.
+Keep the topics covered, what the student found difficult, and definitions or examples already given, in at most {words} words. Return only the summary.
+
+Current summary:
+{summary}
+
+New exchanges:
+{exchanges}"""
+
+_stats_lock = threading.Lock()
+_stats = {
+    "turns": 0,
+    "rewrites": 0,              # follow-ups rewritten into standalone queries
+    "chunks_reused": 0,         # turns answered from the previous turn's chunks, without retrieval
+    "retrievals": 0,
+    "summaries": 0,             # times older exchanges were folded into the summary
+    "context_cache_hits": 0,    # turns that sent only history + question on top of a cached prefix
+    "context_cache_created": 0,
+}
+
+
+def count(event, n=1):
+    with _stats_lock:
+        _stats[event] += n
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _load(session_key, course, document):
+    conversation, _ = Conversation.objects.get_or_create(session_key=session_key)
+    idle = timedelta(seconds=settings.CONVERSATION['IDLE_SECONDS'])
+    stale = conversation.turns and conversation.updated_at < timezone.now() - idle
+    if stale or (conversation.course, conversation.document) != (course or "", document or ""):
+        reset(conversation)
+        conversation.course, conversation.document = course or "", document or ""
+    return conversation
+
+
+async def aload(session_key, course=None, document=None):
+    """The session's conversation, started afresh if its scope changed or it sat idle too long."""
+    return await sync_to_async(_load)(session_key, course, document)
+
+
+def reset(conversation):
+    conversation.summary = ""
+    conversation.turns = []
+    forget_chunks(conversation)
+
+
+def forget_chunks(conversation):
+    conversation.chunk_ids = []
+    conversation.topic_embedding = []
+    conversation.index_version = 0
+    conversation.context_cache = ""
+    conversation.context_cache_expires = None
+
+
+def has_history(conversation):
+    return bool(conversation.turns or conversation.summary)
+
+
+def history_messages(conversation):
+    """Summary and recent exchanges as chat messages, oldest first."""
+    from langchain_core.messages import AIMessage, HumanMessage
+    messages = []
+    if conversation.summary:
+        messages += [HumanMessage(content=f"Summary of our conversation so far:\n{conversation.summary}"),
+                     AIMessage(content="Understood, I will keep that in mind.")]
+    for turn in conversation.turns:
+        messages += [HumanMessage(content=turn["user"]), AIMessage(content=turn["assistant"])]
+    return messages
+
+
+def _history_text(turns, summary=""):
+    lines = [f"(Earlier: {summary})"] if summary else []
+    for turn in turns:
+        lines += [f"Student: {turn['user']}", f"Tutor: {turn['assistant'][:600]}"]
+    return "\n".join(lines)
+
+
+def is_follow_up(prompt):
+    return len(prompt.split()) <= SHORT_PROMPT_WORDS or bool(FOLLOW_UP.search(prompt))
+
+
+async def arewrite_query(llm, conversation, prompt):
+    """The query to retrieve with: follow-ups are rewritten into standalone questions, anything else is kept."""
+    if not has_history(conversation) or not is_follow_up(prompt):
+        return prompt
+    try:
+        with span("rewrite"):
+            message = await llm.ainvoke(REWRITE_PROMPT.format(
+                history=_history_text(conversation.turns[-2:], conversation.summary), prompt=prompt))
+    except Exception as e:
+        print(f"⚠️ Could not rewrite follow-up, retrieving with it as asked: {e}")
+        return prompt
+    rewritten = message.content.strip().strip('"')
+    if not rewritten:
+        return prompt
+    count("rewrites")
+    return rewritten
+
+
+def can_reuse_chunks(conversation, embedding, version):
+    """True if the query is still on the topic the conversation's chunks were retrieved for."""
+    if not conversation.chunk_ids or conversation.index_version != version or not conversation.topic_embedding:
+        return False
+    topic, query = np.asarray(conversation.topic_embedding), np.asarray(embedding)
+    similarity = float(topic @ query / (np.linalg.norm(topic) * np.linalg.norm(query) or 1))
+    return similarity >= settings.CONVERSATION['REUSE_THRESHOLD']
+
+
+def remember_chunks(conversation, docs, embedding, version):
+    """Records freshly retrieved chunks as the conversation's current topic."""
+    forget_chunks(conversation)
+    conversation.chunk_ids = [doc.id for doc in docs if doc.id]
+    conversation.topic_embedding = [float(x) for x in embedding]
+    conversation.index_version = version
+
+
+async def acontext_cache(llm, conversation, system_message):
+    """Name of a Gemini cached content holding system_message (prompt + chunks), or None.
+
+    A cache is created once per topic and reused while the chunks are; prefixes below
+    Gemini's minimum cacheable size are sent as usual.
+    """
+    options = settings.CONVERSATION
+    if estimate_tokens(system_message.content) < options['CONTEXT_CACHE_MIN_TOKENS']:
+        return None
+    now = timezone.now()
+    if conversation.context_cache and conversation.context_cache_expires and conversation.context_cache_expires > now:
+        count("context_cache_hits")
+        return conversation.context_cache
+    try:
+        name = await sync_to_async(llm.create_cached_content)([system_message], ttl=options['CONTEXT_CACHE_TTL'])
+    except Exception as e:
+        print(f"⚠️ Could not cache chat context, sending it in full: {e}")
+        return None
+    # Renewed a little early so a turn never references a cache that just expired
+    conversation.context_cache = name
+    conversation.context_cache_expires = now + timedelta(seconds=options['CONTEXT_CACHE_TTL'] * 0.9)
+    count("context_cache_created")
+    return name
+
+
+async def _afold_history(llm, conversation):
+    """Folds the oldest exchanges into the summary once the window is full."""
+    options = settings.CONVERSATION
+    if len(conversation.turns) <= options['MAX_TURNS']:
+        return
+    old, recent = conversation.turns[:-options['KEEP_TURNS']], conversation.turns[-options['KEEP_TURNS']:]
+    try:
+        with span("summarize"):
+            message = await llm.ainvoke(SUMMARY_PROMPT.format(
+                words=options['SUMMARY_WORDS'], summary=conversation.summary or "(none yet)",
+                exchanges=_history_text(old)))
+        summary = message.content.strip()
+    except Exception as e:
+        # Keep the window bounded anyway; the summary catches up on the next fold
+        print(f"⚠️ Could not summarize conversation, dropping its oldest turns: {e}")
+        conversation.turns = conversation.turns[-options['MAX_TURNS']:]
+        return
+    if summary:
+        conversation.summary = summary
+        conversation.turns = recent
+        count("summaries")
+
+
+async def arecord_turn(llm, conversation, prompt, answer):
+    """Appends an exchange, folds old ones into the summary when needed, and saves the conversation."""
+    conversation.turns = conversation.turns + [
+        {"user": prompt, "assistant": answer[:settings.CONVERSATION['MAX_ANSWER_CHARS']]}]
+    await _afold_history(llm, conversation)
+    count("turns")
+    await sync_to_async(conversation.save)()
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .clients import is_rate_limited
+from .metrics import span
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedder with content-hash dedup, a persistent SQLite cache and batched, retried calls.
+
+    Document vectors are stored as float32 blobs keyed by sha256(namespace, kind, text),
+    so the same chunk under two S3 keys is only embedded once. Query embeddings are kept
+    apart (Gemini embeds them with a different task type) in a per-process LRU of
+    query_cache_size entries: user questions are unbounded and rarely repeat verbatim
+    for long, so they are not worth a row on disk forever.
+    """
+
+    def __init__(self, embedder, cache_path, namespace="", batch_size=100, max_retries=5, base_delay=1.0,
+                 query_cache_size=1024):
+        self.embedder = embedder
+        self.cache_path = cache_path
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._local = threading.local()
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()  # key -> vector, least recently used first
+        self._queries_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.retries = 0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.cache_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")  # readers in other workers never block
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, kind, text):
+        return hashlib.sha256(f"{self.namespace}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self, keys):
+        found = {}
+        conn = self._connection()
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+
+    def _call_with_retry(self, fn, *args):
+        """Calls the embedder, backing off exponentially (with jitter) on rate limits."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._stats_lock:
+                    self.api_calls += 1
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not is_rate_limited(e):
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                delay = self.base_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    async def _acall_with_retry(self, fn, *args):
+        """Async variant of _call_with_retry."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._stats_lock:
+                    self.api_calls += 1
+                return await fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not is_rate_limited(e):
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                delay = self.base_delay * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    def _lookup(self, texts, vectors):
+        """(keys, unique texts by key, missing keys) for a document request, counting hits and misses."""
+        keys = [self._key("document", text) for text in texts]
+        unique = dict(zip(keys, texts))  # dedupe identical chunks within the request
+        missing = [key for key in unique if key not in vectors]
+        missing_set = set(missing)
+        with self._stats_lock:
+            self.hits += sum(1 for key in keys if key not in missing_set)
+            self.misses += len(missing)
+        return keys, unique, missing
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self._load([self._key("document", text) for text in texts])
+        keys, unique, missing = self._lookup(texts, vectors)
+        for i in range(0, len(missing), self.batch_size):
+            batch_keys = missing[i:i + self.batch_size]
+            batch_vectors = self._call_with_retry(self.embedder.embed_documents, [unique[key] for key in batch_keys])
+            self._store(zip(batch_keys, batch_vectors))
+            vectors.update(zip(batch_keys, batch_vectors))
+        return [list(vectors[key]) for key in keys]
+
+    async def aembed_documents(self, texts):
+        """Async variant of embed_documents; SQLite reads and writes run on worker threads."""
+        texts = list(texts)
+        vectors = await asyncio.to_thread(self._load, [self._key("document", text) for text in texts])
+        keys, unique, missing = self._lookup(texts, vectors)
+        for i in range(0, len(missing), self.batch_size):
+            batch_keys = missing[i:i + self.batch_size]
+            batch_vectors = await self._acall_with_retry(
+                self.embedder.aembed_documents, [unique[key] for key in batch_keys])
+            await asyncio.to_thread(self._store, list(zip(batch_keys, batch_vectors)))
+            vectors.update(zip(batch_keys, batch_vectors))
+        return [list(vectors[key]) for key in keys]
+
+    def _cached_query(self, key):
+        with self._queries_lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+        with self._stats_lock:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return vector
+
+    def _remember_query(self, key, vector):
+        with self._queries_lock:
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def embed_query(self, text):
+        with span("embed"):
+            key = self._key("query", text)
+            vector = self._cached_query(key)
+            if vector is None:
+                vector = self._call_with_retry(self.embedder.embed_query, text)
+                self._remember_query(key, vector)
+            return list(vector)
+
+    async def aembed_query(self, text):
+        with span("embed"):
+            key = self._key("query", text)
+            vector = self._cached_query(key)
+            if vector is None:
+                vector = await self._acall_with_retry(self.embedder.aembed_query, text)
+                self._remember_query(key, vector)
+            return list(vector)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "api_calls": self.api_calls,
+                "retries": self.retries,
+                "cached_queries": len(self._queries),
+            }
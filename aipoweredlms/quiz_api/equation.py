@@ -1,22 +1,48 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+try:
+    from .clients import gemini_model
+    from .concurrency import llm_slot
+    from .single_flight import flight_key, single_flight
+except ImportError:  # run as a script
+    from clients import gemini_model
 
-# Load API key from .env file
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
+EQUATION_MODEL = "gemini-1.5-flash"
 
-def get_curve_equation(curve_name):
-    """Generates only the mathematical equation of the given curve using streaming."""
-    model = genai.GenerativeModel("gemini-1.5-flash")
+def build_equation_prompt(curve_name):
+    return f"Provide only the mathematical equation for the curve: {curve_name}. No extra text."
 
-    prompt = f"Provide only the mathematical equation for the curve: {curve_name}. No extra text."
+def _equation_key(curve_name):
+    """In-flight requests sending Gemini the same prompt share one call."""
+    return flight_key("equation", EQUATION_MODEL, build_equation_prompt(curve_name))
 
-    response = model.generate_content(prompt, stream=True)  # Enable streaming
+def generate_curve_equation(curve_name):
+    """Generates only the mathematical equation of the given curve using streaming."""
+    model = gemini_model(EQUATION_MODEL)
+
+    response = model.generate_content(build_equation_prompt(curve_name), stream=True)  # Enable streaming
     equation = "".join(chunk.text for chunk in response)  # Collect streamed response
     return equation.strip()
 
+def get_curve_equation(curve_name):
+    """generate_curve_equation, shared with identical requests already in flight."""
+    return single_flight("equation").do(_equation_key(curve_name), lambda: generate_curve_equation(curve_name))
+
+async def astream_curve_equation(curve_name):
+    """Yields the equation text as Gemini streams it."""
+    model = gemini_model(EQUATION_MODEL)
+
+    response = await model.generate_content_async(build_equation_prompt(curve_name), stream=True)
+    async for chunk in response:
+        yield chunk.text
+
+async def aget_curve_equation(curve_name):
+    """Async variant of get_curve_equation; only the request calling Gemini holds an LLM slot."""
+    async def generate():
+        async with llm_slot():
+            equation = "".join([text async for text in astream_curve_equation(curve_name)])
+        return equation.strip()
+
+    return await single_flight("equation").ado(_equation_key(curve_name), generate)
+
 if __name__ == "__main__":
     curve_name = input().strip().lower()  # Ask for input without extra text
-    print(get_curve_equation(curve_name))  # Print only the equation
+    print(generate_curve_equation(curve_name))  # Print only the equation
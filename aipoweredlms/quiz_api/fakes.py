@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Deterministic stand-ins for Gemini (LangChain chat models, google.generativeai models and
+# embeddings) with configurable latency and token rate, so benchmarks and smoke runs work
+# offline. Replies follow the shape each prompt asks for: MCQ JSON, topic-tree JSON,
+# query rewrites, summaries or prose built from the prompt's own words.
+
+WORD = re.compile(r"[A-Za-z][A-Za-z\-]{3,}")
+
+
+def _seeded(prompt):
+    return random.Random(int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16], 16))
+
+
+def _vocabulary(text):
+    """Distinct content words of text, in order of first appearance."""
+    return list(dict.fromkeys(word.lower() for word in WORD.findall(text)))
+
+
+def _mcq_reply(prompt, rng):
+    topic = re.search(r'on the topic "([^"]*)"', prompt)
+    topic = topic.group(1) if topic else "the topic"
+    difficulty = re.search(r"with (Easy|Medium|Hard) difficulty", prompt)
+    level = {"Easy": 2, "Medium": 5, "Hard": 8}[difficulty.group(1) if difficulty else "Medium"]
+    count = re.search(r"exactly (\d+)", prompt)
+    count = int(count.group(1)) if count else 5
+    material = prompt.split("**Study Material:**", 1)[-1].split("**Strict Difficulty", 1)[0]
+    words = _vocabulary(material) or ["concept"]
+
+    mcqs = []
+    for i in range(count):
+        # Three different terms per question keep the batch clear of the near-duplicate filter
+        terms = [words[(rng.randrange(len(words)) + j) % len(words)] + (f"{i}" if len(words) < 3 * count else "")
+                 for j in range(3)]
+        options = {key: f"{terms[n % 3]} {key.lower()} {rng.randrange(100)}" for n, key in enumerate("ABCD")}
+        mcqs.append({
+            "question": f"In {topic}, how does {terms[0]} relate to {terms[1]} and {terms[2]}?",
+            "options": options,
+            "answer": rng.choice("ABCD"),
+            "difficulty": level,
+        })
+    return json.dumps({"mcqs": mcqs}, indent=2)
+
+
+def _topic_tree_reply(prompt, rng, size):
+    words = _vocabulary(prompt.split("**Here is the document content:**", 1)[-1]) or ["document"]
+    tree = {}
+    for i in range(max(1, min(8, size // 40))):
+        subpoints = {words[rng.randrange(len(words))].title(): " ".join(rng.choice(words) for _ in range(12))
+                     for _ in range(3)}
+        tree[f"{i + 1}. {words[rng.randrange(len(words))].title()}"] = {"subpoints": subpoints}
+    return json.dumps(tree, indent=2)
+
+
+def fake_reply(prompt, answer_tokens=150):
+    """A deterministic reply to prompt in the format the prompt asks for."""
+    rng = _seeded(prompt)
+    if '"mcqs"' in prompt:
+        return _mcq_reply(prompt, rng)
+    if "standalone question" in prompt:
+        latest = prompt.rsplit("Latest message:", 1)[-1].strip()
+        earlier = _vocabulary(prompt.split("Latest message:", 1)[0])[-3:]
+        return f"{latest} ({' '.join(earlier)})"
+    if "running summary" in prompt:
+        return "The student asked about " + ", ".join(_vocabulary(prompt)[-12:]) + "."
+    if "JSON key" in prompt:
+        return _topic_tree_reply(prompt, rng, answer_tokens)
+    if "mathematical equation" in prompt:
+        return f"y = {rng.randint(1, 9)}x^2 + {rng.randint(1, 9)}x + {rng.randint(1, 9)}"
+    words = _vocabulary(prompt) or ["answer"]
+    sentences, length = [], 0
+    while length < answer_tokens:
+        sentence = " ".join(rng.choice(words) for _ in range(12)).capitalize() + "."
+        sentences.append(sentence)
+        length += 12
+    return " ".join(sentences)
+
+
+def split_tokens(text):
+    """Roughly Gemini-sized tokens (a word plus its trailing space)."""
+    return re.findall(r"\S+\s*", text) or [text]
+
+
+def _prompt_text(messages):
+    return "\n".join(str(message.content) for message in messages)
+
+
+class FakeChatModel(BaseChatModel):
+    """LangChain chat model that answers with fake_reply after latency plus per-token delays."""
+
+    model: str = "gemini-1.5-pro"
+    latency: float = 0.3            # seconds before the first token
+    tokens_per_second: float = 80.0
+    answer_tokens: int = 150
+
+    @property
+    def _llm_type(self):
+        return "fake-gemini"
+
+    def _reply(self, messages):
+        prompt = _prompt_text(messages)
+        text = fake_reply(prompt, self.answer_tokens)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(split_tokens(text))}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _duration(self, text):
+        return self.latency + len(split_tokens(text)) / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        time.sleep(self._duration(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply(messages)
+        await asyncio.sleep(self._duration(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, _ = self._reply(messages)
+        time.sleep(self.latency)
+        for token in split_tokens(text):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, _ = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        for token in split_tokens(text):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeGenaiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenaiModel:
+    """Stands in for google.generativeai.GenerativeModel (generate_content, streamed or not)."""
+
+    def __init__(self, latency=0.3, tokens_per_second=80.0, answer_tokens=150):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    def _reply(self, contents):
+        if isinstance(contents, str):
+            return fake_reply(contents, self.answer_tokens)
+        # Continuation requests: answer the original prompt
+        first = contents[0]
+        return fake_reply(first["parts"][0] if isinstance(first, dict) else str(first), self.answer_tokens)
+
+    def _tokens(self, text):
+        for token in split_tokens(text):
+            time.sleep(1 / self.tokens_per_second)
+            yield FakeGenaiResponse(token)
+
+    async def _atokens(self, text):
+        for token in split_tokens(text):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield FakeGenaiResponse(token)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        text = self._reply(contents)
+        if stream:
+            time.sleep(self.latency)
+            return self._tokens(text)
+        time.sleep(self.latency + len(split_tokens(text)) / self.tokens_per_second)
+        return FakeGenaiResponse(text)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        text = self._reply(contents)
+        if stream:
+            await asyncio.sleep(self.latency)
+            return self._atokens(text)
+        await asyncio.sleep(self.latency + len(split_tokens(text)) / self.tokens_per_second)
+        return FakeGenaiResponse(text)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: texts sharing words are similar, as with real embeddings."""
+
+    def __init__(self, size=768, latency=0.02):
+        self.size = size
+        self.latency = latency  # seconds per call (one batch)
+
+    def vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in WORD.findall(text.lower()):
+            bucket = zlib.crc32(word.encode("utf-8"))
+            vector[bucket % self.size] += 1.0 if bucket & 1 << 31 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self.vector(text)
+
+
+def install(latency=0.3, tokens_per_second=80.0, answer_tokens=150, embed_latency=0.02, embedding_size=768):
+    """Routes every Gemini call in this process (chat, quiz, PDF, equation and embedding models) to fakes.
+
+    Must run before the RAG pipeline is built; the real limiter, breaker, caches and chains stay in place.
+    """
+    from . import clients, ragchat
+
+    def make_chat_model(model, **kwargs):
+        return FakeChatModel(model=model, latency=latency, tokens_per_second=tokens_per_second,
+                             answer_tokens=answer_tokens, **clients.chat_model_guards(model))
+
+    ragchat.make_chat_model = make_chat_model
+    ragchat.make_embedder = lambda: FakeEmbeddings(embedding_size, embed_latency)
+    ragchat.API_KEY = ragchat.API_KEY or "fake"
+    for model_name in ("gemini-1.5-pro", "gemini-1.5-flash"):
+        clients.use_model_handle(model_name, FakeGenaiModel(latency, tokens_per_second, answer_tokens))
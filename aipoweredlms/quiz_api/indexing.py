@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from .pdf_ingest import chunker_name, iter_pdf_chunks
+
+try:
+    import fcntl
+except ImportError:  # Windows: the manifest is only guarded within a process
+    fcntl = None
+
+# The manifest lives next to the Chroma files and records which S3 objects are
+# already embedded, so restarts only touch PDFs that were added, changed or removed.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_LOCK_NAME = "manifest.lock"
+
+# Chunks handed to the vector store per add_documents call while a PDF is streamed in
+ADD_BATCH_SIZE = 64
+
+# PDFs live at pdfs/<course>/<file>.pdf; files directly under pdfs/ belong to DEFAULT_COURSE
+PDF_PREFIX = "pdfs/"
+DEFAULT_COURSE = "general"
+COURSE_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+# Bumped when chunk metadata gains fields; older indexes are re-tagged in place
+CHUNK_METADATA_VERSION = 1
+
+
+def manifest_path(persist_directory):
+    return os.path.join(persist_directory, MANIFEST_NAME)
+
+
+def load_manifest(persist_directory):
+    """Loads the ingestion manifest, or an empty one if the index was never built."""
+    try:
+        with open(manifest_path(persist_directory), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"version": 0, "metadata_version": CHUNK_METADATA_VERSION, "objects": {}}
+    manifest.setdefault("version", 0)
+    manifest.setdefault("metadata_version", 0)
+    manifest.setdefault("objects", {})
+    return manifest
+
+
+def save_manifest(persist_directory, manifest):
+    """Writes the manifest atomically so a crash never leaves it half-written."""
+    os.makedirs(persist_directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=persist_directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(persist_directory))
+
+
+# Serializes manifest read-modify-write between indexing threads of this process;
+# the flock on MANIFEST_LOCK_NAME does the same between processes (web workers, job
+# runners, ingest commands). Reentrant, so locked helpers can call each other.
+_manifest_lock = threading.RLock()
+_manifest_holds = threading.local()
+
+
+@contextmanager
+def manifest_lock(persist_directory):
+    """Holds the manifest for one load -> mutate -> save cycle, across threads and processes."""
+    with _manifest_lock:
+        depth = getattr(_manifest_holds, "depth", 0)
+        if depth or fcntl is None:
+            _manifest_holds.depth = depth + 1
+            try:
+                yield
+            finally:
+                _manifest_holds.depth = depth
+            return
+        os.makedirs(persist_directory, exist_ok=True)
+        with open(os.path.join(persist_directory, MANIFEST_LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _manifest_holds.depth = 1
+            try:
+                yield
+            finally:
+                _manifest_holds.depth = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)  # forked parse workers share this file description
+
+
+def has_manifest(persist_directory):
+    return os.path.exists(manifest_path(persist_directory))
+
+
+def index_version(persist_directory):
+    """Cheap token that changes whenever any process rewrites the manifest."""
+    try:
+        return os.stat(manifest_path(persist_directory)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def is_valid_course(course):
+    return bool(course) and bool(COURSE_PATTERN.match(course))
+
+
+def course_key(course, filename):
+    """S3 key for a PDF uploaded to a course (or to the shared folder when course is empty)."""
+    return f"{PDF_PREFIX}{course}/{filename}" if course else f"{PDF_PREFIX}{filename}"
+
+
+def chunk_metadata(key):
+    """Course and document tags derived from an S3 key laid out as pdfs/<course>/<file>.pdf."""
+    relative = key[len(PDF_PREFIX):] if key.startswith(PDF_PREFIX) else key
+    course, _, document = relative.rpartition("/")
+    return {"source": key, "course": course.split("/")[0] if course else DEFAULT_COURSE, "document": document}
+
+
+def key_from_chunk_id(chunk_id):
+    return chunk_id.rsplit("#", 1)[0]
+
+
+def scope_filter(course=None, document=None):
+    """Chroma metadata filter limiting retrieval to a course and/or one document."""
+    conditions = [{field: value} for field, value in (("course", course), ("document", document)) if value]
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def retag_chunks(vectorstore, persist_directory):
+    """Adds course/document metadata to chunks embedded before it existed, without re-embedding.
+
+    Returns the number of chunks updated.
+    """
+    with manifest_lock(persist_directory):
+        manifest = load_manifest(persist_directory)
+        if manifest["metadata_version"] >= CHUNK_METADATA_VERSION:
+            return 0
+        updated = 0
+        for key, entry in manifest["objects"].items():
+            if entry["ids"]:
+                found = vectorstore.get(ids=entry["ids"], include=["metadatas"])
+                metadatas = [{**(metadata or {}), **chunk_metadata(key)} for metadata in found["metadatas"]]
+                vectorstore._collection.update(ids=found["ids"], metadatas=metadatas)
+                updated += len(found["ids"])
+        manifest["metadata_version"] = CHUNK_METADATA_VERSION
+        save_manifest(persist_directory, manifest)
+    return updated
+
+
+def object_fingerprint(obj, text_splitter=None):
+    """Identifies one version of an S3 object by its ETag and size, and the chunker that splits it."""
+    return {"etag": obj["ETag"].strip('"'), "size": obj["Size"], "chunker": chunker_name(text_splitter)}
+
+
+def list_pdf_objects(s3_client, bucket_name, prefix="pdfs/"):
+    """Returns every PDF object under the given prefix, following list pagination past 1000 keys."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return [
+        obj
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+        for obj in page.get("Contents", [])
+        if obj["Key"].endswith(".pdf")
+    ]
+
+
+def is_unchanged(entry, fingerprint):
+    # Entries written before chunkers were recorded were split by the recursive splitter
+    return (bool(entry) and entry["etag"] == fingerprint["etag"] and entry["size"] == fingerprint["size"]
+            and entry.get("chunker", "recursive") == fingerprint["chunker"])
+
+
+def iter_object_chunks(s3_client, bucket_name, key, text_splitter):
+    """Streams one PDF from S3 straight into PyMuPDF and yields its chunks."""
+    pdf_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
+    return iter_pdf_chunks(pdf_obj["Body"].read(), text_splitter, chunk_metadata(key))
+
+
+def chunk_ids(key, count, start=0):
+    """Stable vector IDs for the chunks of one S3 object."""
+    return [f"{key}#{i}" for i in range(start, start + count)]
+
+
+def add_chunks(vectorstore, key, chunks, keyword_index=None):
+    """Adds chunks to the vector store (and keyword index) in small batches as they are produced; returns their IDs."""
+    ids = []
+    while True:
+        batch = list(islice(chunks, ADD_BATCH_SIZE))
+        if not batch:
+            return ids
+        batch_ids = chunk_ids(key, len(batch), start=len(ids))
+        vectorstore.add_documents(batch, ids=batch_ids)
+        if keyword_index is not None:
+            keyword_index.add(batch_ids, [chunk.page_content for chunk in batch])
+        ids.extend(batch_ids)
+
+
+def index_object(s3_client, bucket_name, key, fingerprint, vectorstore, text_splitter, persist_directory,
+                 manifest, keyword_index=None):
+    """(Re-)embeds one S3 object unless the manifest already has this version of it.
+
+    Returns "added", "updated" or None when unchanged; the manifest is saved after each object.
+    """
+    entries = manifest["objects"]
+    entry = entries.get(key)
+    if is_unchanged(entry, fingerprint):
+        return None
+
+    if entry and entry["ids"]:
+        vectorstore.delete(ids=entry["ids"])
+        if keyword_index is not None:
+            keyword_index.delete(entry["ids"])
+
+    ids = add_chunks(vectorstore, key, iter_object_chunks(s3_client, bucket_name, key, text_splitter), keyword_index)
+    entries[key] = {**fingerprint, "ids": ids}
+    save_manifest(persist_directory, manifest)
+    return "updated" if entry else "added"
+
+
+def index_key(s3_client, bucket_name, key, vectorstore, text_splitter, persist_directory, keyword_index=None):
+    """Incrementally indexes one object (e.g. a just-finished upload) without listing the bucket.
+
+    Returns {"key", "change", "chunks"}, change being "added", "updated" or None.
+    """
+    head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    fingerprint = object_fingerprint({"ETag": head["ETag"], "Size": head["ContentLength"]}, text_splitter)
+    with manifest_lock(persist_directory):
+        manifest = load_manifest(persist_directory)
+        change = index_object(s3_client, bucket_name, key, fingerprint, vectorstore, text_splitter,
+                              persist_directory, manifest, keyword_index)
+        if change:
+            manifest["version"] += 1
+            save_manifest(persist_directory, manifest)
+    return {"key": key, "change": change, "chunks": len(manifest["objects"][key]["ids"])}
+
+
+def sync_vector_index(s3_client, bucket_name, vectorstore, text_splitter, persist_directory, prefix="pdfs/"):
+    """Embeds new or changed PDFs and drops vectors of PDFs deleted from S3.
+
+    Returns a dict with the keys that were added, updated and removed.
+    """
+    from .keyword_index import open_keyword_index  # keyword_index imports this module
+
+    with manifest_lock(persist_directory):
+        manifest = load_manifest(persist_directory)
+        entries = manifest["objects"]
+        keyword_index = open_keyword_index(persist_directory)
+
+        if not entries and vectorstore._collection.count() > 0:
+            # Vectors written before the manifest existed carry random IDs and would
+            # otherwise be duplicated by the first sync.
+            print("⚠️ Vector store has no manifest, rebuilding it from S3.")
+            vectorstore.reset_collection()
+            keyword_index.clear()
+
+        stats = {"added": [], "updated": [], "removed": []}
+        seen = set()
+
+        for obj in list_pdf_objects(s3_client, bucket_name, prefix):
+            key = obj["Key"]
+            fingerprint = object_fingerprint(obj, text_splitter)
+            seen.add(key)
+
+            change = index_object(s3_client, bucket_name, key, fingerprint, vectorstore, text_splitter,
+                                  persist_directory, manifest, keyword_index)
+            if change:
+                stats[change].append(key)
+
+        for key in sorted(set(entries) - seen):
+            if entries[key]["ids"]:
+                vectorstore.delete(ids=entries[key]["ids"])
+                keyword_index.delete(entries[key]["ids"])
+            del entries[key]
+            stats["removed"].append(key)
+
+        if any(stats.values()) or not has_manifest(persist_directory):
+            manifest["version"] += 1
+            save_manifest(persist_directory, manifest)
+    return stats
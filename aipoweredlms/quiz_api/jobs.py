@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from .clients import ServiceBusy
+from .models import Job
+from .pdf_cache import get_pdf_cache
+
+# Set by enqueue so idle in-process workers pick new jobs up without waiting for the next poll
+_wakeup = threading.Event()
+
+
+def dedup_key(kind, digest, version, params):
+    payload = json.dumps([kind, digest, version, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def enqueue(kind, digest, text, version, params=None, result=None):
+    """Queues a job, or returns the queued or running job for an identical request. Returns (job, created).
+
+    Passing result records an already-known answer (e.g. a PDF cache hit) as a finished job,
+    reusing the latest succeeded job for the same request so repeated cache hits add no rows.
+    """
+    params = {**(params or {}), "version": version}
+    key = dedup_key(kind, digest, version, params)
+    existing = Job.objects.filter(dedup_key=key, status__in=Job.ACTIVE).first()
+    if existing is None and result is not None:
+        existing = Job.objects.filter(dedup_key=key, status=Job.SUCCEEDED).order_by('-finished_at').first()
+    if existing is not None:
+        return existing, False
+
+    now = timezone.now()
+    fields = {
+        "kind": kind, "dedup_key": key, "pdf_digest": digest, "params": params,
+        "run_after": now, "max_attempts": settings.JOBS['MAX_ATTEMPTS'],
+    }
+    if result is None:
+        fields["input_text"] = text
+    else:
+        fields.update(status=Job.SUCCEEDED, result=result, finished_at=now)
+
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(**fields)
+    except IntegrityError:
+        # Another request queued the same job in the meantime
+        return Job.objects.filter(dedup_key=key, status__in=Job.ACTIVE).get(), False
+    _wakeup.set()
+    return job, True
+
+
+def describe(job):
+    """Job fields for API responses."""
+    return {
+        "id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error or None,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "status_url": reverse("job_status", args=[job.id]),
+        "result_url": reverse("job_result", args=[job.id]),
+    }
+
+
+def _structure(job):
+    from .pptjson import generate_json_with_gemini
+    return generate_json_with_gemini(job.input_text)
+
+
+def _summary(job):
+    from .summerization import query_pdf_with_gemini
+    return query_pdf_with_gemini(job.input_text, job.params["user_query"])
+
+
+def _index(job):
+    from .ragchat import index_uploaded_object
+    return json.dumps(index_uploaded_object(job.params["key"]))
+
+
+HANDLERS = {
+    Job.KIND_STRUCTURE: _structure,
+    Job.KIND_SUMMARY: _summary,
+    Job.KIND_INDEX: _index,
+}
+
+# Job kinds whose results are Gemini output worth keeping in the PDF cache
+PDF_CACHE_KINDS = (Job.KIND_STRUCTURE, Job.KIND_SUMMARY)
+
+# Bump when indexing changes in a way that should re-run jobs for already indexed uploads
+INDEX_JOB_VERSION = "v1"
+
+
+def enqueue_indexing(key, etag):
+    """Queues incremental indexing of an uploaded S3 object; only PDFs are indexed. Returns the job or None."""
+    if not key.endswith(".pdf"):
+        return None
+    job, _ = enqueue(Job.KIND_INDEX, etag.strip('"'), "", INDEX_JOB_VERSION, {"key": key})
+    return job
+
+
+def release_stale_jobs(now):
+    """Requeues jobs whose worker died mid-run, or fails them if they are out of attempts."""
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOBS['LEASE_SECONDS']))
+    stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, locked_by="", run_after=now)
+    stale.update(status=Job.FAILED, locked_by="", input_text="", finished_at=now, error="Worker stopped while running the job")
+
+
+def prune_finished_jobs(now):
+    """Deletes jobs that finished more than JOBS['RETENTION_SECONDS'] ago; returns how many."""
+    cutoff = now - timedelta(seconds=settings.JOBS['RETENTION_SECONDS'])
+    deleted, _ = Job.objects.filter(status__in=(Job.SUCCEEDED, Job.FAILED), finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def claim_next(worker_id):
+    """Atomically moves the oldest due job to running for this worker; returns it or None."""
+    now = timezone.now()
+    release_stale_jobs(now)
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('created_at')
+    for job_id in due.values_list('id', flat=True)[:10]:
+        # The status check in the UPDATE makes the claim safe across threads and processes
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def renew_lease(owned, stop, interval):
+    """Pushes a running job's locked_at forward until stop is set, so long jobs are not taken for dead ones."""
+    try:
+        while not stop.wait(interval):
+            try:
+                if not owned.update(locked_at=timezone.now()):
+                    return  # released as stale or finished meanwhile
+            except Exception as e:
+                print(f"⚠️ Could not renew job lease: {e}")
+    finally:
+        connection.close()
+
+
+@contextmanager
+def lease_heartbeat(owned):
+    """Keeps renewing the lease of a running job for the duration of the block."""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=renew_lease, args=(owned, stop, settings.JOBS['HEARTBEAT_SECONDS']),
+                                 name="job-lease", daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def run_job(job):
+    """Runs a claimed job, storing its result or scheduling a retry with exponential backoff."""
+    owned = Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by)
+    try:
+        with lease_heartbeat(owned):
+            result = HANDLERS[job.kind](job)
+    except ServiceBusy as e:
+        # Provider is rate limited or its circuit is open: wait it out without using up an attempt
+        owned.update(status=Job.QUEUED, locked_by="", attempts=F('attempts') - 1,
+                     run_after=timezone.now() + timedelta(seconds=e.retry_after))
+        print(f"⏳ Job {job.id} deferred {e.retry_after:.0f}s: {e}")
+        return
+    except Exception as e:
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = settings.JOBS['RETRY_BASE_SECONDS'] * 2 ** (job.attempts - 1)
+            owned.update(status=Job.QUEUED, locked_by="", error=str(e), run_after=now + timedelta(seconds=delay))
+            print(f"⚠️ Job {job.id} failed ({job.attempts}/{job.max_attempts}), retrying in {delay}s: {e}")
+        else:
+            owned.update(status=Job.FAILED, locked_by="", error=str(e), input_text="", finished_at=now)
+            print(f"❌ Job {job.id} failed: {e}")
+        return
+
+    if job.kind in PDF_CACHE_KINDS:
+        get_pdf_cache().set_result(job.pdf_digest, job.kind, job.params["version"], result, job.params.get("query_key", ""))
+    owned.update(status=Job.SUCCEEDED, locked_by="", result=result, error="", input_text="", finished_at=timezone.now())
+
+
+class JobWorker:
+    """Pool of threads that claim and run queued jobs; concurrency bounds parallel Gemini calls."""
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = concurrency or settings.JOBS['CONCURRENCY']
+        self.poll_interval = poll_interval or settings.JOBS['POLL_SECONDS']
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._pruned_at = None  # last retention sweep by this process
+        self._prune_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, args=(f"{self.name}:{i}",), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _prune(self):
+        """Runs the finished-job retention sweep at most once per JOBS['PRUNE_SECONDS'] per process."""
+        now = timezone.now()
+        with self._prune_lock:
+            if self._pruned_at and (now - self._pruned_at).total_seconds() < settings.JOBS['PRUNE_SECONDS']:
+                return
+            self._pruned_at = now
+        deleted = prune_finished_jobs(now)
+        if deleted:
+            print(f"🧹 Deleted {deleted} finished jobs past retention")
+
+    def _loop(self, worker_id):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                self._prune()
+                job = claim_next(worker_id)
+            except Exception as e:
+                print(f"❌ Job queue unavailable: {e}")
+                job = None
+            if job is None:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+                continue
+            run_job(job)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_workers():
+    """Starts the in-process worker pool once per process."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = JobWorker()
+            _worker.start()
+    return _worker
@@ -0,0 +1,180 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from .indexing import chunk_metadata, key_from_chunk_id
+
+KEYWORD_INDEX_NAME = "keyword_index.sqlite3"
+
+# Words, numbers and dotted/dashed terms such as "3.2", "h2o" or "x-ray"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its of on or that the this "
+    "to was what when where which who why with".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def keyword_index_path(persist_directory):
+    return os.path.join(persist_directory, KEYWORD_INDEX_NAME)
+
+
+def is_lexical_query(query, max_terms=4):
+    """True for short look-ups of exact terms: quoted phrases, acronyms, section numbers, formula names."""
+    if '"' in query:
+        return True
+    words = query.split()
+    if not words or len(words) > max_terms:
+        return False
+    return any(re.search(r"\d", word) or (len(word) > 1 and word.isupper()) for word in words)
+
+
+class KeywordIndex:
+    """BM25 inverted index over the vector store's chunks, kept in SQLite next to Chroma.
+
+    Chunks are referenced by their vector IDs, so results can be fetched from Chroma
+    without embedding the query. Postings are (term, doc) rows in a WITHOUT ROWID
+    table keyed by an integer doc number, which keeps the file compact. Each doc
+    carries the course and document parsed from its ID, so searches can be scoped.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(docs)")}
+            if columns and "course" not in columns:
+                # Index from before course scoping; ensure_keyword_index rebuilds it from Chroma
+                conn.executescript("DROP TABLE postings; DROP TABLE docs;")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    doc INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL, length INTEGER NOT NULL,
+                    course TEXT NOT NULL, document TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS docs_course ON docs (course, document);
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+            """)
+            self._local.conn = conn
+        return conn
+
+    def add(self, ids, texts):
+        """Indexes (or re-indexes) chunks under their vector IDs."""
+        conn = self._connection()
+        with conn:
+            self._delete(conn, ids)
+            for chunk_id, text in zip(ids, texts):
+                counts = Counter(tokenize(text))
+                metadata = chunk_metadata(key_from_chunk_id(chunk_id))
+                doc = conn.execute(
+                    "INSERT INTO docs (chunk_id, length, course, document) VALUES (?, ?, ?, ?)",
+                    (chunk_id, sum(counts.values()), metadata["course"], metadata["document"]),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                    [(term, doc, tf) for term, tf in counts.items()],
+                )
+
+    def delete(self, ids):
+        conn = self._connection()
+        with conn:
+            self._delete(conn, ids)
+
+    def _delete(self, conn, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(
+                f"DELETE FROM postings WHERE doc IN (SELECT doc FROM docs WHERE chunk_id IN ({placeholders}))", batch
+            )
+            conn.execute(f"DELETE FROM docs WHERE chunk_id IN ({placeholders})", batch)
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM docs")
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query, k=40, course=None, document=None):
+        """Returns up to k (chunk_id, bm25 score) pairs, best first, optionally within a course/document."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        conn = self._connection()
+        total, avg_length = conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not total:
+            return []
+        avg_length = avg_length or 1.0
+
+        scope_sql, scope_args = "", []
+        for column, value in (("course", course), ("document", document)):
+            if value:
+                scope_sql += f" AND d.{column} = ?"
+                scope_args.append(value)
+
+        scores = {}
+        for term in terms:
+            # Document frequency over the whole corpus, postings only from the requested scope
+            frequency = conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+            if not frequency:
+                continue
+            idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            rows = conn.execute(
+                "SELECT p.doc, p.tf, d.length FROM postings p JOIN docs d ON d.doc = p.doc "
+                "WHERE p.term = ?" + scope_sql,
+                [term] + scope_args,
+            )
+            for doc, tf, length in rows:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        if not best:
+            return []
+        names = dict(conn.execute(
+            f"SELECT doc, chunk_id FROM docs WHERE doc IN ({','.join('?' * len(best))})", [doc for doc, _ in best]
+        ))
+        return [(names[doc], score) for doc, score in best]
+
+
+def open_keyword_index(persist_directory):
+    return KeywordIndex(keyword_index_path(persist_directory))
+
+
+def backfill_keyword_index(vectorstore, keyword_index, batch_size=500):
+    """Builds the keyword index from texts already in Chroma (no embedding calls). Returns chunks indexed."""
+    offset = 0
+    while True:
+        batch = vectorstore.get(include=["documents"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            return offset
+        keyword_index.add(batch["ids"], batch["documents"])
+        offset += len(batch["ids"])
+
+
+def ensure_keyword_index(vectorstore, persist_directory):
+    """Opens the keyword index, backfilling it once for vector stores built before it existed."""
+    keyword_index = open_keyword_index(persist_directory)
+    if keyword_index.count() == 0 and vectorstore._collection.count() > 0:
+        print(f"🔤 Built keyword index for {backfill_keyword_index(vectorstore, keyword_index)} chunks")
+    return keyword_index
@@ -0,0 +1,397 @@
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain_core.documents import Document
+import fitz
+from .pdf_ingest import open_pdf
+
+# Structure-aware chunking from PyMuPDF's layout (get_text("dict")): chunks break at
+# headings instead of every N characters, tables and display equations are never cut,
+# running headers, footers and page numbers are dropped, and each chunk records the
+# section it belongs to and the pages it spans. Pages are read independently; the
+# heading and equation decisions are then made for the whole document at once.
+
+BOLD = 1 << 4  # span flags bit
+MATH_FONT = re.compile(r"^(CM(MI|SY|EX|BSY)|MSBM|MSAM|Symbol|STIX|Cambria.?Math|.*Math)", re.IGNORECASE)
+MATH_CHARS = frozenset("=+−×÷∑∏∫√∂∇≤≥≈≠±∞∈∉⊂⊆∀∃→←⇒⇔∝∘·∗⊙⊕αβγδϵεζηθικλμνξπρστυφχψωΓΔΘΛΞΠΣΦΨΩ^_")
+# "3.2.1 Title", "IV. TITLE", "A. Title", "Chapter 2: Title"; a section number may also sit on a line of its own
+NUMBERED_HEADING = re.compile(
+    r"^(?:(?i:chapter|lecture|lesson|module|part|section|unit|week)\s+)?(\d+(?:\.\d+)*[.:]?|[IVX]+[.:]|[A-Z]\.)\s+\S")
+SECTION_NUMBER = re.compile(r"^(\d+(\.\d+)*|[IVX]+)\.?$")
+CAPTION = re.compile(r"^(table|fig\.?|figure|algorithm|algo\.?)\s*[\dIVX]+", re.IGNORECASE)
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z(\[])")
+PARAGRAPH_END = (".", "!", "?", ":")
+PAGE_NUMBER = re.compile(r"^(page\s*)?\d{1,4}(\s*(/|of)\s*\d{1,4})?$", re.IGNORECASE)
+
+
+def page_layout(page):
+    """Text lines and tables of one page, in reading order, with the features classification needs."""
+    blocks = [block for block in page.get_text("dict")["blocks"] if block["type"] == 0]
+    tables = []
+    for clip in _ruled_regions(page, blocks):  # find_tables is slow, so it only looks where rules line up
+        found = False
+        for table in page.find_tables(clip=clip).tables:
+            rows = [[(cell or "").replace("\n", " ").strip() for cell in row] for row in table.extract()]
+            rows = [row for row in rows if any(row)]
+            if len(rows) >= 2:
+                tables.append({"bbox": tuple(table.bbox), "rows": rows})
+                found = True
+        if not found:
+            # Rules without column lines (booktabs tables, algorithm boxes): keep the region whole, row by row
+            rows = _text_rows([line for block in blocks for line in block["lines"] if _inside(line["bbox"], clip)])
+            if len(rows) >= 2:
+                tables.append({"bbox": tuple(clip), "rows": rows})
+
+    lines = []
+    # Content-stream order, as get_text("text") uses: it keeps two-column pages column by column
+    for block_number, block in enumerate(blocks):
+        for line_number, line in enumerate(block["lines"]):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not text or any(_inside(line["bbox"], table["bbox"]) for table in tables):
+                continue
+            chars = np.array([len(span["text"].strip()) for span in spans], dtype=np.float64)
+            lines.append({
+                "text": text,
+                "block": block_number,
+                "first": line_number == 0,
+                "y": line["bbox"][1],
+                "size": float(np.average([span["size"] for span in spans], weights=chars)),
+                "bold": all(span["flags"] & BOLD or "Bold" in span["font"] for span in spans),
+                "math": float(chars[[bool(MATH_FONT.match(span["font"])) for span in spans]].sum() / chars.sum()),
+            })
+    return {"number": page.number, "height": page.rect.height, "lines": lines, "tables": tables}
+
+
+def _inside(bbox, rect):
+    x, y = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+    return rect[0] <= x <= rect[2] and rect[1] <= y <= rect[3]
+
+
+def _text_rows(lines):
+    """Table rows from loose text lines: lines whose vertical centers are within 3pt form a row, left to right."""
+    rows = []
+    for line in sorted(lines, key=lambda line: ((line["bbox"][1] + line["bbox"][3]) / 2, line["bbox"][0])):
+        y = (line["bbox"][1] + line["bbox"][3]) / 2
+        text = "".join(span["text"] for span in line["spans"]).strip()
+        if not text:
+            continue
+        if rows and y - rows[-1][0] <= 3:
+            rows[-1][1].append((line["bbox"][0], text))
+        else:
+            rows.append((y, [(line["bbox"][0], text)]))
+    return [[text for _, text in sorted(cells)] for _, cells in rows]
+
+
+def _is_paragraph(block, width):
+    """A block of 3+ lines of mostly letters as wide as width: running prose rather than table rows."""
+    text = "".join(span["text"] for line in block["lines"] for span in line["spans"]).replace(" ", "")
+    return (len(block["lines"]) >= 3 and block["bbox"][2] - block["bbox"][0] >= 0.95 * width
+            and sum(c.isalpha() for c in text) >= 0.75 * len(text))
+
+
+def _ruled_regions(page, blocks):
+    """Rects around runs of 3+ horizontal rules sharing left and right edges: the top, header and bottom
+    rules of a ruled table or algorithm box (plot axes and underlines rarely line up like that).
+    A run of 3+ is closed where a paragraph spanning the rules' width follows it (stacked algorithm boxes)."""
+    rules = []
+    for drawing in page.get_drawings():
+        if drawing["rect"].height < 2 and drawing["rect"].width > 30:
+            rules.append(tuple(drawing["rect"]))
+        else:
+            rules += [(min(p.x, q.x), p.y, max(p.x, q.x), p.y) for kind, p, q, *_ in drawing["items"]
+                      if kind == "l" and abs(p.y - q.y) < 1 and abs(p.x - q.x) > 30]
+    groups = {}
+    for rule in sorted(rules, key=lambda rule: rule[1]):
+        groups.setdefault((round(rule[0] / 4), round(rule[2] / 4)), []).append(rule)
+
+    regions = []
+    for group in groups.values():
+        run = group[:1]
+        for rule in group[1:] + [None]:
+            prose = rule is not None and len(run) >= 3 and any(
+                block["bbox"][1] > run[-1][1] and block["bbox"][3] < rule[1] and _is_paragraph(block, rule[2] - rule[0])
+                for block in blocks
+            )
+            if rule is not None and not prose:
+                run.append(rule)
+                continue
+            if len(run) >= 3:
+                regions.append(fitz.Rect(min(r[0] for r in run) - 2, run[0][1] - 2,
+                                         max(r[2] for r in run) + 2, run[-1][3] + 2))
+            run = [rule]
+    return regions
+
+
+def _layout_pages(source, start, stop):
+    """page_layout of pages start..stop-1; runs in a worker process."""
+    with open_pdf(source) as doc:
+        return [page_layout(doc[number]) for number in range(start, stop)]
+
+
+def _table_text(rows):
+    """A table as pipe-separated rows, header first."""
+    return "\n".join("| " + " | ".join(row) + " |" for row in rows)
+
+
+class LayoutChunker:
+    """Splits PDFs into section-aligned chunks of at most max_chars (a single table or equation may exceed it).
+
+    Drop-in for the text splitter passed around ingestion: pdf_ingest.iter_pdf_chunks calls split_pdf.
+    """
+
+    name = "layout-v2"
+
+    def __init__(self, max_chars=3000, min_chars=1500, page_workers=1):
+        self.max_chars = max_chars
+        self.min_chars = min_chars  # sections shorter than this share a chunk with the next one
+        self.page_workers = page_workers
+
+    def split_pdf(self, source, metadata=None):
+        """Yields the chunks of a PDF as Documents with page, page_end and section metadata."""
+        yield from self.split_pages(self.layouts(source), metadata or {})
+
+    def layouts(self, source):
+        """page_layout of every page, spread over page_workers processes for a PDF given as bytes or a path.
+        Inside a worker process already (bulk_ingest parses PDFs in a pool) pages are laid out in turn."""
+        if self.page_workers > 1 and isinstance(source, (bytes, str, os.PathLike)) and not multiprocessing.parent_process():
+            with open_pdf(source) as doc:
+                count = doc.page_count
+            workers = min(self.page_workers, count)
+            if workers > 1:
+                # PyMuPDF is not thread-safe, so each process opens the PDF and takes a run of pages
+                bounds = np.linspace(0, count, workers + 1).astype(int)
+                with ProcessPoolExecutor(workers) as pool:
+                    parts = pool.map(_layout_pages, [source] * workers, bounds[:-1], bounds[1:])
+                    return [page for part in parts for page in part]
+        with open_pdf(source) as doc:
+            return [page_layout(page) for page in doc]
+
+    # Document-wide classification
+
+    def _features(self, pages):
+        """Flat arrays over every line of the document."""
+        lines = [line for page in pages for line in page["lines"]]
+        page_of = np.array([page["number"] for page in pages for _ in page["lines"]], dtype=np.int64)
+        lengths = np.array([len(line["text"]) for line in lines], dtype=np.int64)
+        sizes = np.array([line["size"] for line in lines], dtype=np.float64)
+        return lines, page_of, lengths, sizes
+
+    def _repeated(self, pages, lines):
+        """Mask of running headers/footers (same text near the top or bottom of many pages) and page numbers."""
+        def margin_key(line, page):
+            if page["height"] * 0.08 < line["y"] < page["height"] * 0.92:
+                return None
+            return re.sub(r"\d+", "#", line["text"].lower())
+
+        keys = [margin_key(line, page) for page in pages for line in page["lines"]]
+        counts = Counter(key for key in keys if key is not None)
+        threshold = max(3, len(pages) // 2)
+        return np.array([
+            key is not None and (counts[key] >= threshold or bool(PAGE_NUMBER.match(line["text"])))
+            for key, line in zip(keys, lines)
+        ], dtype=bool)
+
+    def classify(self, pages):
+        """Per-line labels ("heading", "equation", "text" or "skip") and heading size ranks."""
+        lines, _, lengths, sizes = self._features(pages)
+        if not lines:
+            return [], []
+        # Body text size: the size most characters are set in
+        rounded = np.round(sizes * 2).astype(np.int64)
+        body = np.bincount(rounded, weights=lengths).argmax() / 2
+
+        bold = np.array([line["bold"] for line in lines], dtype=bool)
+        first = np.array([line["first"] for line in lines], dtype=bool)
+        math = np.array([line["math"] for line in lines], dtype=np.float64)
+        texts = [line["text"] for line in lines]
+        symbols = np.array([sum(ch in MATH_CHARS for ch in text) for text in texts], dtype=np.float64)
+        words = np.array([len(re.findall(r"[A-Za-z]{3,}", text)) for text in texts], dtype=np.int64)
+        ends_sentence = np.array([text.endswith((".", ",", ";")) for text in texts], dtype=bool)
+        numbered = np.array([bool(NUMBERED_HEADING.match(text)) for text in texts], dtype=bool)
+        number_only = np.array([bool(SECTION_NUMBER.match(text)) for text in texts], dtype=bool)
+        capitals = np.array([text.isupper() and "," not in text for text in texts], dtype=bool) & (words >= 1) & (words <= 6)
+        caption = np.array([bool(CAPTION.match(text)) for text in texts], dtype=bool)
+
+        # Lines grouped by text block; blocks are numbered in order, so each block's lines are contiguous
+        _, block = np.unique([(page["number"], line["block"]) for page in pages for line in page["lines"]],
+                             axis=0, return_inverse=True)
+        block = block.ravel()
+        block_lines = np.bincount(block)[block]
+        # Bold lines with no regular line before them in their block, e.g. "Decoder:" before its paragraph
+        regular_before = np.cumsum(~bold) - ~bold
+        bold_lead = bold & (regular_before == regular_before[np.searchsorted(block, block)])
+        bold_lead_lines = np.bincount(block, weights=bold_lead)[block]
+
+        larger = sizes >= body * 1.15
+        heading = (
+            larger
+            | bold_lead & (bold_lead_lines <= 3)  # a fully bold paragraph is not a heading
+            | first & (block_lines <= 2) & (numbered | capitals) & (lengths <= 80)
+        ) & (lengths <= 120) & (words <= 14) & ~ends_sentence & ~caption & (math < 0.5) & (
+            (words >= 1) | number_only & (bold | larger))  # "3.2" above its title, not a stray subscript
+        equation = ~heading & (lengths <= 200) & ((math >= 0.5) | ((symbols >= 2) & (words <= 3)))
+        labels = np.where(heading, "heading", np.where(equation, "equation", "text")).astype(object)
+        labels[self._repeated(pages, lines)] = "skip"
+
+        # Heading rank by type size: 1 for the largest; 0 for body-size (bold) headings
+        heading_sizes = sorted({size for size in np.round(sizes[heading] * 2) / 2 if size > body}, reverse=True)
+        ranks = [heading_sizes.index(size) + 1 if size in heading_sizes else 0 for size in np.round(sizes * 2) / 2]
+        return list(labels), ranks
+
+    # Elements and packing
+
+    def elements(self, pages):
+        """Headings, paragraphs, display equations and tables of the document, in reading order."""
+        labels, ranks = self.classify(pages)
+        body_rank = max(ranks, default=0) + 1
+        index = 0
+        for page in pages:
+            tables = sorted(page["tables"], key=lambda table: table["bbox"][1])
+            current, current_block = None, None
+            for line in page["lines"]:
+                label, rank = labels[index], ranks[index]
+                index += 1
+                # A table goes before the first line below its top edge
+                while tables and tables[0]["bbox"][1] <= line["y"]:
+                    if current:
+                        yield current
+                    current = None
+                    yield self._table(tables.pop(0), page)
+                if label == "skip":
+                    continue
+                if current is not None and current_block == line["block"] and current["kind"] == label:
+                    # Consecutive heading lines (3.2 / Attention) and a paragraph's lines join up
+                    current["text"] = _join_lines(current["text"], line["text"])
+                    continue
+                if current:
+                    yield current
+                current = {"kind": label, "text": line["text"], "rank": rank, "body_rank": body_rank,
+                           "page": page["number"]}
+                current_block = line["block"]
+            if current:
+                yield current
+            for table in tables:
+                yield self._table(table, page)
+
+    def _reflow(self, elements):
+        """Joins a paragraph cut by a column or page break back up; a caption in the way goes after it."""
+        paragraph, held = None, []
+        for element in elements:
+            if paragraph is not None and element["kind"] == "text" and not paragraph["text"].endswith(PARAGRAPH_END):
+                if CAPTION.match(element["text"]):
+                    held.append(element)
+                else:
+                    paragraph["text"] = _join_lines(paragraph["text"], element["text"])
+                    paragraph["page_end"] = element["page"]
+                continue
+            if paragraph is not None:
+                yield paragraph
+                yield from held
+                paragraph, held = None, []
+            if element["kind"] == "text":
+                paragraph = element
+            else:
+                yield element
+        if paragraph is not None:
+            yield paragraph
+            yield from held
+
+    def _table(self, table, page):
+        return {"kind": "table", "text": _table_text(table["rows"]), "rows": table["rows"], "page": page["number"]}
+
+    def _level(self, heading):
+        """Nesting level of a heading: its size rank, refined by numbering (3 > 3.2 > 3.2.1).
+        Unnumbered body-size headings (bold run-in titles such as "Decoder:") nest below all others."""
+        numbered = NUMBERED_HEADING.match(heading["text"])
+        if numbered:
+            number = numbered.group(1).rstrip(".:")
+            depth = 0 if re.fullmatch(r"[IVX]+", number) else 1 if number.isalpha() else number.count(".")
+            return (heading["rank"] or heading["body_rank"]) * 10 + depth
+        return heading["rank"] * 10 if heading["rank"] else heading["body_rank"] * 10 + 9
+
+    def split_pages(self, pages, metadata):
+        """Packs the document's elements into chunks that start at section boundaries."""
+        sections = []  # [(level, title)] of the current heading path
+        chunk = {"parts": [], "pages": [], "length": 0, "section": "", "body": False}
+
+        def flush():
+            if chunk["body"]:
+                yield Document(page_content="\n".join(chunk["parts"]), metadata={
+                    **metadata, "page": min(chunk["pages"]), "page_end": max(chunk["pages"]),
+                    "section": chunk["section"]})
+            elif chunk["parts"]:
+                return  # only headings so far: they stay to lead the next chunk
+            chunk.update(parts=[], pages=[], length=0, body=False)
+
+        def add(text, element, body):
+            if body and not chunk["body"]:
+                # The chunk belongs to the section its first content is in, which it names for retrieval
+                chunk["section"] = " > ".join(title for _, title in sections)
+                if sections and sections[-1][1] not in chunk["parts"]:
+                    chunk["parts"].append(sections[-1][1])
+                    chunk["length"] += len(sections[-1][1]) + 1
+                chunk["body"] = True
+            chunk["parts"].append(text)
+            chunk["pages"] += [element["page"], element.get("page_end", element["page"])]
+            chunk["length"] += len(text) + 1
+
+        previous = None
+        for element in self._reflow(self.elements(pages)):
+            wrapped, previous = previous == "heading", element["kind"]
+            if element["kind"] == "heading":
+                if chunk["length"] >= self.min_chars:
+                    yield from flush()
+                level = self._level(element)
+                if wrapped and sections and sections[-1][0] == level and chunk["parts"][-1:] == [sections[-1][1]]:
+                    # A title wrapped over two blocks
+                    title = f"{sections[-1][1]} {element['text']}"
+                    sections[-1] = (level, title)
+                    chunk["parts"][-1] = title
+                    chunk["length"] += len(element["text"]) + 1
+                    continue
+                while sections and sections[-1][0] >= level:
+                    sections.pop()
+                sections.append((level, element["text"]))
+                add(element["text"], element, body=False)
+                continue
+
+            for piece in self._pieces(element):
+                if chunk["body"] and chunk["length"] + len(piece) > self.max_chars:
+                    yield from flush()
+                add(piece, element, body=True)
+        yield from flush()
+
+    def _pieces(self, element):
+        """An element cut to fit max_chars: paragraphs at sentence ends, tables between rows
+        (repeating the header). Equations are never cut."""
+        text = element["text"]
+        if len(text) <= self.max_chars or element["kind"] == "equation":
+            return [text]
+        if element["kind"] == "table":
+            header, rows = element["rows"][0], element["rows"][1:]
+            pieces, current = [], [header]
+            for row in rows:
+                if len(current) > 1 and len(_table_text(current + [row])) > self.max_chars:
+                    pieces.append(_table_text(current))
+                    current = [header]
+                current.append(row)
+            return pieces + [_table_text(current)]
+
+        pieces, current = [], ""
+        for sentence in SENTENCE_END.split(text):
+            if current and len(current) + len(sentence) + 1 > self.max_chars:
+                pieces.append(current)
+                current = ""
+            current = f"{current} {sentence}".strip()
+        return pieces + [current] if current else pieces
+
+
+def _join_lines(text, line):
+    """Joins wrapped lines, undoing end-of-line hyphenation."""
+    if text.endswith("-") and line[:1].islower():
+        return text[:-1] + line
+    return f"{text} {line}"
@@ -0,0 +1,62 @@
+import glob
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from quiz_api import ragchat
+from quiz_api.benchmark import synthetic_pdf
+from quiz_api.chunk_bench import compare, sample_queries
+
+CHUNKERS = ("recursive", "layout")
+
+
+class Command(BaseCommand):
+    help = ("Compares PDF chunkers (fixed-size recursive vs layout-aware) on local PDFs: "
+            "chunk counts, index size and retrieval hit rate.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdfs", default=os.path.join(settings.BASE_DIR, "aipoweredlms", "pdfs"),
+                            help="Directory of PDFs to chunk.")
+        parser.add_argument("--synthetic", type=int, default=0, help="Also add this many synthetic course PDFs.")
+        parser.add_argument("--queries-per-pdf", type=int, default=40)
+        parser.add_argument("-k", type=int, default=4)
+        parser.add_argument("--real-embeddings", action="store_true",
+                            help="Embed with Gemini instead of the offline hashed bag-of-words embeddings.")
+        parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        pdfs = []
+        for path in sorted(glob.glob(os.path.join(options["pdfs"], "*.pdf"))):
+            with open(path, "rb") as f:
+                pdfs.append((os.path.basename(path), f.read()))
+        pdfs += [(f"synthetic-{i}.pdf", synthetic_pdf("ml", i)) for i in range(options["synthetic"])]
+        if not pdfs:
+            self.stderr.write(f"No PDFs found in {options['pdfs']}")
+            return
+
+        if options["real_embeddings"]:
+            embeddings = ragchat.make_embeddings()
+        else:
+            from quiz_api.fakes import FakeEmbeddings
+            embeddings = FakeEmbeddings(latency=0)
+
+        queries = sample_queries(pdfs, options["queries_per_pdf"])
+        hit = f"hit_at_{options['k']}"
+        budget_chars = settings.RAG_CONTEXT['TOKEN_BUDGET'] * 4
+        self.stdout.write(f"{len(pdfs)} PDFs, {len(queries)} queries, k={options['k']}, budget {budget_chars} chars")
+        results = {}
+        for chunker in CHUNKERS:
+            row = results[chunker] = compare(pdfs, ragchat.make_text_splitter(chunker), embeddings, queries,
+                                             options["k"], budget_chars)
+            self.stdout.write(
+                f"{chunker:>10}: {row['chunks']} chunks, {row['chars']} chars (mean {row['mean_chars']}, "
+                f"max {row['max_chars']}), duplication {row['duplication']}x, index {row['index_mb']}MB, "
+                f"chunked in {row['chunk_seconds']}s, coverage {row['coverage']}, hit@{options['k']} {row[hit]}, "
+                f"hit@budget {row['hit_at_budget']}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"pdfs": [name for name, _ in pdfs], "queries": len(queries), "k": options["k"],
+                           "budget_chars": budget_chars, "results": results}, f, indent=2)
+            self.stdout.write(f"Results written to {os.path.abspath(options['output'])}")
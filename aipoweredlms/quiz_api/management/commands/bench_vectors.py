@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from quiz_api.vector_bench import BACKENDS
+
+
+class Command(BaseCommand):
+    help = ("Compares vector store backends (NumPy flat, NumPy IVF, Chroma) on synthetic embeddings: "
+            "build time, query latency, recall and resident memory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated chunk counts.")
+        parser.add_argument("--dim", type=int, default=768, help="Embedding size (Gemini embedding-001 is 768).")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("-k", type=int, default=8)
+        parser.add_argument("--backends", default=",".join(BACKENDS))
+        parser.add_argument("--chroma-max-size", type=int, default=100000,
+                            help="Skip Chroma above this size; its HNSW build at 1M chunks takes hours on small machines.")
+        parser.add_argument("--workdir", default=None, help="Where stores are built (needs ~4 GB per million chunks).")
+        parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+
+    def run_phase(self, phase, params):
+        # A fresh interpreter per phase, so each figure only covers that backend
+        result = subprocess.run(
+            [sys.executable, "-m", "quiz_api.vector_bench", phase, json.dumps(params)],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        if result.returncode:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"{phase} failed")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        results = []
+        for size in (int(size) for size in options["sizes"].split(",")):
+            for backend in options["backends"].split(","):
+                row = {"backend": backend, "size": size}
+                results.append(row)
+                if backend == "chroma" and size > options["chroma_max_size"]:
+                    row["skipped"] = f"above --chroma-max-size {options['chroma_max_size']}"
+                    self.stdout.write(f"{backend:>10} {size:>8}: skipped ({row['skipped']})")
+                    continue
+
+                directory = tempfile.mkdtemp(prefix=f"bench-{backend}-{size}-", dir=options["workdir"])
+                params = {"backend": backend, "size": size, "dim": options["dim"],
+                          "queries": options["queries"], "k": options["k"], "directory": directory}
+                recall = f"recall_at_{options['k']}"
+                try:
+                    row.update(self.run_phase("build", params))
+                    row.update(self.run_phase("query", params))
+                except RuntimeError as e:
+                    row["error"] = str(e)
+                    self.stderr.write(f"{backend:>10} {size:>8}: {e}")
+                    continue
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+                self.stdout.write(
+                    f"{backend:>10} {size:>8}: build {row['build_seconds']}s, "
+                    f"p50 {row['p50_ms']}ms, p95 {row['p95_ms']}ms, {recall} {row[recall]}, "
+                    f"rss {row['rss_mb']}MB (anon {row['anon_mb']}, file {row['file_mb']}), disk {row['disk_mb']}MB"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"dim": options["dim"], "queries": options["queries"], "k": options["k"], "results": results}, f, indent=2)
+            self.stdout.write(f"Results written to {os.path.abspath(options['output'])}")
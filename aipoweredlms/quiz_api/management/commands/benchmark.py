@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncRequestFactory
+
+ENDPOINTS = ("chat", "chat_stream", "quiz", "quiz_bulk", "equation", "summarize_stream", "upload_pdf", "upload_file")
+BUCKET = "benchmark-bucket"
+# Metrics compared against --baseline, and whether higher is better
+COMPARED = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "requests_per_sec": True,
+            "pages_per_sec": True, "chunks_per_sec": True}
+
+
+def _peak_rss_mb(who):
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Relative change of each compared metric against baseline; changes worse than threshold are regressions."""
+    changes, regressions = {}, []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            old = previous.get(key) if isinstance(previous, dict) else None
+            if isinstance(value, dict):
+                walk(value, old, path + [key])
+            elif key in COMPARED and isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                change = (value - old) / old
+                name = ".".join(path + [key])
+                changes[name] = round(change, 4)
+                if (-change if COMPARED[key] else change) > threshold:
+                    regressions.append(name)
+
+    walk(results, baseline, [])
+    return changes, regressions
+
+
+class Command(BaseCommand):
+    help = ("Offline benchmark: seeds a moto S3 bucket with synthetic PDFs, ingests them and drives the real views "
+            "with fake Gemini models, reporting ingestion throughput, retrieval latency, per-endpoint "
+            "p50/p95/p99 and peak RSS as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdfs", type=int, default=12, help="Synthetic PDFs seeded into S3 and ingested.")
+        parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic PDF.")
+        parser.add_argument("--requests", type=int, default=40, help="Requests per endpoint.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per endpoint.")
+        parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+        parser.add_argument("--retrieval-queries", type=int, default=100)
+        parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake Gemini seconds to first token.")
+        parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="Fake Gemini output token rate.")
+        parser.add_argument("--answer-tokens", type=int, default=150, help="Length of fake prose answers.")
+        parser.add_argument("--embed-latency", type=float, default=0.02, help="Fake embedding seconds per call.")
+        parser.add_argument("--gemini-rpm", type=float, default=100000,
+                            help="Rate limit applied to the fakes; lower it to exercise queueing and 503s.")
+        parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default=None)
+        parser.add_argument("--run-jobs", action="store_true", help="Also run the queued background jobs and time them.")
+        parser.add_argument("--workdir", default=None, help="Scratch directory (default: a temporary one, removed afterwards).")
+        parser.add_argument("--output", default=None, help="Results file (default: benchmark-results/<UTC time>.json).")
+        parser.add_argument("--baseline", default=None, help="Earlier results file to compare against.")
+        parser.add_argument("--regression-threshold", type=float, default=0.2,
+                            help="Relative slowdown reported as a regression (0.2 = 20%%).")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        from moto import mock_aws
+
+        started_at = datetime.now(timezone.utc)
+        output = os.path.abspath(options["output"] or os.path.join(
+            "benchmark-results", started_at.strftime("%Y%m%dT%H%M%SZ") + ".json"))
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+
+        workdir = os.path.abspath(options["workdir"] or tempfile.mkdtemp(prefix="lms-benchmark-"))
+        os.makedirs(workdir, exist_ok=True)
+        previous_cwd = os.getcwd()
+        self._isolate(workdir, options)
+        try:
+            with mock_aws():
+                results = self._run(options)
+        finally:
+            os.chdir(previous_cwd)
+            if not options["workdir"]:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            "meta": {
+                "started_at": started_at.isoformat(),
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "options": {key: options[key] for key in (
+                    "pdfs", "pages", "requests", "concurrency", "retrieval_queries", "llm_latency", "tokens_per_sec",
+                    "answer_tokens", "embed_latency", "gemini_rpm", "vector_backend")},
+            },
+            **results,
+        }
+        if baseline is not None:
+            changes, regressions = compare(results, baseline, options["regression_threshold"])
+            report["comparison"] = {"baseline": os.path.abspath(options["baseline"]),
+                                    "changes": changes, "regressions": regressions}
+
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Results written to {output}")
+
+        if baseline is not None:
+            for name, change in report["comparison"]["changes"].items():
+                marker = "  ⚠️ regression" if name in report["comparison"]["regressions"] else ""
+                self.stdout.write(f"  {name}: {change:+.1%}{marker}")
+            if report["comparison"]["regressions"] and options["fail_on_regression"]:
+                raise CommandError(f"{len(report['comparison']['regressions'])} metrics regressed")
+
+    def _isolate(self, workdir, options):
+        """Points S3, the database, caches and the vector index at scratch locations and Gemini at fakes."""
+        from quiz_api import clients, fakes, pdf_cache, ragchat
+
+        os.environ.update({"AWS_ACCESS_KEY_ID": "benchmark", "AWS_SECRET_ACCESS_KEY": "benchmark",
+                           "AWS_DEFAULT_REGION": "us-east-1", "AWS_BUCKET_NAME": BUCKET})
+        ragchat.AWS_ACCESS_KEY = ragchat.AWS_SECRET_KEY = "benchmark"
+        ragchat.BUCKET_NAME = BUCKET
+        if options["vector_backend"]:
+            ragchat.VECTOR_BACKEND = options["vector_backend"]
+
+        # Django keeps one settings dict per alias, shared by every thread's connection
+        connections.close_all()
+        connections.settings["default"]["NAME"] = os.path.join(workdir, "benchmark.sqlite3")
+        call_command("migrate", verbosity=0)
+        settings.PDF_CACHE_DIR = os.path.join(workdir, "pdf_cache")
+        pdf_cache._cache = None
+
+        for model_name in clients.GEMINI_RPM:
+            clients.GEMINI_RPM[model_name] = options["gemini_rpm"]
+        clients.DEFAULT_RPM = options["gemini_rpm"]
+        fakes.install(options["llm_latency"], options["tokens_per_sec"], options["answer_tokens"],
+                      options["embed_latency"])
+        # The vector index, embedding cache and keyword index live under ./ paths
+        os.chdir(workdir)
+
+    def _run(self, options):
+        from quiz_api import benchmark, ragchat, views
+        from quiz_api.bulk_ingest import bulk_ingest
+        from quiz_api.vector_bench import memory
+
+        s3 = ragchat.make_s3_client()
+        s3.create_bucket(Bucket=BUCKET)
+        courses = sorted(benchmark.COURSE_TERMS)
+        for i in range(options["pdfs"]):
+            course = courses[i % len(courses)]
+            s3.put_object(Bucket=BUCKET, Key=f"pdfs/{course}/notes-{i}.pdf",
+                          Body=benchmark.synthetic_pdf(course, i, options["pages"]), ContentType="application/pdf")
+        self.stdout.write(f"Seeded {options['pdfs']} synthetic PDFs ({options['pages']} pages each)")
+
+        # Ingestion: the bulk path, with the fake embedder behind the real embedding cache
+        embeddings = ragchat.make_embeddings()
+        vectorstore = ragchat.open_vectorstore(embeddings)
+        ingest = bulk_ingest(s3, BUCKET, vectorstore, embeddings, ragchat.make_text_splitter(), ragchat.VECTOR_DB_DIR,
+                             log=lambda message: None)
+        ingest["rss_mb"] = memory()["rss_mb"]
+        self.stdout.write(f"ingest: {ingest['pages_per_sec']} pages/sec, {ingest['chunks_per_sec']} chunks/sec")
+
+        start = time.perf_counter()
+        ragchat.get_pipeline()
+        pipeline_seconds = round(time.perf_counter() - start, 3)
+
+        queries = benchmark.course_queries(max(options["retrieval_queries"], options["requests"]))
+        retrieval_seconds = []
+        for course, query in queries[:options["retrieval_queries"]]:
+            start = time.perf_counter()
+            ragchat.retrieve(query, course)
+            retrieval_seconds.append(time.perf_counter() - start)
+        retrieval = benchmark.latency_summary(retrieval_seconds)
+        self.stdout.write(f"retrieval: p50 {retrieval['p50_ms']}ms, p95 {retrieval['p95_ms']}ms")
+
+        endpoints = {}
+        for name in options["endpoints"].split(","):
+            view, make_request = self._endpoint(name, views, benchmark, queries)
+            endpoints[name] = asyncio.run(benchmark.drive(view, make_request, options["requests"], options["concurrency"]))
+            stats = endpoints[name]
+            self.stdout.write(f"{name:>16}: {stats['ok']}/{stats['requests']} ok, {stats['requests_per_sec']} req/s, "
+                              f"p50 {stats.get('p50_ms')}ms, p95 {stats.get('p95_ms')}ms, p99 {stats.get('p99_ms')}ms")
+
+        results = {
+            "ingest": ingest,
+            "pipeline_build_seconds": pipeline_seconds,
+            "retrieval": retrieval,
+            "endpoints": endpoints,
+        }
+        if options["run_jobs"]:
+            results["jobs"] = self._run_jobs()
+        results["memory"] = {
+            **memory(),
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_child_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),  # PDF parsing workers
+        }
+        self.stdout.write(f"peak RSS {results['memory']['peak_rss_mb']}MB "
+                          f"(parse workers {results['memory']['peak_child_rss_mb']}MB)")
+        return results
+
+    def _endpoint(self, name, views, benchmark, queries):
+        """(view, make_request(i)) for an endpoint."""
+        factory = AsyncRequestFactory()
+        courses = sorted(benchmark.COURSE_TERMS)
+
+        def json_post(path, body):
+            return factory.post(path, json.dumps(body), content_type="application/json")
+
+        def pdf_upload(i):
+            course = courses[i % len(courses)]
+            # Half the uploads repeat an earlier PDF, as re-uploads do
+            return SimpleUploadedFile(f"upload-{i}.pdf", benchmark.synthetic_pdf(course, 10000 + i // 2, 3),
+                                      content_type="application/pdf")
+
+        def chat(i, stream=False):
+            course, query = queries[i % len(queries)]
+            # A handful of sessions, so later requests are follow-ups within a conversation
+            body = {"prompt": query, "course": course, "session_id": f"benchmark-{i % 5}"}
+            if stream:
+                body["stream"] = "true"
+            return json_post("/api/chat/", body)
+
+        def topic(i):
+            course = courses[i % len(courses)]
+            return course, benchmark.COURSE_TERMS[course][i % len(benchmark.COURSE_TERMS[course])]
+
+        requests = {
+            "chat": (views.chat_api, chat),
+            "chat_stream": (views.chat_api, lambda i: chat(i, stream=True)),
+            "quiz": (views.quiz_api, lambda i: json_post("/api/quiz/", {
+                "prompt": f"{topic(i)[1]} medium", "course": topic(i)[0], "session_id": f"benchmark-{i % 5}"})),
+            "quiz_bulk": (views.bulk_quiz_api, lambda i: json_post("/api/quiz/bulk/", {
+                "topic": topic(i)[1], "course": topic(i)[0], "count": 20})),
+            "equation": (views.get_equation, lambda i: json_post("/api/equation/", {
+                "curve_name": ["parabola", "ellipse", "hyperbola", "cardioid"][i % 4]})),
+            "summarize_stream": (views.summarize_pdf, lambda i: factory.post("/api/summarize_pdf/", {
+                "file": pdf_upload(i), "user_query": queries[i % len(queries)][1], "stream": "true"})),
+            "upload_pdf": (views.upload_pdf, lambda i: factory.post("/api/upload_pdf/", {"file": pdf_upload(i)})),
+            "upload_file": (views.upload_file, lambda i: factory.post("/api/upload_file/", {
+                "file": pdf_upload(i), "course": courses[i % len(courses)]})),
+        }
+        if name not in requests:
+            raise CommandError(f"Unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        return requests[name]
+
+    def _run_jobs(self):
+        """Runs the jobs the endpoints queued and reports how long each took from enqueue to finish."""
+        from quiz_api import benchmark
+        from quiz_api.jobs import JobWorker
+        from quiz_api.models import Job
+
+        start = time.perf_counter()
+        worker = JobWorker()
+        worker.start()
+        while Job.objects.filter(status__in=[Job.QUEUED, Job.RUNNING]).exists():
+            time.sleep(0.2)
+        worker.stop(timeout=5)
+        elapsed = time.perf_counter() - start
+
+        jobs = {}
+        for kind in Job.objects.values_list("kind", flat=True).distinct():
+            finished = Job.objects.filter(kind=kind, finished_at__isnull=False)
+            durations = [(job.finished_at - job.created_at).total_seconds() for job in finished]
+            jobs[kind] = {
+                "jobs": len(durations),
+                "failed": finished.filter(status=Job.FAILED).count(),
+                **benchmark.latency_summary(durations),
+            }
+        jobs["seconds"] = round(elapsed, 3)
+        self.stdout.write(f"jobs: {json.dumps(jobs)}")
+        return jobs
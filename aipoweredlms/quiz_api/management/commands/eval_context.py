@@ -0,0 +1,95 @@
+import json
+import re
+from django.core.management.base import BaseCommand
+from quiz_api.context_builder import estimate_tokens, _shingles
+from quiz_api.ragchat import get_pipeline, make_retriever
+
+
+def _content_words(text):
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 3}
+
+
+def grounding(answer, context):
+    """Share of the answer's content words that appear in the context."""
+    words = _content_words(answer)
+    return round(len(words & _content_words(context)) / len(words), 3) if words else 0.0
+
+
+def coverage(reference_docs, docs):
+    """Share of the reference context's 5-word shingles still present in the candidate context."""
+    reference = set().union(*(_shingles(doc.page_content) for doc in reference_docs)) if reference_docs else set()
+    candidate = set().union(*(_shingles(doc.page_content) for doc in docs)) if docs else set()
+    return round(len(reference & candidate) / len(reference), 3) if reference else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Compares prompt size and grounding of the plain top-k retriever against the "
+            "token-budgeted MMR context builder over a file of questions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("questions", help='JSON list of questions, or of {"question": ..., "keywords": [...]}')
+        parser.add_argument("--baseline-k", type=int, default=15)
+        parser.add_argument("--reference-k", type=int, default=5,
+                            help="Top-k similarity chunks whose content the budgeted context should keep.")
+        parser.add_argument("--generate", action="store_true", help="Also answer with Gemini and score grounding.")
+        parser.add_argument("--output", default=None, help="Write the full report as JSON.")
+
+    def handle(self, *args, **options):
+        with open(options["questions"], "r", encoding="utf-8") as f:
+            questions = [item if isinstance(item, dict) else {"question": item} for item in json.load(f)]
+
+        pipeline = get_pipeline()
+        budgeted = make_retriever(pipeline.vectorstore, pipeline.keyword_index)
+        rows = []
+
+        for item in questions:
+            question = item["question"]
+            strategies = {
+                "baseline": pipeline.vectorstore.similarity_search(question, k=options["baseline_k"]),
+                "budgeted": budgeted.invoke(question),
+            }
+            reference = strategies["baseline"][:options["reference_k"]]
+            row = {"question": question}
+
+            for name, docs in strategies.items():
+                context = "\n\n".join(doc.page_content for doc in docs)
+                result = {
+                    "chunks": len(docs),
+                    "context_chars": len(context),
+                    "context_tokens_est": estimate_tokens(context),
+                    "reference_coverage": coverage(reference, docs),
+                }
+                if item.get("keywords"):
+                    found = [kw for kw in item["keywords"] if kw.lower() in context.lower()]
+                    result["keyword_recall"] = round(len(found) / len(item["keywords"]), 3)
+                if options["generate"]:
+                    messages = pipeline.prompt.invoke({"input": question, "context": context})
+                    message = pipeline.llm.invoke(messages)
+                    result["answer_grounding"] = grounding(message.content, context)
+                    usage = getattr(message, "usage_metadata", None)
+                    if usage:
+                        result["llm_input_tokens"] = usage.get("input_tokens")
+                row[name] = result
+            rows.append(row)
+
+        summary = self._summarize(rows)
+        for name, metrics in summary.items():
+            self.stdout.write(f"{name}: " + ", ".join(f"{key}={value}" for key, value in metrics.items()))
+        baseline_tokens = summary["baseline"]["context_tokens_est"]
+        if baseline_tokens:
+            reduction = 1 - summary["budgeted"]["context_tokens_est"] / baseline_tokens
+            self.stdout.write(f"prompt context reduced by {reduction:.0%}")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump({"summary": summary, "questions": rows}, f, indent=2)
+
+    def _summarize(self, rows):
+        summary = {}
+        for name in ("baseline", "budgeted"):
+            metrics = {}
+            for key in rows[0][name] if rows else []:
+                values = [row[name][key] for row in rows if row[name].get(key) is not None]
+                metrics[key] = round(sum(values) / len(values), 3) if values else None
+            summary[name] = metrics
+        return summary
@@ -0,0 +1,54 @@
+from botocore.config import Config
+from django.core.management.base import BaseCommand
+from quiz_api import ragchat
+from quiz_api.bulk_ingest import bulk_ingest
+
+
+class Command(BaseCommand):
+    help = "Indexes every PDF under the S3 prefix in parallel and reports pages/sec and chunks/sec."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="pdfs/")
+        parser.add_argument("--bucket", default=ragchat.BUCKET_NAME)
+        parser.add_argument("--persist-directory", default=ragchat.VECTOR_DB_DIR)
+        parser.add_argument("--backend", choices=["chroma", "numpy"], default=ragchat.VECTOR_BACKEND)
+        parser.add_argument("--chunker", choices=["layout", "recursive"], default=ragchat.PDF_CHUNKER)
+        parser.add_argument("--download-workers", type=int, default=16)
+        parser.add_argument("--parse-workers", type=int, default=None, help="Defaults to the number of CPUs.")
+        parser.add_argument("--embed-batch-size", type=int, default=100)
+        parser.add_argument("--embed-concurrency", type=int, default=4)
+        parser.add_argument("--endpoint-url", default=None, help="Alternative S3 endpoint, e.g. a local moto server.")
+        parser.add_argument("--fake-embeddings", type=int, default=None, metavar="DIM",
+                            help="Use deterministic fake embeddings of this size instead of Gemini.")
+
+    def handle(self, *args, **options):
+        s3_client = ragchat.make_s3_client(
+            endpoint_url=options["endpoint_url"],
+            config=Config(max_pool_connections=options["download_workers"]),
+        )
+
+        if options["fake_embeddings"]:
+            from langchain_core.embeddings import DeterministicFakeEmbedding
+            embeddings = DeterministicFakeEmbedding(size=options["fake_embeddings"])
+        else:
+            embeddings = ragchat.make_embeddings()
+
+        vectorstore = ragchat.open_vectorstore(embeddings, options["persist_directory"], options["backend"])
+        stats = bulk_ingest(
+            s3_client, options["bucket"], vectorstore, embeddings, ragchat.make_text_splitter(options["chunker"]),
+            options["persist_directory"],
+            prefix=options["prefix"],
+            download_workers=options["download_workers"],
+            parse_workers=options["parse_workers"],
+            embed_batch_size=options["embed_batch_size"],
+            embed_concurrency=options["embed_concurrency"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            f"{stats['added']} added, {stats['updated']} updated, {stats['removed']} removed, {stats['failed']} failed; "
+            f"{stats['pages']} pages, {stats['chunks']} chunks in {stats['seconds']}s "
+            f"({stats['pages_per_sec']} pages/sec, {stats['chunks_per_sec']} chunks/sec)"
+        )
+        if hasattr(vectorstore, "optimize"):
+            # Compacts after deletes and builds the IVF index once the corpus is large enough
+            self.stdout.write(f"Vector store optimized: {vectorstore.optimize()}")
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from quiz_api import ragchat, views
+
+
+class StubChain:
+    """Stands in for rag_chain; sleeps for the configured LLM latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def invoke(self, inputs):
+        time.sleep(self.latency)
+        return {"answer": f"stub answer for {inputs['input']}"}
+
+    async def ainvoke(self, inputs):
+        await asyncio.sleep(self.latency)
+        return {"answer": f"stub answer for {inputs['input']}"}
+
+
+class StubPipeline:
+    def __init__(self, latency):
+        self.rag_chain = StubChain(latency)
+
+
+@api_view(['POST'])
+def legacy_chat_api(request):
+    """The blocking chat view as it was before the async rewrite."""
+    chat_response = ragchat.get_rag_response(request.data.get('prompt'))
+    return Response({'status': 'success', 'response': chat_response})
+
+
+class Command(BaseCommand):
+    help = "Compares chat requests/second per worker for the blocking and async views using a stubbed LLM."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients.")
+        parser.add_argument("--latency", type=float, default=0.5, help="Stub LLM latency in seconds.")
+        parser.add_argument("--threads", type=int, default=1, help="Threads of the blocking worker (gunicorn sync default is 1).")
+
+    def handle(self, *args, **options):
+        ragchat._pipeline = StubPipeline(options["latency"])
+        body = json.dumps({"prompt": "what is backpropagation"})
+        total = options["requests"]
+
+        factory = RequestFactory()
+
+        def sync_request(_):
+            request = factory.post("/api/chat/", body, content_type="application/json")
+            return legacy_chat_api(request).status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            statuses = list(pool.map(sync_request, range(total)))
+        sync_elapsed = time.perf_counter() - start
+        self._report("blocking view", statuses, sync_elapsed)
+
+        async_factory = AsyncRequestFactory()
+
+        async def run_async():
+            clients = asyncio.Semaphore(options["concurrency"])
+
+            async def one():
+                async with clients:
+                    request = async_factory.post("/api/chat/", body, content_type="application/json")
+                    response = await views.chat_api(request)
+                    return response.status_code
+
+            return await asyncio.gather(*(one() for _ in range(total)))
+
+        start = time.perf_counter()
+        statuses = asyncio.run(run_async())
+        async_elapsed = time.perf_counter() - start
+        self._report("async view", statuses, async_elapsed)
+
+        self.stdout.write(f"speed-up: {sync_elapsed / async_elapsed:.1f}x")
+
+    def _report(self, label, statuses, elapsed):
+        ok = sum(1 for status in statuses if status == 200)
+        self.stdout.write(f"{label}: {ok}/{len(statuses)} ok in {elapsed:.2f}s -> {len(statuses) / elapsed:.1f} req/s per worker")
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from quiz_api.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = ("Runs background workers for queued PDF structuring and summarization jobs. "
+            "Set JOB_RUN_IN_PROCESS=0 on the web processes when using dedicated workers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Jobs run at once by this process (defaults to JOBS['CONCURRENCY']).")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="Seconds between queue checks when idle (defaults to JOBS['POLL_SECONDS']).")
+
+    def handle(self, *args, **options):
+        worker = JobWorker(options["concurrency"], options["poll_interval"])
+        worker.start()
+        self.stdout.write(f"Job worker {worker.name} running {worker.concurrency} jobs at a time, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, waiting for running jobs to finish...")
+            worker.stop()
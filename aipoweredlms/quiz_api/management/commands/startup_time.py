@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so nothing is already imported or cached
+MEASURE_SCRIPT = """
+import os, time, json
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aipoweredlms.settings')
+import django
+django.setup()
+import quiz_api.views
+boot = time.perf_counter() - start
+result = {"boot_seconds": round(boot, 3)}
+if os.environ.get("MEASURE_WARMUP") == "1":
+    from quiz_api.ragchat import get_pipeline, STARTUP_TIMINGS
+    get_pipeline()
+    result.update(STARTUP_TIMINGS)
+print(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures how long a worker takes to import the app, and optionally to warm the RAG pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--warmup", action="store_true", help="Also build the RAG pipeline and report its timings.")
+
+    def handle(self, *args, **options):
+        env = {"RAG_WARMUP_ON_START": "0"}
+        if options["warmup"]:
+            env["MEASURE_WARMUP"] = "1"
+
+        for run in range(options["runs"]):
+            result = subprocess.run(
+                [sys.executable, "-c", MEASURE_SCRIPT],
+                capture_output=True, text=True, env={**os.environ, **env}, check=True
+            )
+            self.stdout.write(f"run {run + 1}: {result.stdout.strip().splitlines()[-1]}")
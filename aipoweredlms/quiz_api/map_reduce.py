@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .concurrency import llm_slot
+
+# Documents larger than one map chunk are split, mapped concurrently and reduced;
+# sizes and parallelism come from settings.MAP_REDUCE
+CHARS_PER_TOKEN = 4
+
+
+def split_document(text, chunk_tokens=None):
+    """Splits text into map chunks of about chunk_tokens tokens; short texts stay whole."""
+    chunk_chars = (chunk_tokens or settings.MAP_REDUCE['CHUNK_TOKENS']) * CHARS_PER_TOKEN
+    if len(text) <= chunk_chars:
+        return [text]
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_chars, chunk_overlap=settings.MAP_REDUCE['CHUNK_OVERLAP'])
+    return splitter.split_text(text)
+
+
+def group_by_budget(parts, token_budget=None):
+    """Packs consecutive parts into groups that each fit the reduce token budget (at least two per group)."""
+    budget_chars = (token_budget or settings.MAP_REDUCE['REDUCE_TOKEN_BUDGET']) * CHARS_PER_TOKEN
+    groups, current, size = [], [], 0
+    for part in parts:
+        if current and size + len(part) > budget_chars and len(current) > 1:
+            groups.append(current)
+            current, size = [], 0
+        current.append(part)
+        size += len(part)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def fits_budget(parts, token_budget=None):
+    return sum(len(part) for part in parts) <= (token_budget or settings.MAP_REDUCE['REDUCE_TOKEN_BUDGET']) * CHARS_PER_TOKEN
+
+
+def run_map(items, fn, parallelism=None):
+    """Applies fn to every item on a bounded thread pool, keeping input order."""
+    if len(items) == 1:
+        return [fn(items[0])]
+    with ThreadPoolExecutor(max_workers=min(parallelism or settings.MAP_REDUCE['PARALLELISM'], len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+async def arun_map(items, fn, parallelism=None):
+    """Awaits fn (a coroutine function) for every item, at most parallelism at a time, keeping input order.
+
+    Each call also holds an LLM slot, so a long document shares the worker's LLM budget with other requests.
+    """
+    semaphore = asyncio.Semaphore(parallelism or settings.MAP_REDUCE['PARALLELISM'])
+
+    async def bounded(item):
+        async with semaphore, llm_slot():
+            return await fn(item)
+
+    return await asyncio.gather(*(bounded(item) for item in items))
+
+
+def reduce_to_budget(parts, combine, token_budget=None, parallelism=None):
+    """Combines groups of parts concurrently, level by level, until they fit one reduce prompt."""
+    while len(parts) > 1 and not fits_budget(parts, token_budget):
+        parts = run_map(group_by_budget(parts, token_budget), combine, parallelism)
+    return parts
+
+
+async def areduce_to_budget(parts, combine, token_budget=None, parallelism=None):
+    """Async variant of reduce_to_budget; combine is a coroutine function."""
+    while len(parts) > 1 and not fits_budget(parts, token_budget):
+        parts = await arun_map(group_by_budget(parts, token_budget), combine, parallelism)
+    return parts
+
+
+def merge_json(a, b):
+    """Deep-merges two partial JSON documents: same keys merge, lists concatenate, texts join."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = merge_json(merged[key], value) if key in merged else value
+        return merged
+    if a == b or b in (None, "", [], {}):
+        return a
+    if a in (None, "", [], {}):
+        return b
+    if isinstance(a, str) and isinstance(b, str):
+        return f"{a}\n{b}"
+    if isinstance(a, list) or isinstance(b, list):
+        a_items = a if isinstance(a, list) else [a]
+        return a_items + [item for item in (b if isinstance(b, list) else [b]) if item not in a_items]
+    return [a, b]
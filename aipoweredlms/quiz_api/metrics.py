@@ -0,0 +1,206 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+# Per-request trace: {"spans": [(stage, seconds)], "values": {name: number}}
+_trace = ContextVar("quiz_api_trace", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+COUNT_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition layout."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (metric, labels tuple) -> Histogram
+        self._help = {}
+
+    def observe(self, metric, value, labels, buckets, help_text):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help[metric] = help_text
+            histogram.observe(value)
+
+    def render(self):
+        """Renders every histogram in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for metric in sorted(self._help):
+                lines.append(f"# HELP {metric} {self._help[metric]}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (name, labels), histogram in sorted(self._histograms.items()):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {cumulative}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {histogram.total}")
+                    lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(stage):
+    """Times one pipeline stage of the current request (a no-op outside requests)."""
+    trace = _trace.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace["spans"].append((stage, time.perf_counter() - start))
+
+
+def record_value(name, value):
+    """Attaches a number (context size, token counts, ...) to the current request."""
+    trace = _trace.get()
+    if trace is not None:
+        trace["values"][name] = trace["values"].get(name, 0) + value
+
+
+def server_timing(trace, total=None):
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in trace["spans"]]
+    parts += [f'{name};desc="{value}"' for name, value in trace["values"].items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def observe_request(endpoint, trace, total):
+    registry.observe("lms_request_duration_seconds", total, {"endpoint": endpoint},
+                     LATENCY_BUCKETS, "End-to-end request latency per endpoint.")
+    for stage, seconds in trace["spans"]:
+        registry.observe("lms_stage_duration_seconds", seconds, {"endpoint": endpoint, "stage": stage},
+                         LATENCY_BUCKETS, "Latency of each RAG pipeline stage per endpoint.")
+    for name, value in trace["values"].items():
+        buckets = COUNT_BUCKETS if name.endswith(("_chunks", "_mcqs")) else SIZE_BUCKETS
+        registry.observe(f"lms_{name}", value, {"endpoint": endpoint},
+                         buckets, f"Per-request {name.replace('_', ' ')}.")
+
+
+def _endpoint(request):
+    try:
+        return resolve(request.path_info).url_name or "unknown"
+    except Resolver404:
+        return "not_found"
+
+
+class MetricsMiddleware:
+    """Traces each request: adds a Server-Timing header and feeds the /metrics histograms."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace, token, start = self._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            _trace.reset(token)
+        return self._finish(request, response, trace, start)
+
+    async def __acall__(self, request):
+        trace, token, start = self._begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _trace.reset(token)
+        return self._finish(request, response, trace, start)
+
+    def _begin(self):
+        trace = {"spans": [], "values": {}}
+        return trace, _trace.set(trace), time.perf_counter()
+
+    def _finish(self, request, response, trace, start):
+        endpoint = _endpoint(request)
+        if response.streaming:
+            # Headers go out before generation, so only the stages so far appear in Server-Timing;
+            # the histograms get the full latency once the stream closes
+            response["Server-Timing"] = server_timing(trace)
+            content = response.streaming_content
+            if response.is_async:
+                response.streaming_content = _atraced(content, endpoint, trace, start)
+            else:
+                response.streaming_content = _traced(iter(content), endpoint, trace, start)
+            return response
+        total = time.perf_counter() - start
+        if endpoint != "metrics":
+            observe_request(endpoint, trace, total)
+        response["Server-Timing"] = server_timing(trace, total)
+        return response
+
+
+def _traced(content, endpoint, trace, start):
+    """Passes a streamed body through, running each step under the request's trace; observed on close."""
+    try:
+        while True:
+            token = _trace.set(trace)
+            try:
+                chunk = next(content)
+            except StopIteration:
+                return
+            finally:
+                _trace.reset(token)
+            yield chunk
+    finally:
+        observe_request(endpoint, trace, time.perf_counter() - start)
+
+
+async def _atraced(content, endpoint, trace, start):
+    """Async variant of _traced."""
+    try:
+        while True:
+            token = _trace.set(trace)
+            try:
+                chunk = await content.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                _trace.reset(token)
+            yield chunk
+    finally:
+        observe_request(endpoint, trace, time.perf_counter() - start)
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
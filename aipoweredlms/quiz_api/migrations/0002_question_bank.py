@@ -0,0 +1,71 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=1024, unique=True)),
+                ('course', models.CharField(db_index=True, max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector_id', models.CharField(max_length=1100, unique=True)),
+                ('page', models.IntegerField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='quiz_api.document')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MCQ',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255)),
+                ('difficulty', models.PositiveSmallIntegerField()),
+                ('question', models.TextField()),
+                ('options', models.JSONField(default=dict)),
+                ('answer', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('chunks', models.ManyToManyField(blank=True, related_name='mcqs', to='quiz_api.chunk')),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mcqs', to='quiz_api.document')),
+            ],
+            options={
+                'verbose_name': 'MCQ',
+            },
+        ),
+        migrations.CreateModel(
+            name='SeenMCQ',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=64)),
+                ('served_at', models.DateTimeField(auto_now_add=True)),
+                ('mcq', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seen_by', to='quiz_api.mcq')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mcq',
+            index=models.Index(fields=['topic', 'difficulty'], name='mcq_topic_difficulty'),
+        ),
+        migrations.AddIndex(
+            model_name='mcq',
+            index=models.Index(fields=['document', 'difficulty'], name='mcq_document_difficulty'),
+        ),
+        migrations.AddConstraint(
+            model_name='seenmcq',
+            constraint=models.UniqueConstraint(fields=('session_key', 'mcq'), name='seen_mcq_unique_session_mcq'),
+        ),
+    ]
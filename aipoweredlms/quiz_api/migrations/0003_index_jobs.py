@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_api', '0002_question_bank'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('structure', 'Structure PDF'), ('summary', 'Summarize PDF'), ('index', 'Index uploaded PDF')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_api', '0003_index_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=64, unique=True)),
+                ('course', models.CharField(blank=True, max_length=64)),
+                ('document', models.CharField(blank=True, max_length=1024)),
+                ('summary', models.TextField(blank=True)),
+                ('turns', models.JSONField(blank=True, default=list)),
+                ('chunk_ids', models.JSONField(blank=True, default=list)),
+                ('topic_embedding', models.JSONField(blank=True, default=list)),
+                ('index_version', models.BigIntegerField(default=0)),
+                ('context_cache', models.CharField(blank=True, max_length=255)),
+                ('context_cache_expires', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
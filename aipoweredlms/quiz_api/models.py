@@ -1,3 +1,168 @@
+import uuid
 from django.db import models
 
 # Create your models here.
+
+
+class Job(models.Model):
+    """A long-running task (PDF structuring, summarization or indexing an upload) queued for a background worker."""
+
+    KIND_STRUCTURE = 'structure'
+    KIND_SUMMARY = 'summary'
+    KIND_INDEX = 'index'
+    KIND_CHOICES = [
+        (KIND_STRUCTURE, 'Structure PDF'),
+        (KIND_SUMMARY, 'Summarize PDF'),
+        (KIND_INDEX, 'Index uploaded PDF'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    # Statuses an identical request joins instead of queuing its own job
+    ACTIVE = (QUEUED, RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    # Hash of kind, PDF digest (S3 ETag for index jobs), prompt version and parameters; identical requests share one job
+    dedup_key = models.CharField(max_length=64)
+    pdf_digest = models.CharField(max_length=64)
+    params = models.JSONField(default=dict, blank=True)
+    # Extracted PDF text, dropped once the job has finished
+    input_text = models.TextField(blank=True)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after'),
+            models.Index(fields=['finished_at'], name='job_finished_at'),  # retention sweep
+        ]
+        constraints = [
+            # At most one queued or running job per identical request; finished jobs are never reused,
+            # so a PDF re-uploaded after its index entry was dropped gets indexed again
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='job_unique_active_dedup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class Document(models.Model):
+    """A PDF in the knowledge base, identified by its S3 key (pdfs/<course>/<file>.pdf)."""
+
+    key = models.CharField(max_length=1024, unique=True)
+    course = models.CharField(max_length=64, db_index=True)
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Chunk(models.Model):
+    """A chunk of a Document as stored in the vector index."""
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    vector_id = models.CharField(max_length=1100, unique=True)
+    page = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return self.vector_id
+
+
+class MCQ(models.Model):
+    """A generated multiple-choice question, kept so repeat quiz requests are served from the bank."""
+
+    # normalize_prompt() of the requested topic
+    topic = models.CharField(max_length=255)
+    # 1-10, as assigned by mcq_prompt (Easy 1-3, Medium 4-6, Hard 7-10)
+    difficulty = models.PositiveSmallIntegerField()
+    question = models.TextField()
+    options = models.JSONField(default=dict)
+    answer = models.CharField(max_length=10)
+    # Document of the best-matching chunk the question was generated from
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='mcqs')
+    chunks = models.ManyToManyField(Chunk, blank=True, related_name='mcqs')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'MCQ'
+        indexes = [
+            models.Index(fields=['topic', 'difficulty'], name='mcq_topic_difficulty'),
+            models.Index(fields=['document', 'difficulty'], name='mcq_document_difficulty'),
+        ]
+
+    def __str__(self):
+        return self.question[:80]
+
+    def as_dict(self):
+        """Same shape as the MCQs returned by the LLM, plus the bank ID."""
+        return {
+            'id': self.id,
+            'question': self.question,
+            'options': self.options,
+            'answer': self.answer,
+            'difficulty': self.difficulty,
+        }
+
+
+class SeenMCQ(models.Model):
+    """Records which questions a quiz session has already been served."""
+
+    session_key = models.CharField(max_length=64)
+    mcq = models.ForeignKey(MCQ, on_delete=models.CASCADE, related_name='seen_by')
+    served_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'mcq'], name='seen_mcq_unique_session_mcq'),
+        ]
+
+
+class Conversation(models.Model):
+    """Multi-turn chat state of a session: recent exchanges, a rolling summary of older ones and the chunks in use."""
+
+    session_key = models.CharField(max_length=64, unique=True)
+    # Scope the conversation was held in; changing it starts a new conversation
+    course = models.CharField(max_length=64, blank=True)
+    document = models.CharField(max_length=1024, blank=True)
+    summary = models.TextField(blank=True)
+    # Most recent exchanges, oldest first: [{"user": ..., "assistant": ...}]
+    turns = models.JSONField(default=list, blank=True)
+    # Chunks the current topic is answered from, the query embedding they were retrieved for and the index version
+    chunk_ids = models.JSONField(default=list, blank=True)
+    topic_embedding = models.JSONField(default=list, blank=True)
+    index_version = models.BigIntegerField(default=0)
+    # Gemini cached-content resource holding the system prompt and those chunks
+    context_cache = models.CharField(max_length=255, blank=True)
+    context_cache_expires = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.session_key} ({len(self.turns)} turns)"
@@ -0,0 +1,513 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+# Local vector store: a memory-mapped float32 matrix searched with vectorized NumPy,
+# plus an optional IVF index with int8-quantized vectors for large corpora. Texts and
+# metadata live in SQLite next to it. Worker processes open the files read-only, so
+# the OS page cache holds one copy of the vectors however many workers there are.
+VECTORS_NAME = "vectors.f32"
+META_NAME = "vectors.sqlite3"
+IVF_PREFIX = "ivf-"
+
+# IVF is only built for corpora at least this large; below it a flat scan is as fast
+IVF_MIN_ROWS = int(os.getenv("NUMPY_IVF_MIN_ROWS", "100000"))
+# Inverted lists scanned per query, and how many quantized candidates per result are re-scored exactly
+IVF_NPROBE = int(os.getenv("NUMPY_IVF_NPROBE", "32"))
+IVF_RERANK = int(os.getenv("NUMPY_IVF_RERANK", "4"))
+KMEANS_ITERATIONS = 10
+# Compact the vector file once this share of its rows belongs to deleted chunks
+COMPACT_DEAD_RATIO = 0.2
+SCORE_BATCH_ROWS = 65536
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def _where(filter):
+    """SQL condition for a Chroma-style metadata filter ({"field": value}, $eq, $in, $and, $or)."""
+    if not filter:
+        return "1", []
+    clauses, params = [], []
+    for field, value in filter.items():
+        if field in ("$and", "$or"):
+            parts = [_where(condition) for condition in value]
+            joiner = " AND " if field == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params += [param for _, part_params in parts for param in part_params]
+            continue
+        column = "json_extract(metadata, ?)"
+        if isinstance(value, dict) and "$in" in value:
+            clauses.append(f"{column} IN ({','.join('?' * len(value['$in']))})")
+            params += [f"$.{field}", *value["$in"]]
+        else:
+            clauses.append(f"{column} = ?")
+            params += [f"$.{field}", value["$eq"] if isinstance(value, dict) else value]
+    return " AND ".join(clauses), params
+
+
+def kmeans(vectors, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized vectors; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=clusters) == 0
+        # Reseed empty clusters so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IvfIndex:
+    """Inverted-file index over the rows present when it was built.
+
+    Rows are grouped by nearest centroid (order/offsets in CSR form) and stored as int8
+    codes with a per-row scale; queries scan nprobe lists on the codes and re-score the
+    best candidates with the exact float32 vectors.
+    """
+
+    FILES = ("centroids", "order", "offsets", "codes", "scales")
+
+    def __init__(self, directory, built_rows):
+        self.directory = directory
+        self.built_rows = built_rows
+        for name in self.FILES:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+
+    @classmethod
+    def build(cls, directory, matrix, rows, lists=None, sample_size=None):
+        """Clusters the given rows of matrix and writes the index files to directory."""
+        lists = lists or max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        sample = rows if len(rows) <= (sample_size or lists * 64) else rng.choice(rows, sample_size or lists * 64, replace=False)
+        centroids = kmeans(np.asarray(matrix[np.sort(sample)]), lists)
+
+        assignment = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), SCORE_BATCH_ROWS):
+            batch = np.asarray(matrix[rows[start:start + SCORE_BATCH_ROWS]])
+            assignment[start:start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+        by_list = np.argsort(assignment, kind="stable")
+        order = rows[by_list].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=lists))]).astype(np.int64)
+
+        os.makedirs(directory, exist_ok=True)
+        codes = np.lib.format.open_memmap(os.path.join(directory, "codes.npy"), mode="w+",
+                                          dtype=np.int8, shape=(len(order), matrix.shape[1]))
+        scales = np.empty(len(order), dtype=np.float32)
+        for start in range(0, len(order), SCORE_BATCH_ROWS):
+            batch = np.asarray(matrix[order[start:start + SCORE_BATCH_ROWS]])
+            batch_scales = np.abs(batch).max(axis=1) / 127
+            batch_scales[batch_scales == 0] = 1
+            codes[start:start + len(batch)] = np.round(batch / batch_scales[:, None]).astype(np.int8)
+            scales[start:start + len(batch)] = batch_scales
+        codes.flush()
+        del codes
+        for name, array in (("centroids", centroids), ("order", order), ("offsets", offsets), ("scales", scales)):
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    def candidates(self, query, nprobe, count):
+        """Up to count rows most similar to the query by their quantized vectors."""
+        probes = top_k(self.centroids @ query, min(nprobe, len(self.centroids)))
+        positions = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes])
+        if not len(positions):
+            return positions
+        scores = (self.codes[positions].astype(np.float32) @ query) * self.scales[positions]
+        return np.asarray(self.order[positions[top_k(scores, count)]])
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store backed by a memory-mapped float32 matrix, searched by cosine similarity.
+
+    Writers (from any process) are serialized by SQLite's write lock; each write bumps a
+    generation counter that readers check to pick up new or deleted chunks.
+    """
+
+    def __init__(self, embedding_function=None, persist_directory="./vector_db_numpy", nprobe=None):
+        self._embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.nprobe = nprobe or IVF_NPROBE
+        os.makedirs(persist_directory, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._state = None  # (generation, file name, dim, live rows, live mask, IvfIndex or None)
+        self._matrix_cache = None  # (file name, row count, memmap)
+        self._filter_cache = {}
+        self._init_schema()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    # SQLite metadata ----------------------------------------------------------
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.persist_directory, META_NAME), timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")  # readers in other workers never block
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO info VALUES ('generation', '0'), ('next_row', '0'), "
+                     "('vectors_file', ?), ('dim', '0'), ('ivf', ''), ('ivf_rows', '0')", (VECTORS_NAME,))
+
+    def _info(self, conn=None):
+        return dict((conn or self._connection()).execute("SELECT key, value FROM info"))
+
+    def _set_info(self, conn, **values):
+        conn.executemany("UPDATE info SET value = ? WHERE key = ?", [(str(v), k) for k, v in values.items()])
+
+    def _write(self, fn):
+        """Runs fn(conn, info) in an immediate transaction and bumps the generation."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            info = self._info(conn)
+            result = fn(conn, info)
+            self._set_info(conn, generation=int(info["generation"]) + 1)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    # Matrix and live rows -----------------------------------------------------
+
+    def _load_state(self):
+        """Current (generation, vectors file, dim, live rows, live mask, IVF index); reloaded only after a write."""
+        conn = self._connection()
+        generation = int(conn.execute("SELECT value FROM info WHERE key = 'generation'").fetchone()[0])
+        with self._lock:
+            if self._state is not None and self._state[0] == generation:
+                return self._state
+        info = self._info(conn)
+        rows = np.fromiter((row for (row,) in conn.execute("SELECT row FROM chunks ORDER BY row")), dtype=np.int64)
+        mask = np.zeros(int(info["next_row"]), dtype=bool)
+        mask[rows] = True
+        ivf = None
+        if info["ivf"]:
+            directory = os.path.join(self.persist_directory, info["ivf"])
+            previous = self._state[5] if self._state else None
+            ivf = previous if previous and previous.directory == directory else IvfIndex(directory, int(info["ivf_rows"]))
+        state = (int(info["generation"]), info["vectors_file"], int(info["dim"]), rows, mask, ivf)
+        with self._lock:
+            self._state, self._filter_cache = state, {}
+        return state
+
+    def _matrix(self, file_name, dim, rows_needed):
+        """Read-only memmap of the vectors file covering at least rows_needed rows."""
+        with self._lock:
+            cached = self._matrix_cache
+            if cached and cached[0] == file_name and cached[1] >= rows_needed:
+                return cached[2]
+        path = os.path.join(self.persist_directory, file_name)
+        row_count = os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+        matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(row_count, dim)) if row_count else np.empty((0, max(dim, 1)), np.float32)
+        with self._lock:
+            self._matrix_cache = (file_name, row_count, matrix)
+        return matrix
+
+    def _filtered_rows(self, filter):
+        if not filter:
+            return None
+        key = json.dumps(filter, sort_keys=True)
+        with self._lock:
+            if key in self._filter_cache:
+                return self._filter_cache[key]
+        sql, params = _where(filter)
+        rows = np.fromiter((row for (row,) in self._connection().execute(
+            f"SELECT row FROM chunks WHERE {sql} ORDER BY row", params)), dtype=np.int64)
+        with self._lock:
+            if len(self._filter_cache) > 256:
+                self._filter_cache.clear()
+            self._filter_cache[key] = rows
+        return rows
+
+    # Writes -------------------------------------------------------------------
+
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        """Adds (or replaces) chunks with precomputed embeddings; the Chroma collection call bulk_ingest uses."""
+        if not ids:
+            return
+        vectors = normalize(embeddings)
+        metadatas = metadatas or [{} for _ in ids]
+
+        def write(conn, info):
+            dim = int(info["dim"]) or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match the store's {dim}")
+            start = int(info["next_row"])
+            path = os.path.join(self.persist_directory, info["vectors_file"])
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.pwrite(fd, vectors.tobytes(), start * dim * 4)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+            conn.executemany(
+                "INSERT INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(start + i, doc_id, text or "", json.dumps(metadata or {}))
+                 for i, (doc_id, text, metadata) in enumerate(zip(ids, documents, metadatas))],
+            )
+            self._set_info(conn, next_row=start + len(ids), dim=dim)
+
+        self._write(write)
+
+    def update(self, ids, metadatas):
+        """Replaces chunk metadata without touching vectors (Chroma collection API)."""
+        def write(conn, info):
+            conn.executemany("UPDATE chunks SET metadata = ? WHERE id = ?",
+                             [(json.dumps(metadata or {}), doc_id) for doc_id, metadata in zip(ids, metadatas)])
+        self._write(write)
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @property
+    def _collection(self):
+        # indexing and bulk_ingest use Chroma's collection API (count/update/upsert); this store provides it itself
+        return self
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [f"chunk-{time.time_ns()}-{i}" for i in range(len(texts))]
+        self.upsert(ids, self._embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            self._write(lambda conn, info: conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids]))
+        return True
+
+    def reset_collection(self):
+        def write(conn, info):
+            conn.execute("DELETE FROM chunks")
+            self._set_info(conn, next_row=0, dim=0, ivf="", ivf_rows=0, vectors_file=f"vectors-{time.time_ns()}.f32")
+        self._write(write)
+        self._remove_unused_files()
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=None, where=None):
+        """Chunks by ID (or all, paged), in the shape Chroma's get returns."""
+        sql, params = _where(where)
+        if ids is not None:
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params += list(ids)
+        query = f"SELECT row, id, document, metadata FROM chunks WHERE {sql} ORDER BY row"
+        if limit is not None:
+            query += f" LIMIT {int(limit)} OFFSET {int(offset or 0)}"
+        found = self._connection().execute(query, params).fetchall()
+        result = {"ids": [doc_id for _, doc_id, _, _ in found]}
+        if "documents" in include:
+            result["documents"] = [document for _, _, document, _ in found]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(metadata) for _, _, _, metadata in found]
+        if "embeddings" in include:
+            state = self._load_state()
+            rows = np.array([row for row, _, _, _ in found], dtype=np.int64)
+            matrix = self._matrix(state[1], state[2], int(rows.max()) + 1 if len(rows) else 0)
+            result["embeddings"] = np.asarray(matrix[rows]) if len(rows) else np.empty((0, state[2]), np.float32)
+        return result
+
+    # Search -------------------------------------------------------------------
+
+    def search_rows(self, embedding, k, filter=None, exact=False, state=None):
+        """(rows, scores) of the k chunks most similar to embedding, best first.
+
+        Uses the IVF index when there is one (rows added after it was built are scanned
+        exactly), otherwise a vectorized scan of the whole matrix.
+        """
+        generation, file_name, dim, live, mask, ivf = state or self._load_state()
+        if not len(live) or not dim:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        query = normalize(embedding)
+        # The file can run past the committed rows (a writer between its pwrite and COMMIT, or one that crashed there)
+        matrix = self._matrix(file_name, dim, len(mask))[:len(mask)]
+        allowed = self._filtered_rows(filter)
+        if exact:
+            ivf = None
+        if ivf is not None:
+            candidates = ivf.candidates(query, self.nprobe, k * IVF_RERANK)
+            rows = np.concatenate([candidates, np.arange(ivf.built_rows, len(mask))])
+            rows = rows[mask[rows]]
+            if allowed is not None:
+                rows = rows[np.isin(rows, allowed)]
+                if len(rows) < k <= len(allowed):
+                    # A narrow filter can starve the probed lists; scan its rows instead
+                    rows = allowed
+        else:
+            rows = allowed
+
+        if rows is None:
+            scores = np.empty(len(mask), dtype=np.float32)
+            for start in range(0, len(mask), SCORE_BATCH_ROWS):
+                scores[start:start + SCORE_BATCH_ROWS] = matrix[start:start + SCORE_BATCH_ROWS] @ query
+            scores[~mask] = -np.inf
+            best = top_k(scores, min(k, len(live)))
+            return best, scores[best]
+        if not len(rows):
+            return rows, np.empty(0, np.float32)
+        rows = np.sort(rows)
+        scores = np.asarray(matrix[rows]) @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _documents(self, rows):
+        """Documents for rows, keeping their order (rows deleted meanwhile are skipped)."""
+        rows = [int(row) for row in rows]
+        found = {}
+        conn = self._connection()
+        for i in range(0, len(rows), 500):
+            batch = rows[i:i + 500]
+            for row, doc_id, document, metadata in conn.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch):
+                found[row] = Document(page_content=document, metadata=json.loads(metadata), id=doc_id)
+        return [(row, found[row]) for row in rows if row in found]
+
+    def _search(self, embedding, k, filter, select=None):
+        """[(document, score)] for the best k rows, optionally re-selected by select(rows, matrix).
+
+        compact() renumbers rows, so a search that raced with it is simply run again.
+        """
+        while True:
+            state = self._load_state()
+            rows, scores = self.search_rows(embedding, k, filter, state=state)
+            if select is not None and len(rows):
+                chosen = select(rows, self._matrix(state[1], state[2], len(state[4])))
+                rows, scores = rows[chosen], scores[chosen]
+            docs = self._documents(rows)
+            if self._info()["vectors_file"] == state[1]:
+                score_of = dict(zip(rows.tolist(), scores.tolist()))
+                return [(doc, score_of[row]) for row, doc in docs]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        """(document, cosine similarity) pairs, most similar first."""
+        return self._search(embedding, k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self._search(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self._search(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k, filter)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        query = normalize(embedding)
+
+        def select(rows, matrix):
+            return maximal_marginal_relevance(query, np.asarray(matrix[rows]), lambda_mult=lambda_mult, k=min(k, len(rows)))
+
+        return [doc for doc, _ in self._search(embedding, fetch_k, filter, select)]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory="./vector_db_numpy", **kwargs):
+        store = cls(embedding, persist_directory)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    # Maintenance --------------------------------------------------------------
+
+    def compact(self):
+        """Rewrites the vector file without rows of deleted chunks. Returns the rows dropped."""
+        def write(conn, info):
+            dim, old_file = int(info["dim"]), info["vectors_file"]
+            rows = np.fromiter((row for (row,) in conn.execute("SELECT row FROM chunks ORDER BY row")), dtype=np.int64)
+            dropped = int(info["next_row"]) - len(rows)
+            if not dropped or not dim:
+                return 0
+            new_file = f"vectors-{time.time_ns()}.f32"
+            matrix = np.memmap(os.path.join(self.persist_directory, old_file), dtype=np.float32, mode="r",
+                               shape=(int(info["next_row"]), dim))
+            with open(os.path.join(self.persist_directory, new_file), "wb") as f:
+                for start in range(0, len(rows), SCORE_BATCH_ROWS):
+                    f.write(np.asarray(matrix[rows[start:start + SCORE_BATCH_ROWS]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # Renumber in ascending order so new rows never collide with old ones mid-update
+            conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                             [(new, int(old)) for new, old in enumerate(rows)])
+            self._set_info(conn, next_row=len(rows), vectors_file=new_file, ivf="", ivf_rows=0)
+            return dropped
+
+        dropped = self._write(write)
+        self._remove_unused_files()
+        return dropped
+
+    def build_ivf(self, lists=None):
+        """Builds the IVF index over every live chunk; queries start using it immediately."""
+        generation, file_name, dim, live, mask, _ = self._load_state()
+        directory = f"{IVF_PREFIX}{time.time_ns()}"
+        IvfIndex.build(os.path.join(self.persist_directory, directory), self._matrix(file_name, dim, len(mask)), live, lists)
+
+        def write(conn, info):
+            if info["vectors_file"] != file_name:
+                raise RuntimeError("The vector file was compacted while the IVF index was being built")
+            self._set_info(conn, ivf=directory, ivf_rows=len(mask))
+
+        self._write(write)
+        self._remove_unused_files()
+        return {"rows": len(live), "lists": len(np.load(os.path.join(self.persist_directory, directory, "centroids.npy"), mmap_mode="r"))}
+
+    def optimize(self):
+        """Compacts after heavy deletes and (re)builds IVF for large corpora; run after bulk ingests."""
+        info = self._info()
+        live = self.count()
+        stats = {"rows": live, "compacted": 0, "ivf": None}
+        if int(info["next_row"]) and 1 - live / int(info["next_row"]) >= COMPACT_DEAD_RATIO:
+            stats["compacted"] = self.compact()
+            info = self._info()
+        unindexed = int(info["next_row"]) - int(info["ivf_rows"])
+        if live >= IVF_MIN_ROWS and (not info["ivf"] or unindexed > 0.1 * live):
+            stats["ivf"] = self.build_ivf()
+        return stats
+
+    def _remove_unused_files(self):
+        """Deletes old vector files and IVF directories (open memmaps in other processes stay valid)."""
+        info = self._info()
+        for name in os.listdir(self.persist_directory):
+            path = os.path.join(self.persist_directory, name)
+            if name.endswith(".f32") and name != info["vectors_file"]:
+                os.remove(path)
+            elif name.startswith(IVF_PREFIX) and name != info["ivf"]:
+                shutil.rmtree(path, ignore_errors=True)
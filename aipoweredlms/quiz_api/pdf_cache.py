@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from django.conf import settings
+
+# Eviction trims the cache to this fraction of max_bytes, so a full cache is walked
+# once per ~10% of turnover rather than on every write
+EVICT_TO = 0.9
+
+
+class PdfCache:
+    """Bounded on-disk cache of PDF-derived results, keyed by the SHA-256 of the PDF bytes.
+
+    Reads refresh a file's mtime, so eviction removes the least recently used files
+    once the directory grows past max_bytes. Writes keep a running size total, so the
+    directory is only walked when that total crosses the limit; each walk re-syncs the
+    total with what other workers wrote meanwhile.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk as of the last walk plus this process's writes since
+
+    def _path(self, digest, name):
+        return os.path.join(self.directory, digest[:2], f"{digest}.{name}")
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        written = os.stat(tmp_path).st_size
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += written - replaced
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        """Walks the directory and, if it is over max_bytes, removes least recently used files down to EVICT_TO."""
+        with self._lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes if total <= self.max_bytes else self.max_bytes * EVICT_TO
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._size = total
+
+    def get_text(self, digest):
+        """Returns the extracted text of a PDF, or None if it was never parsed."""
+        return self._read(self._path(digest, "txt"))
+
+    def set_text(self, digest, text):
+        self._write(self._path(digest, "txt"), text)
+
+    def get_result(self, digest, kind, version, key=""):
+        """Returns a cached LLM result for this PDF, prompt kind/version and optional extra key."""
+        data = self._read(self._path(digest, _result_name(kind, version, key)))
+        return json.loads(data) if data is not None else None
+
+    def set_result(self, digest, kind, version, value, key=""):
+        self._write(self._path(digest, _result_name(kind, version, key)), json.dumps(value))
+
+
+def _result_name(kind, version, key):
+    suffix = f"-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}" if key else ""
+    return f"{kind}-{version}{suffix}.json"
+
+
+_cache = None
+
+
+def get_pdf_cache():
+    global _cache
+    if _cache is None:
+        _cache = PdfCache(settings.PDF_CACHE_DIR, settings.PDF_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,82 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+import fitz  # PyMuPDF for extracting text from PDFs
+from langchain_core.documents import Document
+
+
+@contextmanager
+def open_pdf(source):
+    """Opens a PDF with PyMuPDF without copying it through a temp file.
+
+    source may be a filesystem path, raw bytes, an mmap, or a binary file-like
+    object (S3 StreamingBody, Django upload, BytesIO).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        doc = fitz.open(source)  # MuPDF reads pages from disk on demand
+    elif isinstance(source, (bytes, bytearray, memoryview, io.BytesIO)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    elif isinstance(source, mmap.mmap):
+        doc = fitz.open(stream=memoryview(source), filetype="pdf")
+    elif hasattr(source, "temporary_file_path"):
+        doc = fitz.open(source.temporary_file_path())  # Django already spooled it to disk
+    else:
+        doc = fitz.open(stream=source.read(), filetype="pdf")
+    try:
+        yield doc
+    finally:
+        doc.close()
+
+
+def iter_pages(source, metadata=None):
+    """Lazily yields one Document per non-empty page, in the PyPDFLoader metadata layout."""
+    metadata = metadata or {}
+    with open_pdf(source) as doc:
+        for page in doc:
+            text = page.get_text("text")
+            if text.strip():
+                yield Document(page_content=text, metadata={**metadata, "page": page.number})
+
+
+def iter_chunks(pages, text_splitter):
+    """Splits pages as they are produced instead of materialising the whole document."""
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+def iter_pdf_chunks(source, text_splitter, metadata=None):
+    """Chunks of a PDF: from its layout when the splitter reads PDFs itself (LayoutChunker),
+    otherwise page text through text_splitter."""
+    if hasattr(text_splitter, "split_pdf"):
+        return text_splitter.split_pdf(source, metadata)
+    return iter_chunks(iter_pages(source, metadata), text_splitter)
+
+
+def chunker_name(text_splitter):
+    """Identifies how chunks were made, so the index re-ingests PDFs when the chunker changes."""
+    return getattr(text_splitter, "name", "recursive")
+
+
+def extract_text(source):
+    """Returns the plain text of a PDF, pages separated by newlines."""
+    with open_pdf(source) as doc:
+        return "\n".join(page.get_text("text") for page in doc).strip()
+
+
+def read_upload(uploaded_file, digest):
+    """Returns a parseable source for a Django upload, feeding its bytes to digest.
+
+    Small uploads stay in memory; large ones are opened from Django's own temp file,
+    so nothing is rewritten to MEDIA_ROOT.
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+        return uploaded_file.temporary_file_path()
+
+    buffer = bytearray()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+        buffer.extend(chunk)
+    return bytes(buffer)
@@ -1,51 +1,123 @@
-import os
-import fitz  # PyMuPDF for extracting text from PDFs
-import google.generativeai as genai
-from dotenv import load_dotenv
+import json
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from .pdf_ingest import extract_text
+from .map_reduce import split_document, run_map, arun_map, merge_json
+from .clients import gemini_model
+from .structured_output import CONTINUE_PROMPT, count, join_continuation, parse_topic_tree
 
-# Load API key from .env file
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
-
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a text-based PDF (no OCR needed)."""
-    text = ""
+def extract_text_from_pdf(pdf_source):
+    """Extracts text from a text-based PDF (no OCR needed); accepts a path, bytes or a stream."""
     try:
-        doc = fitz.open(pdf_path)
-        text = "\n".join([page.get_text("text") for page in doc])
+        return extract_text(pdf_source)
     except Exception as e:
         print(f"Error extracting text: {e}")
-    return text.strip()
+        return ""
 
-def generate_json_with_gemini(pdf_text):
-    """Sends extracted PDF text to Gemini and returns the structured JSON response."""
-    model = genai.GenerativeModel("gemini-1.5-pro")
-    
-    fixed_query = f"""
+# Bump whenever the structuring prompt changes so cached results are not reused
+STRUCTURING_PROMPT_VERSION = "v2"
+
+def build_structuring_prompt(pdf_text, part=None):
+    """Builds the prompt that asks Gemini to turn the document (or one (index, total) part of it) into topic JSON."""
+    scope = f"This is part {part[0]} of {part[1]} of the document; cover only the topics in this part.\n" if part else ""
+    return f"""
     I want you to go through every single topic and make it one JSON key.  
     Then, go through every subpoint of that unit and write a **detailed description**  
     for each point in the "subpoints" section.  
     Next, go to the next topic (1, 2, 3, ... till the last one).  
     **Ensure the JSON is as detailed as possible**.
-
+    {scope}
     **Here is the document content:**
-    {pdf_text[:5000]}  # Limiting input size.
+    {pdf_text}
 
     **Return only valid JSON output. Do not include any extra text or explanations.**
     """
-    
-    response = model.generate_content(fixed_query)
-    json_output = response.text.strip()
-    
-    # Remove triple backticks if Gemini adds them
+
+def strip_json_fences(json_output):
+    """Removes the ```json fences Gemini sometimes wraps around its output."""
+    json_output = json_output.strip()
     if json_output.startswith("```json"):
         json_output = json_output[7:]  # Remove ```json
     if json_output.endswith("```"):
         json_output = json_output[:-3]  # Remove closing ```
-    
     return json_output
+
+def _continuation_contents(prompt, partial):
+    """The original prompt plus the cut-off reply, asking Gemini for only the rest."""
+    return [
+        {"role": "user", "parts": [prompt]},
+        {"role": "model", "parts": [partial]},
+        {"role": "user", "parts": [CONTINUE_PROMPT]},
+    ]
+
+def _record_tree(text, tree, repaired, continued):
+    if continued:
+        count("continued")
+    if tree is None:
+        return
+    count("repaired" if repaired or continued else "clean")
+    try:
+        json.loads(strip_json_fences(text))
+    except json.JSONDecodeError:
+        # The old path returned this text unvalidated
+        count("retries_avoided")
+
+def _structure_part(model, prompt):
+    """Topic JSON (a dict) for one structuring prompt, or None if the reply is unusable.
+
+    Fences and trailing commas are repaired locally; a cut-off reply is completed by
+    asking only for its missing tail.
+    """
+    text = model.generate_content(prompt).text
+    tree, repaired, truncated = parse_topic_tree(text)
+    if truncated:
+        tail = model.generate_content(_continuation_contents(prompt, text)).text
+        tree = parse_topic_tree(join_continuation(text, tail))[0] or tree
+    _record_tree(text, tree, repaired, truncated)
+    return tree
+
+async def _astructure_part(model, prompt):
+    """Async variant of _structure_part."""
+    text = (await model.generate_content_async(prompt)).text
+    tree, repaired, truncated = parse_topic_tree(text)
+    if truncated:
+        tail = (await model.generate_content_async(_continuation_contents(prompt, text))).text
+        tree = parse_topic_tree(join_continuation(text, tail))[0] or tree
+    _record_tree(text, tree, repaired, truncated)
+    return tree
+
+def _structuring_prompts(pdf_text):
+    parts = split_document(pdf_text)
+    if len(parts) == 1:
+        return [build_structuring_prompt(pdf_text)]
+    return [build_structuring_prompt(part, (index, len(parts))) for index, part in enumerate(parts, 1)]
+
+def merge_topic_json(trees):
+    """Merges the topic JSON of every part locally (no reduce call); unusable parts are skipped.
+
+    Raises ValueError if no part produced usable JSON, so the job is retried.
+    """
+    merged = None
+    for index, tree in enumerate(trees, 1):
+        if tree is None:
+            print(f"⚠️ Part {index} of {len(trees)} did not return valid topic JSON, skipping it.")
+            continue
+        merged = tree if merged is None else merge_json(merged, tree)
+    if merged is None:
+        raise ValueError("Gemini did not return valid topic JSON")
+    return json.dumps(merged, indent=2, ensure_ascii=False)
+
+def generate_json_with_gemini(pdf_text):
+    """Sends extracted PDF text to Gemini and returns the schema-checked topic JSON.
+
+    Long documents are structured part by part on a bounded thread pool and merged.
+    """
+    model = gemini_model("gemini-1.5-pro")
+    return merge_topic_json(run_map(_structuring_prompts(pdf_text), lambda prompt: _structure_part(model, prompt)))
+
+async def agenerate_json_with_gemini(pdf_text):
+    """Async variant of generate_json_with_gemini."""
+    model = gemini_model("gemini-1.5-pro")
+    return merge_topic_json(await arun_map(_structuring_prompts(pdf_text), lambda prompt: _astructure_part(model, prompt)))
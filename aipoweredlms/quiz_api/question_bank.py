@@ -0,0 +1,137 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from .bulk_quiz import McqDeduper
+from .indexing import chunk_metadata, key_from_chunk_id
+from .metrics import record_value, span
+from .models import Chunk, Document, MCQ, SeenMCQ
+from .semantic_cache import normalize_prompt
+from .single_flight import flight_key, single_flight
+
+# mcq_prompt's difficulty bands
+DIFFICULTY_RANGES = {"Easy": (1, 3), "Medium": (4, 6), "Hard": (7, 10)}
+
+
+def bank_queryset(topic, difficulty, course=None, document=None):
+    """Banked MCQs for a topic and difficulty band, optionally within a course/document."""
+    mcqs = MCQ.objects.filter(topic=normalize_prompt(topic), difficulty__range=DIFFICULTY_RANGES[difficulty])
+    if course:
+        mcqs = mcqs.filter(document__course=course)
+    if document:
+        mcqs = mcqs.filter(document__name=document)
+    return mcqs
+
+
+def unseen_mcqs(topic, difficulty, count, course=None, document=None, session_key=None):
+    """Up to count banked MCQs this session has not been served yet (any MCQs without a session)."""
+    mcqs = bank_queryset(topic, difficulty, course, document)
+    if session_key:
+        mcqs = mcqs.exclude(id__in=SeenMCQ.objects.filter(session_key=session_key).values('mcq_id'))
+    return list(mcqs.order_by('created_at')[:count])
+
+
+def record_chunk(doc):
+    """Document and Chunk rows for a retrieved vector-store chunk."""
+    key = doc.metadata.get("source") or key_from_chunk_id(doc.id)
+    tags = chunk_metadata(key)
+    document, _ = Document.objects.get_or_create(key=key, defaults={"course": tags["course"], "name": tags["document"]})
+    chunk, _ = Chunk.objects.get_or_create(
+        vector_id=doc.id, defaults={"document": document, "page": doc.metadata.get("page")})
+    return chunk
+
+
+def _difficulty_level(value, difficulty):
+    low, high = DIFFICULTY_RANGES[difficulty]
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        level = (low + high) // 2
+    return min(max(level, low), high)
+
+
+def store_mcqs(topic, difficulty, mcqs, docs):
+    """Saves generated MCQs that are not near-duplicates of the topic's bank; returns the new rows."""
+    normalized = normalize_prompt(topic)
+    deduper = McqDeduper(settings.BULK_QUIZ['DEDUPE_THRESHOLD'])
+    banked = MCQ.objects.filter(topic=normalized).order_by('-created_at').values_list('question', flat=True)
+    deduper.filter([{"question": question} for question in banked[:settings.QUESTION_BANK['DEDUPE_WINDOW']]])
+    fresh = deduper.filter(mcqs)
+    if not fresh:
+        return []
+
+    with transaction.atomic():
+        chunks = [record_chunk(doc) for doc in docs if doc.id]
+        rows = [
+            MCQ.objects.create(
+                topic=normalized,
+                difficulty=_difficulty_level(mcq.get("difficulty"), difficulty),
+                question=str(mcq.get("question", "")),
+                options=mcq.get("options") or {},
+                answer=str(mcq.get("answer", ""))[:10],
+                document=chunks[0].document if chunks else None,
+            )
+            for mcq in fresh
+        ]
+        for row in rows:
+            row.chunks.set(chunks)
+    return rows
+
+
+def mark_seen(session_key, rows):
+    if session_key and rows:
+        SeenMCQ.objects.bulk_create(
+            [SeenMCQ(session_key=session_key, mcq=row) for row in rows], ignore_conflicts=True)
+
+
+def rows_by_id(ids):
+    rows = MCQ.objects.in_bulk(ids)
+    return [rows[mcq_id] for mcq_id in ids if mcq_id in rows]
+
+
+def _shortfall_key(topic, difficulty, shortfall, course, document, model_key):
+    return flight_key("quiz", normalize_prompt(topic), difficulty, shortfall, course, document, *model_key)
+
+
+def serve_quiz(topic, difficulty, count, generate, course=None, document=None, session_key=None, model_key=()):
+    """Serves count MCQs from the bank and generates only the shortfall.
+
+    generate(n) returns (mcqs, retrieved_docs) for n new questions. Identical requests
+    (same topic, difficulty, scope, shortfall and model_key) that arrive while a shortfall
+    is being generated wait for it and are served the same new questions.
+    """
+    with span("bank"):
+        served = unseen_mcqs(topic, difficulty, count, course, document, session_key)
+    record_value("bank_mcqs", len(served))
+
+    shortfall = count - len(served)
+    if shortfall > 0:
+        def bank_shortfall():
+            mcqs, docs = generate(shortfall)
+            return [row.id for row in store_mcqs(topic, difficulty, mcqs, docs)]
+
+        key = _shortfall_key(topic, difficulty, shortfall, course, document, model_key)
+        served += rows_by_id(single_flight("quiz").do(key, bank_shortfall))[:shortfall]
+
+    mark_seen(session_key, served)
+    return [row.as_dict() for row in served]
+
+
+async def aserve_quiz(topic, difficulty, count, agenerate, course=None, document=None, session_key=None,
+                      model_key=()):
+    """Async variant of serve_quiz; agenerate is a coroutine function."""
+    with span("bank"):
+        served = await sync_to_async(unseen_mcqs)(topic, difficulty, count, course, document, session_key)
+    record_value("bank_mcqs", len(served))
+
+    shortfall = count - len(served)
+    if shortfall > 0:
+        async def bank_shortfall():
+            mcqs, docs = await agenerate(shortfall)
+            return [row.id for row in await sync_to_async(store_mcqs)(topic, difficulty, mcqs, docs)]
+
+        key = _shortfall_key(topic, difficulty, shortfall, course, document, model_key)
+        ids = await single_flight("quiz").ado(key, bank_shortfall)
+        served += (await sync_to_async(rows_by_id)(ids))[:shortfall]
+
+    await sync_to_async(mark_seen)(session_key, served)
+    return [row.as_dict() for row in served]
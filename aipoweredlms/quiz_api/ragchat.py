@@ -1,16 +1,21 @@
 import os
-import io
-import json
 import re
-import boto3
+import time
+import threading
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv  # Load .env files
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from django.conf import settings
+from . import conversation as memory
+from .clients import chat_model_guards, s3_client
+from .concurrency import llm_slot
+from .indexing import index_version
+from .keyword_index import is_lexical_query
+from .semantic_cache import SemanticCache
+from .metrics import span, record_value
+from .structured_output import (
+    CONTINUE_PROMPT, McqStreamParser, join_continuation, parse_mcq_output, record_mcq_outcome,
+    count as count_output,
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,65 +26,20 @@ AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
 
-if not API_KEY:
-    raise ValueError("GOOGLE_API_KEY is missing from .env file!")
-if not AWS_ACCESS_KEY or not AWS_SECRET_KEY or not BUCKET_NAME:
-    raise ValueError("AWS credentials or bucket name missing from .env file!")
-
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY
-)
-
-# Get list of PDFs from S3 bucket
-data = []
-response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix='pdfs/')
-for obj in response.get('Contents', []):
-    if obj['Key'].endswith('.pdf'):
-        # Download PDF from S3
-        pdf_obj = s3_client.get_object(Bucket=BUCKET_NAME, Key=obj['Key'])
-        pdf_content = pdf_obj['Body'].read()
-        
-        # Create a temporary file-like object
-        pdf_file = io.BytesIO(pdf_content)
-        
-        # Save BytesIO to temporary file
-        import tempfile
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
-            temp_pdf.write(pdf_content)
-            temp_path = temp_pdf.name
-        
-        # Load PDF content using file path
-        loader = PyPDFLoader(temp_path)
-        data.extend(loader.load())
-        
-        # Clean up temp file
-        os.unlink(temp_path)
-
-# Split documents
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=500)
-docs = text_splitter.split_documents(data)
-
-# Create embeddings
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-# Store in ChromaDB
-vectorstore = Chroma.from_documents(
-    documents=docs, 
-    embedding=embeddings,
-    persist_directory="./vector_db"
-)
+# "chroma" (default) or "numpy": the memory-mapped NumPy/IVF store in numpy_store.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_DB_DIR = "./vector_db" if VECTOR_BACKEND == "chroma" else f"./vector_db_{VECTOR_BACKEND}"
+# Embeddings are the same whichever backend stores them, so the cache is shared
+EMBEDDING_CACHE_PATH = "./vector_db/embedding_cache.sqlite3"
+EMBEDDING_MODEL = "models/embedding-001"
+# "recursive" (default): fixed-size text splits; "layout": heading/table/equation-aware chunks from layout_chunker.py.
+# Switching re-ingests every PDF, as the chunker is part of each manifest entry's fingerprint.
+PDF_CHUNKER = os.getenv("PDF_CHUNKER", "recursive")
+# Processes laying out the pages of one PDF with the layout chunker (bulk_ingest already parses PDFs in parallel)
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", "1"))
 
-# Define retriever
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 15})
+_module_start = time.perf_counter()
 
-# LLM setup for chat
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.5, max_tokens=800)
-
-# LLM setup for quiz
-quiz_llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.7, max_tokens=4000, response_format="json")
 
 # Improved prompt for chat
 system_prompt = (
@@ -90,17 +50,8 @@ system_prompt = (
     "\n\nContext:\n{context}"
 )
 
-# Chat prompt
-prompt = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("human", "{input}"),
-])
-
-# MCQ Prompt Template
-mcq_prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are an AI MCQ generator. Your response MUST be STRICT JSON."),
-    ("human", 
-        """
+# MCQ prompt
+mcq_human_prompt = """
         Generate multiple-choice questions (MCQs) on the topic "{topic}" with {difficulty} difficulty.
         Generate a dynamic number of questions based on content richness.
         
@@ -125,21 +76,508 @@ mcq_prompt = ChatPromptTemplate.from_messages([
         - Return JSON ONLY.
         - No explanations, comments, or extra text.
         """
+
+# Bulk MCQ prompt: one batch of a question bank, grounded in a group of retrieved chunks
+bulk_mcq_human_prompt = """
+        Generate exactly {count} multiple-choice questions (MCQs) on the topic "{topic}" with {difficulty} difficulty,
+        using only the study material below. Cover different facts; do not repeat questions.
+
+        **Study Material:**
+        {context}
+
+        **Strict Difficulty Assignment:**
+        - If 'Easy', all MCQs must be in range (1-3).
+        - If 'Medium', all MCQs must be in range (4-6).
+        - If 'Hard', all MCQs must be in range (7-10).
+
+        **Format Response as JSON:**
+        {{
+          "mcqs": [
+            {{
+              "question": "What is AI?",
+              "options": {{"A": "Artificial Intelligence", "B": "Automated Input", "C": "Analog Information", "D": "None"}},
+              "answer": "A",
+              "difficulty": 7
+            }}
+          ]
+        }}
+
+        **IMPORTANT:** 
+        - Return JSON ONLY.
+        - No explanations, comments, or extra text.
+        """
+
+
+def make_text_splitter(chunker=None):
+    if (chunker or PDF_CHUNKER) == "layout":
+        from .layout_chunker import LayoutChunker
+        return LayoutChunker(page_workers=PDF_PAGE_WORKERS)
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=500)
+
+
+def make_embedder():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+
+
+def make_embeddings():
+    """Gemini embeddings behind the persistent, deduplicating embedding cache."""
+    from .embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(
+        make_embedder(),
+        EMBEDDING_CACHE_PATH,
+        namespace=EMBEDDING_MODEL,
+        batch_size=int(os.getenv("EMBED_BATCH_SIZE", "100")),
+        query_cache_size=int(os.getenv("EMBED_QUERY_CACHE_SIZE", "1024")),
     )
-])
 
-# Chains for chat
-question_answer_chain = create_stuff_documents_chain(llm, prompt)
-rag_chain = create_retrieval_chain(retriever, question_answer_chain)
 
-def get_rag_response(user_input: str) -> str:
-    """Fetches a response from the RAG model for the given user input."""
-    response = rag_chain.invoke({"input": user_input})
+def make_chat_model(model, **kwargs):
+    """Gemini chat model sharing that model's rate limiter and circuit breaker with the other endpoints."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, **kwargs, **chat_model_guards(model))
+
+
+def open_vectorstore(embeddings, persist_directory=VECTOR_DB_DIR, backend=None):
+    if (backend or VECTOR_BACKEND) == "numpy":
+        from .numpy_store import NumpyVectorStore
+        return NumpyVectorStore(embeddings, persist_directory)
+    from langchain_chroma import Chroma
+    return Chroma(embedding_function=embeddings, persist_directory=persist_directory)
+
+
+def make_s3_client(**client_kwargs):
+    """Returns the shared S3 client, or a dedicated one when boto3.client kwargs are given."""
+    if not AWS_ACCESS_KEY or not AWS_SECRET_KEY or not BUCKET_NAME:
+        raise ValueError("AWS credentials or bucket name missing from .env file!")
+    if not client_kwargs:
+        return s3_client()
+    import boto3
+    return boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        **client_kwargs
+    )
+
+
+def make_retriever(vectorstore, keyword_index=None, **search_kwargs):
+    from .context_builder import BudgetedRetriever
+    options = settings.RAG_CONTEXT
+    return BudgetedRetriever(
+        vectorstore=vectorstore,
+        keyword_index=keyword_index,
+        rrf_k=options['RRF_K'],
+        fetch_k=options['FETCH_K'],
+        max_chunks=options['MAX_CHUNKS'],
+        lambda_mult=options['MMR_LAMBDA'],
+        token_budget=options['TOKEN_BUDGET'],
+        dedupe_threshold=options['DEDUPE_THRESHOLD'],
+        search_kwargs=search_kwargs,
+    )
+
+
+class RagPipeline:
+    """Retriever, LLM clients and chains. Built once per process by get_pipeline()."""
+
+    def __init__(self):
+        # Heavy imports stay here so importing this module (and Django) stays fast
+        from langchain.chains import create_retrieval_chain
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from .indexing import has_manifest, retag_chunks, sync_vector_index
+        from .keyword_index import ensure_keyword_index
+
+        if not API_KEY:
+            raise ValueError("GOOGLE_API_KEY is missing from .env file!")
+
+        # Split documents
+        self.text_splitter = make_text_splitter()
+
+        # Create embeddings
+        self.embeddings = make_embeddings()
+
+        # Open the persisted ChromaDB; only PDFs that changed since the last run get embedded
+        self.vectorstore = open_vectorstore(self.embeddings)
+
+        # Warm starts reuse the existing index; set RAG_SYNC_ON_START=1 to pick up S3 changes
+        if not has_manifest(VECTOR_DB_DIR) or os.getenv("RAG_SYNC_ON_START") == "1":
+            sync_stats = sync_vector_index(make_s3_client(), BUCKET_NAME, self.vectorstore, self.text_splitter, VECTOR_DB_DIR)
+            print(f"Vector index synced: {len(sync_stats['added'])} added, "
+                  f"{len(sync_stats['updated'])} updated, {len(sync_stats['removed'])} removed")
+
+        # Chunks embedded before course scoping get their course/document tags in place
+        retagged = retag_chunks(self.vectorstore, VECTOR_DB_DIR)
+        if retagged:
+            print(f"🏷️ Tagged {retagged} existing chunks with course metadata")
+
+        # BM25 index next to Chroma for exact terms (acronyms, formula names, section numbers)
+        self.keyword_index = ensure_keyword_index(self.vectorstore, VECTOR_DB_DIR)
+
+        # Define retriever: MMR fused with BM25 by reciprocal rank, packed into a token budget
+        self.retriever = make_retriever(self.vectorstore, self.keyword_index)
+
+        # LLM setup for chat
+        # Both share the gemini-1.5-pro rate limiter and circuit breaker with the PDF endpoints
+        self.llm = make_chat_model("gemini-1.5-pro", temperature=0.5, max_tokens=800)
+
+        # Cheap model for conversation upkeep: rewriting follow-ups and summarizing old turns
+        self.memory_llm = make_chat_model("gemini-1.5-flash", temperature=0, max_tokens=400)
+
+        # LLM setup for quiz
+        self.quiz_llm = make_chat_model("gemini-1.5-pro", temperature=0.7, max_tokens=4000, response_format="json")
+
+        # Chat prompt
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            ("human", "{input}"),
+        ])
+
+        # Chat prompt for a conversation turn; system prompt and context stay first so the prefix can be cached
+        self.conversation_prompt = ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            MessagesPlaceholder("history"),
+            ("human", "{input}"),
+        ])
+
+        # MCQ Prompt Template
+        self.mcq_prompt = ChatPromptTemplate.from_messages([
+            ("system", "You are an AI MCQ generator. Your response MUST be STRICT JSON."),
+            ("human", mcq_human_prompt)
+        ])
+
+        # Bulk MCQ Prompt Template (quiz_api.bulk_quiz)
+        self.bulk_mcq_prompt = ChatPromptTemplate.from_messages([
+            ("system", "You are an AI MCQ generator. Your response MUST be STRICT JSON."),
+            ("human", bulk_mcq_human_prompt)
+        ])
+
+        # Chains for chat
+        self.question_answer_chain = create_stuff_documents_chain(self.llm, self.prompt)
+        self.rag_chain = create_retrieval_chain(self.retriever, self.question_answer_chain)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+_warmup_thread = None
+_warmup_error = None
+
+# Seconds spent importing this module and building the pipeline, for diagnostics
+STARTUP_TIMINGS = {}
+
+
+class PipelineWarming(Exception):
+    """Raised when the RAG pipeline is requested before warm-up has finished."""
+
+
+def get_pipeline():
+    """Returns the process-wide RAG pipeline, building it on first use."""
+    global _pipeline, _warmup_error
+    if _pipeline is not None:
+        return _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            start = time.perf_counter()
+            try:
+                _pipeline = RagPipeline()
+            except Exception as e:
+                _warmup_error = e
+                raise
+            _warmup_error = None
+            STARTUP_TIMINGS["pipeline_build_seconds"] = round(time.perf_counter() - start, 3)
+            print(f"RAG pipeline ready in {STARTUP_TIMINGS['pipeline_build_seconds']}s")
+    return _pipeline
+
+
+def _warmup():
+    try:
+        get_pipeline()
+    except Exception as e:
+        print(f"❌ RAG warm-up failed: {e}")
+
+
+def start_warmup():
+    """Builds the pipeline on a background thread unless it is ready or already building."""
+    global _warmup_thread
+    with _pipeline_lock:
+        if _pipeline is not None or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        _warmup_thread = threading.Thread(target=_warmup, name="rag-warmup", daemon=True)
+        _warmup_thread.start()
+
+
+def is_ready():
+    return _pipeline is not None
+
+
+def warmup_status():
+    """Describes the warm-up state for API responses."""
+    if _pipeline is not None:
+        return {"state": "ready", "vector_backend": VECTOR_BACKEND, "timings": STARTUP_TIMINGS}
+    if _warmup_error is not None and not (_warmup_thread and _warmup_thread.is_alive()):
+        return {"state": "failed", "error": str(_warmup_error)}
+    return {"state": "warming"}
+
+
+def require_pipeline():
+    """Returns the pipeline if it is ready, otherwise kicks off warm-up and raises PipelineWarming."""
+    if _pipeline is None:
+        start_warmup()
+        raise PipelineWarming("The knowledge base is still warming up, please retry shortly.")
+    return _pipeline
+
+
+def index_uploaded_object(key):
+    """Embeds one just-uploaded S3 object into the live index, building the pipeline if needed."""
+    from .indexing import index_key
+    pipeline = get_pipeline()
+    return index_key(make_s3_client(), BUCKET_NAME, key, pipeline.vectorstore, pipeline.text_splitter,
+                     VECTOR_DB_DIR, pipeline.keyword_index)
 
-    if "answer" not in response or not response["answer"].strip():
-        return "I couldn't find an answer from your documents."
-    
-    return response["answer"]
+
+# Answers are reused for repeated or near-identical prompts until the index changes
+chat_cache = SemanticCache(
+    threshold=settings.SEMANTIC_CACHE['THRESHOLD'],
+    ttl=settings.SEMANTIC_CACHE['TTL'],
+    max_entries=settings.SEMANTIC_CACHE['MAX_ENTRIES'],
+)
+
+NO_ANSWER = "I couldn't find an answer from your documents."
+
+
+def cache_stats():
+    stats = {"chat": chat_cache.stats()}
+    if _pipeline is not None and hasattr(_pipeline.embeddings, "stats"):
+        stats["embeddings"] = _pipeline.embeddings.stats()
+    return stats
+
+
+def _query_embedding(text):
+    """The query's embedding, shared by the semantic cache and retrieval. None for lexical look-ups:
+    the retriever answers those from the keyword index without one, so they only hit the cache exactly."""
+    if is_lexical_query(text):
+        return None
+    return require_pipeline().embeddings.embed_query(text)
+
+
+async def _aquery_embedding(text):
+    if is_lexical_query(text):
+        return None
+    return await require_pipeline().embeddings.aembed_query(text)
+
+
+def _cached(cache, text, namespace, compute):
+    """Serves compute(embedding) through the semantic cache; empty results are never stored."""
+    version = index_version(VECTOR_DB_DIR)
+    with span("cache"):
+        value = cache.get_exact(text, version, namespace)
+        if value is not None:
+            return value
+
+        embedding = _query_embedding(text)
+        value = cache.get_similar(embedding, version, namespace)
+        if value is not None:
+            return value
+
+    value = compute(embedding)
+    if value:
+        cache.set(text, embedding, value, version, namespace)
+    return value
+
+
+async def _acached(cache, text, namespace, compute):
+    """Async variant of _cached; compute is a coroutine function."""
+    version = index_version(VECTOR_DB_DIR)
+    with span("cache"):
+        value = cache.get_exact(text, version, namespace)
+        if value is not None:
+            return value
+
+        embedding = await _aquery_embedding(text)
+        value = cache.get_similar(embedding, version, namespace)
+        if value is not None:
+            return value
+
+    value = await compute(embedding)
+    if value:
+        cache.set(text, embedding, value, version, namespace)
+    return value
+
+
+# The chat path runs the same steps as rag_chain (retrieve, stuff, generate) one at a
+# time so each stage shows up in Server-Timing and the /metrics histograms.
+
+def _record_context(docs):
+    chars = sum(len(doc.page_content) for doc in docs)
+    record_value("context_chunks", len(docs))
+    record_value("context_chars", chars)
+    record_value("context_tokens_est", chars // 4)  # ~4 characters per token
+
+
+def _record_usage(message):
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        record_value("llm_input_tokens", usage.get("input_tokens", 0))
+        record_value("llm_output_tokens", usage.get("output_tokens", 0))
+
+
+def _scope_namespace(*parts):
+    """Cache namespace for a request, so answers never leak across courses or documents."""
+    return "|".join(part or "" for part in parts)
+
+
+def scoped_retriever(course=None, document=None):
+    return require_pipeline().retriever.scoped(course, document)
+
+
+def retrieve(query, course=None, document=None, embedding=None):
+    """Runs the retriever for a query, timing it and recording the context size.
+    embedding is the query's, when the caller already computed it."""
+    with span("retrieve"):
+        docs = scoped_retriever(course, document).context(query, embedding)
+    _record_context(docs)
+    return docs
+
+
+async def aretrieve(query, course=None, document=None, embedding=None):
+    with span("retrieve"):
+        docs = await sync_to_async(scoped_retriever(course, document).context, thread_sensitive=False)(query, embedding)
+    _record_context(docs)
+    return docs
+
+
+def _chat_messages(user_input, docs):
+    """Stuffs the retrieved chunks into the chat prompt, as create_stuff_documents_chain does."""
+    with span("stuff"):
+        context = "\n\n".join(doc.page_content for doc in docs)
+        return require_pipeline().prompt.invoke({"input": user_input, "context": context})
+
+
+def _extract_answer(message):
+    if not message.content.strip():
+        return None
+    return message.content
+
+
+def _chat_answer(user_input, course=None, document=None, embedding=None):
+    messages = _chat_messages(user_input, retrieve(user_input, course, document, embedding))
+    with span("generate"):
+        message = require_pipeline().llm.invoke(messages)
+    _record_usage(message)
+    return _extract_answer(message)
+
+
+async def _aconversation_context(pipeline, conversation, query, course, document, embedding=None):
+    """Context for a conversation turn: the previous turn's chunks while the topic holds, else a fresh retrieval."""
+    if embedding is None:
+        embedding = await pipeline.embeddings.aembed_query(query)  # topic tracking needs it even for lexical queries
+    version = index_version(VECTOR_DB_DIR)
+    if memory.can_reuse_chunks(conversation, embedding, version):
+        with span("retrieve"):
+            docs = await sync_to_async(scoped_retriever(course, document).context_for_ids)(conversation.chunk_ids)
+        if docs:
+            memory.count("chunks_reused")
+            _record_context(docs)
+            return docs
+    docs = await aretrieve(query, course, document, embedding)
+    memory.count("retrievals")
+    memory.remember_chunks(conversation, docs, embedding, version)
+    return docs
+
+
+async def _achat_request(user_input, course=None, document=None, conversation=None, embedding=None):
+    """(messages, llm kwargs) for a chat turn.
+
+    Within a conversation, follow-ups are rewritten into standalone queries for retrieval,
+    chunks are reused while the topic holds, the summary and recent exchanges are sent
+    along, and the system prompt + context prefix goes through Gemini context caching.
+    embedding is user_input's, if the caller already computed it.
+    """
+    pipeline = require_pipeline()
+    if conversation is None:
+        return _chat_messages(user_input, await aretrieve(user_input, course, document, embedding)), {}
+
+    query = await memory.arewrite_query(pipeline.memory_llm, conversation, user_input)
+    docs = await _aconversation_context(pipeline, conversation, query, course, document,
+                                        embedding if query == user_input else None)
+    with span("stuff"):
+        messages = pipeline.conversation_prompt.invoke({
+            "input": user_input,
+            "context": "\n\n".join(doc.page_content for doc in docs),
+            "history": memory.history_messages(conversation),
+        }).to_messages()
+    cached_content = await memory.acontext_cache(pipeline.llm, conversation, messages[0])
+    if cached_content:
+        return messages[1:], {"cached_content": cached_content}
+    return messages, {}
+
+
+async def _achat_answer(user_input, course=None, document=None, conversation=None, embedding=None):
+    messages, llm_kwargs = await _achat_request(user_input, course, document, conversation, embedding)
+    with span("generate"):
+        message = await require_pipeline().llm.ainvoke(messages, **llm_kwargs)
+    _record_usage(message)
+    return _extract_answer(message)
+
+
+def get_rag_response(user_input: str, course: str = None, document: str = None) -> str:
+    """Fetches a response from the RAG model for the given user input, optionally within a course/document."""
+    namespace = _scope_namespace(course, document)
+    answer = _cached(chat_cache, user_input, namespace,
+                     lambda embedding: _chat_answer(user_input, course, document, embedding))
+    return answer or NO_ANSWER
+
+async def aget_rag_response(user_input: str, course: str = None, document: str = None, session_key: str = None) -> str:
+    """Async variant of get_rag_response for ASGI views; with a session_key the answer follows the conversation so far."""
+    namespace = _scope_namespace(course, document)
+    if not session_key:
+        answer = await _acached(chat_cache, user_input, namespace,
+                                lambda embedding: _achat_answer(user_input, course, document, embedding=embedding))
+        return answer or NO_ANSWER
+
+    conversation = await memory.aload(session_key, course, document)
+    if memory.has_history(conversation):
+        # Follow-ups depend on what came before, so they bypass the answer cache
+        answer = await _achat_answer(user_input, course, document, conversation)
+    else:
+        answer = await _acached(chat_cache, user_input, namespace,
+                                lambda embedding: _achat_answer(user_input, course, document, conversation, embedding))
+    answer = answer or NO_ANSWER
+    await memory.arecord_turn(require_pipeline().memory_llm, conversation, user_input, answer)
+    return answer
+
+async def astream_rag_response(user_input: str, course: str = None, document: str = None, session_key: str = None):
+    """Yields the RAG answer chunk by chunk as Gemini produces it."""
+    version = index_version(VECTOR_DB_DIR)
+    namespace = _scope_namespace(course, document)
+    conversation = await memory.aload(session_key, course, document) if session_key else None
+    fresh = conversation is None or not memory.has_history(conversation)
+    embedding = None
+    if fresh:
+        with span("cache"):
+            cached = chat_cache.get_exact(user_input, version, namespace)
+            if cached is None:
+                embedding = await _aquery_embedding(user_input)
+                cached = chat_cache.get_similar(embedding, version, namespace)
+        if cached is not None:
+            yield cached
+            if conversation is not None:
+                await memory.arecord_turn(require_pipeline().memory_llm, conversation, user_input, cached)
+            return
+
+    messages, llm_kwargs = await _achat_request(user_input, course, document, conversation, embedding)
+    parts = []
+    async for chunk in require_pipeline().llm.astream(messages, **llm_kwargs):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+
+    answer = "".join(parts)
+    if answer.strip() and fresh:
+        chat_cache.set(user_input, embedding, answer, version, namespace)
+    if conversation is not None:
+        await memory.arecord_turn(require_pipeline().memory_llm, conversation, user_input, answer or NO_ANSWER)
 
 def parse_user_input(query):
     """Extracts topic and difficulty from user input."""
@@ -148,44 +586,165 @@ def parse_user_input(query):
     topic = re.sub(r"\b(easy|medium|hard)\b", "", query, flags=re.IGNORECASE).strip()
     return topic, difficulty
 
-def generate_mcqs(topic, text, difficulty):
-    """Generate MCQs using LLM based on the specified topic dynamically."""
+def _continuation_messages(messages, partial):
+    """The original prompt plus the cut-off reply, asking the model for only the rest."""
+    from langchain_core.messages import AIMessage, HumanMessage
+    return messages.to_messages() + [AIMessage(content=partial), HumanMessage(content=CONTINUE_PROMPT)]
+
+def _best_parse(first, second):
+    return second if len(second.mcqs) >= len(first.mcqs) else first
+
+def _parse_mcq_response(pipeline, messages, text):
+    """Returns the schema-valid MCQs in a quiz reply, or None if it has none.
+
+    Fences, trailing commas and schema slips are repaired locally; a cut-off reply
+    is completed by requesting only its missing tail instead of regenerating it.
+    """
+    result = parse_mcq_output(text)
+    continued = result.truncated
+    if continued:
+        try:
+            with span("generate"):
+                tail = pipeline.quiz_llm.invoke(_continuation_messages(messages, text))
+            _record_usage(tail)
+            result = _best_parse(result, parse_mcq_output(join_continuation(text, tail.content)))
+        except Exception as e:
+            print(f"⚠️ Could not continue truncated MCQ reply: {e}")
+    record_mcq_outcome(text, result, continued)
+    return result.mcqs or None
+
+async def _aparse_mcq_response(pipeline, messages, text, streamed=()):
+    """Async variant of _parse_mcq_response; streamed holds MCQs already validated mid-stream."""
+    result = parse_mcq_output(text)
+    if len(streamed) > len(result.mcqs):
+        result.mcqs = list(streamed)
+    continued = result.truncated
+    if continued:
+        try:
+            with span("generate"):
+                tail = await pipeline.quiz_llm.ainvoke(_continuation_messages(messages, text))
+            _record_usage(tail)
+            result = _best_parse(result, parse_mcq_output(join_continuation(text, tail.content)))
+        except Exception as e:
+            print(f"⚠️ Could not continue truncated MCQ reply: {e}")
+    record_mcq_outcome(text, result, continued)
+    return result.mcqs or None
+
+async def astream_mcq_reply(pipeline, messages):
+    """Streams a quiz reply, validating each MCQ as soon as its object is complete."""
+    parser = McqStreamParser()
+    response = None
+    with span("generate"):
+        async for chunk in pipeline.quiz_llm.astream(messages):
+            response = chunk if response is None else response + chunk
+            parser.feed(chunk.content)
+    _record_usage(response)
+    return parser
+
+def _mcq_prompt_input(pipeline, topic, text, difficulty, count):
+    """mcq_prompt for a dynamic number of questions, bulk_mcq_prompt for an exact count."""
+    values = {"topic": topic, "context": text, "difficulty": difficulty}
+    if count:
+        return pipeline.bulk_mcq_prompt, {**values, "count": count}
+    return pipeline.mcq_prompt, values
+
+def generate_mcqs(topic, text, difficulty, count=None):
+    """Generate MCQs using LLM based on the specified topic dynamically (or exactly count of them)."""
+    pipeline = require_pipeline()
+    prompt, values = _mcq_prompt_input(pipeline, topic, text, difficulty, count)
     for attempt in range(3):
         try:
-            response = quiz_llm.invoke(mcq_prompt.invoke({
-                "topic": topic, 
-                "context": text,
-                "difficulty": difficulty
-            }))
-            response_text = response.content if hasattr(response, "content") else str(response)
-            response_text = re.sub(r"```json\n|\n```", "", response_text).strip()
-            mcqs_data = json.loads(response_text)
-
-            if isinstance(mcqs_data, dict) and "mcqs" in mcqs_data and len(mcqs_data["mcqs"]) > 0:
-                return mcqs_data["mcqs"]
-            
+            messages = prompt.invoke(values)
+            with span("generate"):
+                response = pipeline.quiz_llm.invoke(messages)
+            _record_usage(response)
+            mcqs = _parse_mcq_response(pipeline, messages, response.content)
+            if mcqs:
+                return mcqs
+
+            count_output("full_retries")
             print(f"⚠️ Invalid MCQ response format. Retrying... ({attempt+1}/3)")
-        except json.JSONDecodeError:
-            print("⚠️ JSON Parsing Error. Retrying...")
         except Exception as e:
             print(f"❌ Unexpected Error: {e}")
             break
     return []
 
-def get_rag_quiz(query: str) -> list:
-    """Generates MCQs based on the query using RAG."""
-    topic, difficulty = parse_user_input(query)
-    
-    relevant_docs = retriever.invoke(topic)
+async def agenerate_mcqs(topic, text, difficulty, count=None):
+    """Async variant of generate_mcqs; the reply is streamed and validated as it arrives."""
+    pipeline = require_pipeline()
+    prompt, values = _mcq_prompt_input(pipeline, topic, text, difficulty, count)
+    for attempt in range(3):
+        try:
+            messages = await prompt.ainvoke(values)
+            reply = await astream_mcq_reply(pipeline, messages)
+            mcqs = await _aparse_mcq_response(pipeline, messages, reply.text, reply.mcqs)
+            if mcqs:
+                return mcqs
+
+            count_output("full_retries")
+            print(f"⚠️ Invalid MCQ response format. Retrying... ({attempt+1}/3)")
+        except Exception as e:
+            print(f"❌ Unexpected Error: {e}")
+            break
+    return []
+
+def _rag_quiz(topic, difficulty, course=None, document=None, count=None):
+    """Returns (mcqs, retrieved_docs) for the topic."""
+    relevant_docs = retrieve(topic, course, document)
     if not relevant_docs:
         print(f"❌ No relevant content found for topic: {topic}")
-        return []
+        return [], []
     
     extracted_text = " ".join([doc.page_content for doc in relevant_docs])
-    mcq_list = generate_mcqs(topic, extracted_text, difficulty)
+    mcq_list = generate_mcqs(topic, extracted_text, difficulty, count)
     
     if not mcq_list:
         print("❌ No valid MCQs generated. Try modifying the topic.")
-        return []
+        return [], relevant_docs
     
-    return mcq_list
+    return mcq_list, relevant_docs
+
+async def _arag_quiz(topic, difficulty, course=None, document=None, count=None):
+    relevant_docs = await aretrieve(topic, course, document)
+    if not relevant_docs:
+        print(f"❌ No relevant content found for topic: {topic}")
+        return [], []
+
+    extracted_text = " ".join([doc.page_content for doc in relevant_docs])
+    mcq_list = await agenerate_mcqs(topic, extracted_text, difficulty, count)
+
+    if not mcq_list:
+        print("❌ No valid MCQs generated. Try modifying the topic.")
+        return [], relevant_docs
+
+    return mcq_list, relevant_docs
+
+def _quiz_model_key():
+    """The quiz model settings, part of the key identical in-flight quiz requests are coalesced on."""
+    llm = require_pipeline().quiz_llm
+    return (llm.model, getattr(llm, "temperature", None), getattr(llm, "max_output_tokens", None))
+
+def get_rag_quiz(query: str, course: str = None, document: str = None, session_key: str = None, count: int = None) -> list:
+    """Serves MCQs for the query from the question bank, generating only the shortfall with RAG.
+
+    Questions already served to session_key are skipped.
+    """
+    from .question_bank import serve_quiz
+    topic, difficulty = parse_user_input(query)
+    count = count or settings.QUESTION_BANK['QUESTIONS_PER_QUIZ']
+    return serve_quiz(topic, difficulty, count, lambda n: _rag_quiz(topic, difficulty, course, document, n),
+                      course, document, session_key, _quiz_model_key())
+
+async def aget_rag_quiz(query: str, course: str = None, document: str = None, session_key: str = None, count: int = None) -> list:
+    """Async variant of get_rag_quiz for ASGI views; only the generating request holds an LLM slot."""
+    from .question_bank import aserve_quiz
+    topic, difficulty = parse_user_input(query)
+    count = count or settings.QUESTION_BANK['QUESTIONS_PER_QUIZ']
+
+    async def generate(n):
+        async with llm_slot():
+            return await _arag_quiz(topic, difficulty, course, document, n)
+
+    return await aserve_quiz(topic, difficulty, count, generate, course, document, session_key, _quiz_model_key())
+
+STARTUP_TIMINGS["module_import_seconds"] = round(time.perf_counter() - _module_start, 3)
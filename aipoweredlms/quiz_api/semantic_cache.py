@@ -0,0 +1,108 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_prompt(text):
+    """Lowercases and collapses whitespace so trivially different prompts share a key.
+    Punctuation is kept: "x^2+y^2" and "x^2-y^2" are different questions."""
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+class SemanticCache:
+    """LRU + TTL cache of LLM answers, matched by exact prompt or by embedding similarity.
+
+    Entries remember the index version they were computed against and are
+    dropped once the vector index changes.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (namespace, normalized prompt) -> entry dict
+        self._lock = threading.Lock()
+        self._version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get_exact(self, prompt, version, namespace=""):
+        """Returns the cached value for an identical normalized prompt, or None."""
+        key = (namespace, normalize_prompt(prompt))
+        with self._lock:
+            self._sync_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry["value"]
+
+    def get_similar(self, embedding, version, namespace=""):
+        """Returns the value of the most similar cached prompt above the threshold, or None.
+
+        embedding may be None for prompts that are only matched exactly; that just counts the miss.
+        """
+        query = None if embedding is None else _unit(embedding)
+        with self._lock:
+            self._sync_version(version)
+            self._evict_expired(time.monotonic())
+            keys = [key for key in self._entries if key[0] == namespace and self._entries[key]["embedding"] is not None]
+            if keys and query is not None:
+                matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.semantic_hits += 1
+                    return self._entries[keys[best]]["value"]
+            self.misses += 1
+            return None
+
+    def set(self, prompt, embedding, value, version, namespace=""):
+        """Stores value for prompt; with embedding None it is only served to identical prompts."""
+        key = (namespace, normalize_prompt(prompt))
+        with self._lock:
+            self._sync_version(version)
+            self._entries[key] = {
+                "embedding": None if embedding is None else _unit(embedding),
+                "value": value,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: duplicates are only coalesced within a worker
+    fcntl = None
+
+# Request coalescing: identical LLM calls that are in flight at the same time run once and
+# every caller gets that one result. Within a worker, callers on any thread or event loop
+# wait on the leader's future; across workers on the host, an flock per key in
+# SINGLE_FLIGHT['DIRECTORY'] elects the leader, which leaves its JSON result beside the lock.
+
+POLL_SECONDS = 0.05
+STALE_SECONDS = 3600  # result and lock files older than this are swept
+_MISSING = object()
+
+
+def flight_key(*parts):
+    """Stable key for the normalized parts of a request."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+class LeaderGone(Exception):
+    """The caller computing a shared result was cancelled; waiters retry."""
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and fans its result out to concurrent duplicates.
+
+    Results must be JSON-serializable when directory is set, as that is how they reach other workers.
+    """
+
+    def __init__(self, name, directory=None, wait_seconds=120):
+        self.name = name
+        self.directory = os.path.join(str(directory), name) if directory and fcntl else None
+        self.wait_seconds = wait_seconds
+        self._flights = {}  # key -> Future of the in-process leader
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.leaders = 0
+        self.shared = 0  # answered by a leader in this worker
+        self.shared_across_workers = 0  # answered by a leader in another worker
+
+    def _join(self, key):
+        """(future, is_leader) for key."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = self._flights[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _land(self, key, future, result=_MISSING, error=None):
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error if isinstance(error, Exception) else LeaderGone())
+        else:
+            future.set_result(result)
+
+    def do(self, key, compute):
+        """compute(), unless an identical call is in flight; then its result (or exception)."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result(timeout=self.wait_seconds)
+            except FutureTimeout:
+                if future.done():
+                    raise  # the leader's own TimeoutError
+                print(f"⚠️ {self.name}: shared call is taking over {self.wait_seconds}s, running it again")
+                return compute()
+            except LeaderGone:
+                continue
+
+        try:
+            result = self._lead(key, compute)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    async def ado(self, key, acompute):
+        """Async variant of do; acompute is a coroutine function."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: a waiter that is cancelled must not cancel the leader's future
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait_seconds)
+            except asyncio.TimeoutError:
+                if future.done():
+                    raise
+                print(f"⚠️ {self.name}: shared call is taking over {self.wait_seconds}s, running it again")
+                return await acompute()
+            except LeaderGone:
+                continue
+
+        try:
+            result = await self._alead(key, acompute)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    # Cross-worker election
+
+    def _paths(self, key):
+        return os.path.join(self.directory, f"{key}.lock"), os.path.join(self.directory, f"{key}.json")
+
+    def _open_lock(self, lock_path):
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(lock_path, "a")
+        os.utime(lock_path)  # keeps keys in use clear of the stale sweep
+        return lock_file
+
+    def _try_lock(self, lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _read_result(self, result_path, arrived):
+        """The result another worker finished after this caller arrived, or _MISSING."""
+        try:
+            with open(result_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return _MISSING
+        if data["finished_at"] < arrived:
+            return _MISSING  # an earlier flight's result: coalescing, not caching
+        with self._lock:
+            self.shared_across_workers += 1
+        return data["value"]
+
+    def _write_result(self, result_path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"finished_at": time.time(), "value": value}, f)
+        os.replace(tmp_path, result_path)
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % 100 == 1
+        if sweep:
+            self._sweep()
+
+    def _sweep(self):
+        cutoff = time.time() - STALE_SECONDS
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _lead(self, key, compute):
+        """Runs compute() as this worker's leader, unless another worker is already running it."""
+        if self.directory is None:
+            return compute()
+        lock_path, result_path = self._paths(key)
+        arrived = time.time()
+        with self._open_lock(lock_path) as lock_file:
+            deadline = time.monotonic() + self.wait_seconds
+            locked = self._try_lock(lock_file)
+            if not locked:
+                while not locked and time.monotonic() < deadline:
+                    time.sleep(POLL_SECONDS)
+                    locked = self._try_lock(lock_file)
+                result = self._read_result(result_path, arrived)
+                if result is not _MISSING:
+                    return result
+            # The other worker failed or timed out (or there was none): compute it here
+            result = compute()
+            if locked:
+                self._write_result(result_path, result)
+            return result
+
+    async def _alead(self, key, acompute):
+        """Async variant of _lead."""
+        if self.directory is None:
+            return await acompute()
+        lock_path, result_path = self._paths(key)
+        arrived = time.time()
+        with self._open_lock(lock_path) as lock_file:
+            deadline = time.monotonic() + self.wait_seconds
+            locked = self._try_lock(lock_file)
+            if not locked:
+                while not locked and time.monotonic() < deadline:
+                    await asyncio.sleep(POLL_SECONDS)
+                    locked = self._try_lock(lock_file)
+                result = self._read_result(result_path, arrived)
+                if result is not _MISSING:
+                    return result
+            result = await acompute()
+            if locked:
+                self._write_result(result_path, result)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "shared": self.shared,
+                    "shared_across_workers": self.shared_across_workers}
+
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+def single_flight(name):
+    """Returns the process-wide SingleFlight for name, configured from settings.SINGLE_FLIGHT."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = SingleFlight(name, settings.SINGLE_FLIGHT['DIRECTORY'],
+                                           settings.SINGLE_FLIGHT['WAIT_SECONDS'])
+        return _registry[name]
+
+
+def flight_stats():
+    """Coalescing counters per call type, for /api/rag_status/."""
+    with _registry_lock:
+        flights = dict(_registry)
+    return {name: flight.stats() for name, flight in sorted(flights.items())}
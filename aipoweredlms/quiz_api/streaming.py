@@ -0,0 +1,56 @@
+import json
+from contextlib import nullcontext
+from django.http import StreamingHttpResponse
+from .clients import ServiceBusy
+from .concurrency import llm_slot
+
+
+def wants_stream(request):
+    """True if the client asked for a streamed (server-sent events) answer."""
+    flag = request.query_params.get('stream') or request.data.get('stream')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+def sse_event(data, event=None):
+    """Formats one server-sent event carrying a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return f"{message}data: {json.dumps(data)}\n\n"
+
+
+async def _sse_events(tokens, field, slot):
+    async with llm_slot() if slot else nullcontext():
+        try:
+            async for token in tokens:
+                if token:
+                    yield sse_event({field: token})
+        except Exception as e:
+            error = {'status': 'error', 'message': str(e)}
+            if isinstance(e, ServiceBusy):
+                error['retry_after'] = round(e.retry_after)
+            yield sse_event(error, event='error')
+            return
+    yield sse_event({'status': 'success'}, event='done')
+
+
+async def tee_tokens(tokens, on_complete):
+    """Passes tokens through and calls on_complete(full_text) once the stream finishes."""
+    parts = []
+    async for token in tokens:
+        parts.append(token)
+        yield token
+    on_complete("".join(parts))
+
+
+async def single_token(text):
+    yield text
+
+
+def sse_response(tokens, field='token', slot=True):
+    """Streams items (text chunks by default) from an async iterator to the client as they are produced.
+
+    The stream holds an LLM slot throughout unless slot is False, for producers that take slots themselves.
+    """
+    response = StreamingHttpResponse(_sse_events(tokens, field, slot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+    return response
@@ -0,0 +1,268 @@
+import json
+import re
+import threading
+
+# Structured-output layer for LLM JSON: local repair of fences, trailing commas and
+# truncation, schema checks for MCQs and topic trees, and tail-only continuation.
+
+FENCE = re.compile(r"```(?:json|JSON)?[ \t]*")
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+ANSWER_KEY = re.compile(r"^\(?([A-H])\b")
+OPTION_KEYS = "ABCDEFGH"
+CLOSERS = {"{": "}", "[": "]"}
+
+# How many of the latest cut points truncation repair tries before giving up
+MAX_REPAIR_CUTS = 20
+
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off. Continue the JSON exactly where it stopped: "
+    "output only the remaining characters, without repeating anything and without code fences."
+)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "clean": 0,            # parsed as-is
+    "repaired": 0,         # needed local repair (fences, trailing commas, truncation, schema slips)
+    "continued": 0,        # truncated output finished by requesting only its tail
+    "full_retries": 0,     # nothing usable; the whole generation was re-run
+    "retries_avoided": 0,  # outputs the old strip-and-json.loads path would have thrown away
+}
+
+
+def count(event, n=1):
+    with _stats_lock:
+        _stats[event] += n
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class JsonScanner:
+    """Tracks JSON nesting over text fed in pieces, without parsing values."""
+
+    def __init__(self):
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.position = 0
+        # (index just past a complete element, open containers at that point)
+        self.cuts = []
+
+    def feed(self, text, on_close=None):
+        """Scans text; on_close(opener, start, end, depth) is called whenever a container closes."""
+        for char in text:
+            index = self.position
+            self.position += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char in CLOSERS:
+                self.stack.append((char, index))
+            elif char in "}]" and self.stack:
+                opener, start = self.stack.pop()
+                self.cuts.append((index + 1, [c for c, _ in self.stack]))
+                if on_close is not None:
+                    on_close(opener, start, index + 1, len(self.stack))
+            elif char == "," and self.stack:
+                self.cuts.append((index, [c for c, _ in self.stack]))
+
+    @property
+    def balanced(self):
+        return not self.stack and not self.in_string
+
+
+def strip_fences(text):
+    """Drops code fences and any prose before the first JSON bracket."""
+    text = FENCE.sub("", text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):] if starts else text.strip()
+
+
+def _loads_prefix(text):
+    """Parses the first JSON value in text, ignoring anything after it."""
+    return json.JSONDecoder().raw_decode(text)[0]
+
+
+def _close_truncated(text):
+    """Recovers the longest valid prefix of cut-off JSON by closing its open containers."""
+    scanner = JsonScanner()
+    scanner.feed(text)
+    # A value cut mid-string is incomplete, so only cut points after whole elements are tried
+    candidates = [] if scanner.in_string else [(text, [c for c, _ in scanner.stack])]
+    candidates += [(text[:end], stack) for end, stack in reversed(scanner.cuts[-MAX_REPAIR_CUTS:])]
+
+    for prefix, stack in candidates:
+        closed = TRAILING_COMMA.sub(r"\1", prefix.rstrip().rstrip(",") + "".join(CLOSERS[c] for c in reversed(stack)))
+        try:
+            return _loads_prefix(closed)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def parse_json(text):
+    """Parses LLM JSON output, repairing what it can locally.
+
+    Returns (data, repaired, truncated); data is None if nothing could be recovered.
+    """
+    raw = text.strip()
+    cleaned = strip_fences(raw).strip()
+    for candidate in (cleaned, TRAILING_COMMA.sub(r"\1", cleaned)):
+        try:
+            return _loads_prefix(candidate), candidate != raw, False
+        except json.JSONDecodeError:
+            pass
+
+    scanner = JsonScanner()
+    scanner.feed(cleaned)
+    return _close_truncated(cleaned), True, not scanner.balanced
+
+
+def join_continuation(partial, tail):
+    """Appends a continuation to cut-off output, dropping any part of it the model repeated."""
+    tail = FENCE.sub("", tail)
+    for size in range(min(len(partial), len(tail), 200), 0, -1):
+        if partial.endswith(tail[:size]):
+            return partial + tail[size:]
+    return partial + tail
+
+
+# MCQ schema: {"mcqs": [{"question": str, "options": {"A": str, ...}, "answer": "A", "difficulty": 1-10}]}
+
+def normalize_mcq(item):
+    """Returns a schema-valid MCQ, fixing small slips (option lists, "A) ..." answers,
+    string difficulties), or None if the item cannot be used."""
+    if not isinstance(item, dict):
+        return None
+    question = str(item.get("question") or "").strip()
+    options = item.get("options")
+    if isinstance(options, list):
+        options = {OPTION_KEYS[i]: option for i, option in enumerate(options[:len(OPTION_KEYS)])}
+    if not question or not isinstance(options, dict) or len(options) < 2:
+        return None
+    options = {str(key).strip().strip("().:").upper(): str(value).strip() for key, value in options.items()}
+
+    answer = str(item.get("answer") or "").strip()
+    if not answer or not all(options.values()):
+        return None
+    match = ANSWER_KEY.match(answer.upper())
+    key = match.group(1) if match and match.group(1) in options else None
+    if key is None:
+        key = next((k for k, value in options.items() if value.lower() == answer.lower()), None)
+    if key is None:
+        return None
+
+    mcq = {"question": question, "options": options, "answer": key}
+    try:
+        mcq["difficulty"] = min(max(int(item.get("difficulty")), 1), 10)
+    except (TypeError, ValueError):
+        pass
+    return mcq
+
+
+def _mcq_items(data):
+    if isinstance(data, dict):
+        if isinstance(data.get("mcqs"), list):
+            return data["mcqs"]
+        return [data] if "question" in data else []
+    return data if isinstance(data, list) else []
+
+
+class McqParse:
+    def __init__(self, mcqs, repaired, truncated, dropped):
+        self.mcqs = mcqs
+        self.repaired = repaired
+        self.truncated = truncated
+        self.dropped = dropped
+
+
+def parse_mcq_output(text):
+    """Parses and validates an MCQ reply; truncated replies keep every complete question."""
+    data, repaired, truncated = parse_json(text)
+    items = _mcq_items(data)
+    mcqs = [mcq for mcq in map(normalize_mcq, items) if mcq is not None]
+    changed = any(mcq != item for mcq, item in zip(mcqs, items))
+    return McqParse(mcqs, repaired or changed or len(mcqs) < len(items), truncated, len(items) - len(mcqs))
+
+
+def legacy_mcq_parse_ok(text):
+    """Whether the old fence-regex + json.loads path would have accepted this reply."""
+    try:
+        data = json.loads(re.sub(r"```json\n|\n```", "", text).strip())
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and bool(data.get("mcqs"))
+
+
+def record_mcq_outcome(text, result, continued=False):
+    """Updates the counters for one MCQ reply (text is the reply before any continuation)."""
+    if continued:
+        count("continued")
+    if not result.mcqs:
+        return
+    count("repaired" if result.repaired or continued else "clean")
+    if not legacy_mcq_parse_ok(text):
+        count("retries_avoided")
+
+
+class McqStreamParser:
+    """Validates MCQs while the reply streams in, emitting each as soon as its object closes."""
+
+    def __init__(self):
+        self.text = ""
+        self.mcqs = []
+        self._scanner = JsonScanner()
+        self._offset = None  # where the JSON starts once fences/prose are skipped
+
+    def feed(self, chunk):
+        """Adds streamed text; returns the MCQs completed by it."""
+        self.text += chunk
+        if self._offset is None:
+            starts = [i for i in (self.text.find("{"), self.text.find("[")) if i != -1]
+            if not starts:
+                return []
+            self._offset = min(starts)
+            chunk = self.text[self._offset:]
+        completed = []
+
+        def on_close(opener, start, end, depth):
+            # Elements of the MCQ array: {"mcqs": [ {...} ]} or a bare [ {...} ]
+            parent = self._scanner.stack
+            if opener == "{" and parent and parent[-1][0] == "[" and depth in (1, 2):
+                try:
+                    mcq = normalize_mcq(json.loads(self.text[self._offset + start:self._offset + end]))
+                except json.JSONDecodeError:
+                    return
+                if mcq is not None:
+                    completed.append(mcq)
+
+        self._scanner.feed(chunk, on_close)
+        self.mcqs.extend(completed)
+        return completed
+
+
+# Topic-tree schema for PDF structuring: a non-empty object of topic -> details
+
+def parse_topic_tree(text):
+    """Parses structuring output into a topic dict. Returns (tree or None, repaired, truncated)."""
+    data, repaired, truncated = parse_json(text)
+    if isinstance(data, list):
+        # A list of {"topic": ..., ...} objects is turned into the expected mapping
+        tree = {}
+        for i, item in enumerate(data, 1):
+            if isinstance(item, dict):
+                name = str(item.get("topic") or item.get("title") or f"Topic {i}")
+                tree[name] = {k: v for k, v in item.items() if k not in ("topic", "title")}
+        data, repaired = tree, True
+    if not isinstance(data, dict) or not data:
+        return None, repaired, truncated
+    return data, repaired, truncated
@@ -1,43 +1,142 @@
 import os
-import fitz  # PyMuPDF for extracting text from PDFs
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-# Load API key from .env file
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
+try:
+    from .pdf_ingest import extract_text
+    from .map_reduce import split_document, run_map, arun_map, reduce_to_budget, areduce_to_budget
+    from .clients import gemini_model
+    from .concurrency import llm_slot
+except ImportError:  # run as a script
+    from pdf_ingest import extract_text
+    from map_reduce import split_document, run_map, arun_map, reduce_to_budget, areduce_to_budget
+    from clients import gemini_model
+    from concurrency import llm_slot
 
 # 🔹 Set PDF Path Directly
 PDF_PATH = r"D:\Project-Hackathon\pdfs\Enhancing Classification of Imbalanced Data.pdf"
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a text-based PDF (no OCR needed)."""
-    text = ""
+def extract_text_from_pdf(pdf_source):
+    """Extracts text from a text-based PDF (no OCR needed); accepts a path, bytes or a stream."""
     try:
-        doc = fitz.open(pdf_path)
-        text = "\n".join([page.get_text("text") for page in doc])
+        return extract_text(pdf_source)
     except Exception as e:
         print(f"Error extracting text: {e}")
-    return text.strip()
+        return ""
 
-def query_pdf_with_gemini(pdf_text, user_query):
-    """Queries Gemini about the PDF content."""
-    model = genai.GenerativeModel("gemini-1.5-pro")  # Use Flash if Pro is slow
+# Bump whenever the Q&A prompts or query_key change so cached answers are not reused
+QUERY_PROMPT_VERSION = "v3"
+
+
+def query_key(user_query):
+    """Cache key for a question about a PDF: case and whitespace are ignored, symbols are not
+    ("x^2+y^2" and "x^2-y^2" get different answers)."""
+    return " ".join(user_query.lower().split())
+
+# Map step reply for document parts with nothing relevant to the query
+NOTHING_RELEVANT = "NONE"
 
-    prompt = f"""
+def build_query_prompt(pdf_text, user_query):
+    """Builds the document Q&A prompt sent to Gemini."""
+    return f"""
     You are an AI that answers questions based on a provided document.
     
     **Document Content:**
-    {pdf_text[:5000]}  # Limit text input to fit within Gemini's context
+    {pdf_text}
     
     **User Query:** {user_query}
     Answer based only on the provided document.
     """
 
-    response = model.generate_content(prompt)
+def build_map_prompt(part_text, user_query, index, total):
+    """Prompt for one part of a long document: pull out what matters for the query."""
+    return f"""
+    You are reading part {index} of {total} of a document.
+
+    **Document Part:**
+    {part_text}
+
+    **User Query:** {user_query}
+    Write concise notes with every fact, definition and detail from this part that helps answer the query.
+    If nothing in this part is relevant, reply with exactly {NOTHING_RELEVANT}.
+    """
+
+def build_reduce_prompt(notes, user_query):
+    """Prompt that answers the query from the notes taken on each part of the document."""
+    joined = "\n\n".join(f"Notes {i}:\n{note}" for i, note in enumerate(notes, 1))
+    return f"""
+    You are an AI that answers questions based on a provided document.
+    The document was read in parts; here are the notes taken on each part, in order.
+
+    **Notes:**
+    {joined}
+
+    **User Query:** {user_query}
+    Answer based only on these notes.
+    """
+
+def _relevant(notes):
+    return [note for note in notes if note.strip() and note.strip() != NOTHING_RELEVANT]
+
+def _generate(model, prompt):
+    return model.generate_content(prompt).text.strip()
+
+async def _agenerate(model, prompt):
+    response = await model.generate_content_async(prompt)
     return response.text.strip()
 
+async def _agenerate_in_slot(model, prompt):
+    async with llm_slot():
+        return await _agenerate(model, prompt)
+
+def _map_notes(model, parts, user_query):
+    """Takes notes on every part concurrently, then merges them until they fit one prompt."""
+    notes = run_map(
+        list(enumerate(parts, 1)),
+        lambda item: _generate(model, build_map_prompt(item[1], user_query, item[0], len(parts))),
+    )
+    return reduce_to_budget(_relevant(notes), lambda group: _generate(model, build_reduce_prompt(group, user_query)))
+
+async def _amap_notes(model, parts, user_query):
+    async def take_notes(item):
+        return await _agenerate(model, build_map_prompt(item[1], user_query, item[0], len(parts)))
+
+    async def combine(group):
+        return await _agenerate(model, build_reduce_prompt(group, user_query))
+
+    notes = await arun_map(list(enumerate(parts, 1)), take_notes)
+    return await areduce_to_budget(_relevant(notes), combine)
+
+def query_pdf_with_gemini(pdf_text, user_query):
+    """Queries Gemini about the whole PDF; long documents are mapped in parallel parts and reduced."""
+    model = gemini_model("gemini-1.5-pro")  # Use Flash if Pro is slow
+    parts = split_document(pdf_text)
+    if len(parts) == 1:
+        return _generate(model, build_query_prompt(pdf_text, user_query))
+    return _generate(model, build_reduce_prompt(_map_notes(model, parts, user_query), user_query))
+
+async def aquery_pdf_with_gemini(pdf_text, user_query):
+    """Async variant of query_pdf_with_gemini."""
+    model = gemini_model("gemini-1.5-pro")
+    parts = split_document(pdf_text)
+    if len(parts) == 1:
+        return await _agenerate_in_slot(model, build_query_prompt(pdf_text, user_query))
+    return await _agenerate_in_slot(model, build_reduce_prompt(await _amap_notes(model, parts, user_query), user_query))
+
+async def astream_query_pdf_with_gemini(pdf_text, user_query):
+    """Yields the answer about the PDF as Gemini streams it; for long PDFs only the reduce step streams.
+
+    Stream it with sse_response(..., slot=False): the map calls and the final stream each take their own LLM slot.
+    """
+    model = gemini_model("gemini-1.5-pro")
+    parts = split_document(pdf_text)
+    if len(parts) == 1:
+        prompt = build_query_prompt(pdf_text, user_query)
+    else:
+        prompt = build_reduce_prompt(await _amap_notes(model, parts, user_query), user_query)
+    async with llm_slot():
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
 if __name__ == "__main__":
     if not os.path.exists(PDF_PATH):
         print("❌ Error: PDF file not found.")
@@ -1,7 +1,35 @@
-from ragquiz import MCQGenerator
+import json
+import os
+import sys
+import django
 
-# Load existing vector database
-mcq_gen = MCQGenerator()
+# Manual check of RAG quiz generation: python -m quiz_api.testrag ["topic difficulty"] [--offline]
+# --offline swaps Gemini for the deterministic fakes (quiz_api.fakes); the vector index must already exist.
+# Nothing runs on import, so test discovery (which matches test*.py) can load this module safely.
 
-# Generate MCQs
-mcqs = mcq_gen.create_mcqs("machine learning medium", save_to_file=True)
\ No newline at end of file
+
+def main(argv):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aipoweredlms.settings")
+    os.environ.setdefault("RAG_WARMUP_ON_START", "0")
+    os.environ.setdefault("JOB_RUN_IN_PROCESS", "0")
+    django.setup()
+
+    from quiz_api import fakes, ragchat
+
+    args = [arg for arg in argv if arg != "--offline"]
+    if "--offline" in argv:
+        fakes.install()
+
+    # Load existing vector database
+    ragchat.get_pipeline()
+
+    # Generate MCQs
+    query = args[0] if args else "machine learning medium"
+    mcqs = ragchat.get_rag_quiz(query)
+    with open("mcqs.json", "w", encoding="utf-8") as f:
+        json.dump(mcqs, f, indent=2)
+    print(f"✅ {len(mcqs)} MCQs for {query!r} saved to mcqs.json")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
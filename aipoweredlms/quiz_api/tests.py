@@ -1,3 +1,1305 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+import boto3
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from moto import mock_aws
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import signing
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import conversation, jobs, pdf_cache, views
+from .bulk_ingest import bulk_ingest
+from .bulk_quiz import McqDeduper, plan_batches
+from .embedding_cache import CachedEmbeddings
+from .clients import ServiceBusy
+from .ragchat import PipelineWarming
+from .context_builder import BudgetedRetriever, build_context, estimate_tokens, reciprocal_rank_fusion, trim_overlap
+from . import indexing
+from .indexing import load_manifest
+from .keyword_index import KeywordIndex, is_lexical_query
+from .layout_chunker import LayoutChunker
+from .map_reduce import arun_map, areduce_to_budget
+from .models import MCQ, Conversation, Job, SeenMCQ
+from . import question_bank
+from .numpy_store import NumpyVectorStore
+from .pdf_cache import PdfCache
+from .semantic_cache import SemanticCache
+from .single_flight import SingleFlight, fcntl
+from .upload import abort_upload, complete_upload, presign_upload
+from .structured_output import McqStreamParser, parse_json, parse_mcq_output
 
-# Create your tests here.
+
+class SemanticCacheTests(SimpleTestCase):
+    def test_exact_match_ignores_case_and_whitespace_only(self):
+        cache = SemanticCache()
+        cache.set("What is  ReLU?", [1, 0], "answer", version=1)
+        self.assertEqual(cache.get_exact(" what is relu? ", 1), "answer")
+        self.assertIsNone(cache.get_exact("what is relu", 1))
+        cache.set("x^2+y^2", None, "plus", version=1)
+        self.assertIsNone(cache.get_exact("x^2-y^2", 1))
+
+    def test_similar_above_threshold(self):
+        cache = SemanticCache(threshold=0.9)
+        cache.set("define relu", [1, 0, 0], "relu", version=1)
+        cache.set("define tanh", [0, 1, 0], "tanh", version=1)
+        self.assertEqual(cache.get_similar([0.99, 0.1, 0], 1), "relu")
+        self.assertIsNone(cache.get_similar([0.7, 0.7, 0], 1))
+        self.assertEqual(cache.stats()["semantic_hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_namespaces_are_separate(self):
+        cache = SemanticCache()
+        cache.set("relu", [1, 0], "chat answer", version=1, namespace="chat")
+        self.assertIsNone(cache.get_exact("relu", 1, namespace="quiz"))
+        self.assertIsNone(cache.get_similar([1, 0], 1, namespace="quiz"))
+        self.assertEqual(cache.get_similar([1, 0], 1, namespace="chat"), "chat answer")
+
+    def test_entries_without_embedding_only_match_exactly(self):
+        cache = SemanticCache()
+        cache.set('"LSTM"', None, "lstm", version=1)
+        self.assertIsNone(cache.get_similar([1, 0], 1))
+        self.assertIsNone(cache.get_similar(None, 1))
+        self.assertEqual(cache.get_exact('"lstm"', 1), "lstm")
+
+    def test_index_version_change_clears(self):
+        cache = SemanticCache()
+        cache.set("relu", [1, 0], "old", version=1)
+        self.assertIsNone(cache.get_exact("relu", 2))
+        self.assertIsNone(cache.get_exact("relu", 1))
+
+    def test_ttl_and_lru(self):
+        cache = SemanticCache(ttl=0)
+        cache.set("relu", [1, 0], "expired", version=1)
+        self.assertIsNone(cache.get_exact("relu", 1))
+
+        cache = SemanticCache(max_entries=2)
+        cache.set("a", [1, 0], "a", version=1)
+        cache.set("b", [0, 1], "b", version=1)
+        cache.get_exact("a", 1)
+        cache.set("c", [1, 1], "c", version=1)
+        self.assertEqual(cache.get_exact("a", 1), "a")
+        self.assertIsNone(cache.get_exact("b", 1))
+
+
+class KeywordIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.index = KeywordIndex(os.path.join(self.directory, "keyword_index.sqlite3"))
+        self.index.add(
+            ["pdfs/ml/a.pdf#0", "pdfs/ml/b.pdf#0", "pdfs/bio/c.pdf#0", "pdfs/ml/d.pdf#0"],
+            [
+                "The transformer uses attention. Attention weights sum to one.",
+                "Convolutional networks use shared weights.",
+                "Attention span in cell biology lectures.",
+                "Gradient descent updates the weights.",
+            ],
+        )
+
+    def test_ranks_by_bm25(self):
+        results = self.index.search("attention")
+        self.assertEqual([chunk_id for chunk_id, _ in results], ["pdfs/ml/a.pdf#0", "pdfs/bio/c.pdf#0"])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_rare_terms_outweigh_common_ones(self):
+        self.assertEqual(self.index.search("convolutional weights")[0][0], "pdfs/ml/b.pdf#0")
+
+    def test_scoped_search(self):
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("attention", course="bio")],
+                         ["pdfs/bio/c.pdf#0"])
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("weights", document="d.pdf")],
+                         ["pdfs/ml/d.pdf#0"])
+
+    def test_stopwords_only_and_unknown_terms(self):
+        self.assertEqual(self.index.search("what is the"), [])
+        self.assertEqual(self.index.search("quantum"), [])
+
+    def test_delete_and_reindex(self):
+        self.index.delete(["pdfs/ml/a.pdf#0"])
+        self.assertEqual(self.index.count(), 3)
+        self.index.add(["pdfs/bio/c.pdf#0"], ["Mitosis and meiosis."])
+        self.assertEqual(self.index.count(), 3)
+        self.assertEqual(self.index.search("attention"), [])
+
+    def test_is_lexical_query(self):
+        self.assertTrue(is_lexical_query('"scaled dot-product"'))
+        self.assertTrue(is_lexical_query("section 3.2"))
+        self.assertTrue(is_lexical_query("LSTM gates"))
+        self.assertFalse(is_lexical_query("how do transformers handle long documents"))
+        self.assertFalse(is_lexical_query("explain attention"))
+        self.assertFalse(is_lexical_query("what changed between version 2 and version 3 of the model"))
+
+
+class FakeRetriever:
+    fetch_k = 40
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.max_chunks = None
+
+    def model_copy(self, update):
+        copy = FakeRetriever(self.docs)
+        copy.max_chunks, copy.fetch_k = update["max_chunks"], update["fetch_k"]
+        return copy
+
+    def candidates(self, query):
+        return self.docs[:self.max_chunks]
+
+
+class Chunk:
+    def __init__(self, text):
+        self.page_content = text
+
+
+@override_settings(BULK_QUIZ={'BATCH_SIZE': 10, 'CHUNKS_PER_BATCH': 2, 'PARALLELISM': 4,
+                              'MAX_QUESTIONS': 500, 'DEDUPE_THRESHOLD': 0.75})
+class BulkQuizTests(SimpleTestCase):
+    def plan(self, docs, difficulties, count):
+        with mock.patch("quiz_api.bulk_quiz.scoped_retriever", return_value=FakeRetriever(docs)):
+            return plan_batches("attention", difficulties, count)
+
+    def test_batches_cover_count_and_cycle_difficulties(self):
+        docs = [Chunk(f"chunk {i}") for i in range(20)]
+        batches = self.plan(docs, ["Easy", "Hard"], 35)
+        self.assertEqual([size for _, _, size in batches], [10, 10, 10, 5])
+        self.assertEqual([difficulty for difficulty, _, _ in batches], ["Easy", "Hard", "Easy", "Hard"])
+        # Each difficulty's batches ask about different chunk groups
+        self.assertEqual([context for _, context, _ in batches],
+                         ["chunk 0\n\nchunk 1", "chunk 0\n\nchunk 1", "chunk 2\n\nchunk 3", "chunk 2\n\nchunk 3"])
+
+    def test_groups_are_reused_when_the_pool_is_small(self):
+        batches = self.plan([Chunk("only")], ["Medium"], 30)
+        self.assertEqual([context for _, context, _ in batches], ["only"] * 3)
+
+    def test_no_context(self):
+        self.assertEqual(self.plan([], ["Easy"], 10), [])
+
+    def test_deduper(self):
+        deduper = McqDeduper(0.75)
+        kept = deduper.filter([
+            {"question": "Which best describes mitosis?"},
+            {"question": "Which of the following best describes mitosis?"},
+            {"question": "Which best describes meiosis?"},
+            {"question": "Which is true?"},
+        ])
+        self.assertEqual([mcq["question"] for mcq in kept],
+                         ["Which best describes mitosis?", "Which best describes meiosis?"])
+        # Later batches are checked against everything accepted so far
+        self.assertEqual(deduper.filter([{"question": "Describe mitosis."}]), [])
+
+
+MCQ_A = '{"question": "What does ReLU output for negative inputs?", "options": {"A": "0", "B": "1"}, "answer": "A"}'
+MCQ_B = '{"question": "Which optimizer uses momentum?", "options": ["SGD", "Adam"], "answer": "B) Adam"}'
+
+
+class ParseJsonTests(SimpleTestCase):
+    def test_clean_json(self):
+        self.assertEqual(parse_json('{"a": [1, 2]}'), ({"a": [1, 2]}, False, False))
+
+    def test_strips_fences_and_prose(self):
+        data, repaired, truncated = parse_json('Here you go:\n```json\n{"a": 1}\n```')
+        self.assertEqual(data, {"a": 1})
+        self.assertTrue(repaired)
+        self.assertFalse(truncated)
+
+    def test_trailing_commas(self):
+        data, repaired, _ = parse_json('{"a": [1, 2,], "b": 3,}')
+        self.assertEqual(data, {"a": [1, 2], "b": 3})
+        self.assertTrue(repaired)
+
+    def test_truncated_keeps_complete_elements(self):
+        data, repaired, truncated = parse_json('{"items": [{"x": 1}, {"x": 2}, {"x": "cut mid')
+        self.assertEqual(data, {"items": [{"x": 1}, {"x": 2}]})
+        self.assertTrue(repaired)
+        self.assertTrue(truncated)
+
+    def test_unrecoverable(self):
+        self.assertIsNone(parse_json("no json here")[0])
+
+    def test_mcq_output_normalizes_and_drops_invalid(self):
+        text = '{"mcqs": [' + MCQ_A + ', ' + MCQ_B + ', {"question": "No options", "answer": "A"}]}'
+        result = parse_mcq_output(text)
+        self.assertEqual([mcq["answer"] for mcq in result.mcqs], ["A", "B"])
+        self.assertEqual(result.mcqs[1]["options"], {"A": "SGD", "B": "Adam"})
+        self.assertEqual(result.dropped, 1)
+        self.assertTrue(result.repaired)
+
+    def test_truncated_mcq_output_keeps_complete_questions(self):
+        result = parse_mcq_output('{"mcqs": [' + MCQ_A + ', {"question": "Cut')
+        self.assertEqual(len(result.mcqs), 1)
+        self.assertTrue(result.truncated)
+
+
+class McqStreamParserTests(SimpleTestCase):
+    def feed_in_pieces(self, parser, text, size):
+        emitted = []
+        for i in range(0, len(text), size):
+            emitted.append(parser.feed(text[i:i + size]))
+        return emitted
+
+    def test_emits_each_mcq_as_it_closes(self):
+        text = '```json\n{"mcqs": [' + MCQ_A + ', ' + MCQ_B + ']}\n```'
+        parser = McqStreamParser()
+        emitted = self.feed_in_pieces(parser, text, 7)
+        completed = [i for i, mcqs in enumerate(emitted) if mcqs]
+        self.assertEqual(len(completed), 2)
+        self.assertLess(completed[0], len(emitted) - 1)  # the first arrives before the reply ends
+        self.assertEqual([mcq["answer"] for mcq in parser.mcqs], ["A", "B"])
+
+    def test_bare_array_and_nested_objects(self):
+        parser = McqStreamParser()
+        parser.feed('[' + MCQ_A + ', {"question": "Bad", "options": {"A": "x"}, "answer": "A"}]')
+        self.assertEqual(len(parser.mcqs), 1)
+        self.assertEqual(parser.mcqs[0]["options"], {"A": "0", "B": "1"})  # its options object is not an MCQ
+
+    def test_braces_inside_strings(self):
+        parser = McqStreamParser()
+        parser.feed('{"mcqs": [{"question": "Is {x} a set?", "options": {"A": "yes ]", "B": "no"}, "answer": "A"}]}')
+        self.assertEqual([mcq["question"] for mcq in parser.mcqs], ["Is {x} a set?"])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, calls):
+        results, errors = [None] * len(calls), [None] * len(calls)
+
+        def run(i, call):
+            try:
+                results[i] = call()
+            except Exception as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_duplicates_share_one_call(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        threading.Timer(0.2, release.set).start()
+        results, _ = self.run_concurrently([lambda: flight.do("key", compute)] * 4)
+        self.assertEqual(results, ["answer"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()["shared"], 3)
+
+    def test_errors_reach_waiters_and_are_not_kept(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError("provider down")
+
+        threading.Timer(0.2, release.set).start()
+        _, errors = self.run_concurrently([lambda: flight.do("key", fail)] * 3)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(flight.do("key", lambda: "recovered"), "recovered")
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight("test")
+        self.assertEqual([flight.do(key, lambda key=key: key) for key in ("a", "b")], ["a", "b"])
+        self.assertEqual(flight.stats()["leaders"], 2)
+
+    def test_async_duplicates_share_one_call(self):
+        import asyncio
+        flight = SingleFlight("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        async def main():
+            return await asyncio.gather(*[flight.ado("key", compute) for _ in range(4)])
+
+        self.assertEqual(asyncio.run(main()), ["answer"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_workers_share_through_lock_files(self):
+        if fcntl is None:
+            self.skipTest("cross-worker coalescing needs fcntl")
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Two instances stand in for two worker processes on one host
+        first, second = SingleFlight("test", directory), SingleFlight("test", directory)
+
+        def slow():
+            time.sleep(0.3)
+            return {"answer": 1}
+
+        results, _ = self.run_concurrently([lambda: first.do("key", slow),
+                                            lambda: second.do("key", lambda: {"answer": 2})])
+        self.assertEqual(results, [{"answer": 1}, {"answer": 1}])
+        self.assertEqual(second.stats()["shared_across_workers"], 1)
+        # A finished flight's result is not served to later callers
+        self.assertEqual(second.do("key", lambda: {"answer": 3}), {"answer": 3})
+
+
+def line(text, block, y, size=10.0, bold=False, first=False):
+    return {"text": text, "block": block, "first": first, "y": y, "size": size, "bold": bold, "math": 0.0}
+
+
+def page(number, lines):
+    return {"number": number, "height": 800.0, "lines": lines, "tables": []}
+
+
+PARAGRAPH = ("Attention lets every token look at every other token in the sequence. "
+             "The weights come from a softmax over scaled dot products of queries and keys. ")
+
+
+class LayoutChunkerTests(SimpleTestCase):
+    def pages(self):
+        return [
+            page(0, [
+                line("1 Introduction", 0, 100, size=14, first=True),
+                line(PARAGRAPH, 1, 130, first=True),
+                line("2 Attention", 2, 200, size=14, first=True),
+                line("2.1 Scaled dot-product", 3, 230, size=12, first=True),
+                line(PARAGRAPH * 3, 4, 260, first=True),
+                line("The softmax is taken over", 5, 700, first=True),
+            ]),
+            page(1, [
+                line("the keys, one row per query.", 0, 100, first=True),
+                line("3 Results", 1, 200, size=14, first=True),
+                line(PARAGRAPH, 2, 230, first=True),
+            ]),
+        ]
+
+    def test_chunks_follow_sections(self):
+        chunks = list(LayoutChunker(max_chars=3000, min_chars=0).split_pages(self.pages(), {"source": "a.pdf"}))
+        self.assertEqual([chunk.metadata["section"] for chunk in chunks],
+                         ["1 Introduction", "2 Attention > 2.1 Scaled dot-product", "3 Results"])
+        self.assertTrue(chunks[1].page_content.startswith("2 Attention\n2.1 Scaled dot-product\n"))
+        self.assertEqual(chunks[0].metadata["source"], "a.pdf")
+
+    def test_paragraph_across_pages_is_joined(self):
+        chunks = list(LayoutChunker(max_chars=3000, min_chars=0).split_pages(self.pages(), {}))
+        self.assertIn("The softmax is taken over the keys, one row per query.", chunks[1].page_content)
+        self.assertEqual((chunks[1].metadata["page"], chunks[1].metadata["page_end"]), (0, 1))
+
+    def test_short_sections_are_packed_together(self):
+        chunks = list(LayoutChunker(max_chars=3000, min_chars=1500).split_pages(self.pages(), {}))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].metadata, {"page": 0, "page_end": 1, "section": "1 Introduction"})
+        self.assertIn("\n2 Attention\n", chunks[0].page_content)
+
+    def test_long_paragraphs_split_at_sentences(self):
+        chunks = list(LayoutChunker(max_chars=300, min_chars=0).split_pages(self.pages(), {}))
+        # Section 2.1's long paragraph is cut in two, each piece led by its heading
+        self.assertEqual([chunk.page_content.split("\n")[0] for chunk in chunks],
+                         ["1 Introduction", "2 Attention", "2.1 Scaled dot-product", "3 Results"])
+        for chunk in chunks:
+            body = chunk.page_content.split("\n")[-1]
+            self.assertLessEqual(len(body), 300)
+            self.assertTrue(body.rstrip().endswith("."))
+
+    def test_running_headers_and_page_numbers_are_skipped(self):
+        pages = [page(i, [line("Lecture notes", 0, 20, first=True),
+                          line(f"Section {i} text that is long enough to count as body.", 1, 300, first=True),
+                          line(str(i + 1), 2, 780, first=True)]) for i in range(4)]
+        text = "\n".join(chunk.page_content for chunk in LayoutChunker(min_chars=0).split_pages(pages, {}))
+        self.assertNotIn("Lecture notes", text)
+        self.assertNotIn("\n1\n", f"\n{text}\n")
+        self.assertIn("Section 3 text", text)
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = NumpyVectorStore(persist_directory=self.directory)
+        self.vectors = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        self.ids = [f"pdfs/{'ml' if i % 2 else 'bio'}/doc{i}.pdf#0" for i in range(100)]
+        self.store.upsert(self.ids, self.vectors, [f"text {i}" for i in range(100)],
+                          [{"course": "ml" if i % 2 else "bio", "n": i} for i in range(100)])
+
+    def search(self, vector, k=3, **kwargs):
+        return [doc.id for doc, _ in self.store.similarity_search_with_score_by_vector(vector, k, **kwargs)]
+
+    def test_finds_nearest_by_cosine(self):
+        self.assertEqual(self.search(self.vectors[7] * 5)[0], self.ids[7])
+        scores = [score for _, score in self.store.similarity_search_with_score_by_vector(self.vectors[7], 5)]
+        self.assertAlmostEqual(scores[0], 1.0, places=5)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_metadata_filter(self):
+        found = self.store.similarity_search_with_score_by_vector(self.vectors[8], 5, filter={"course": "ml"})
+        self.assertEqual(len(found), 5)
+        self.assertTrue(all(doc.metadata["course"] == "ml" for doc, _ in found))
+        both = {"$and": [{"course": "bio"}, {"n": {"$in": [8, 10]}}]}
+        self.assertEqual(sorted(self.search(self.vectors[8], 5, filter=both)), sorted([self.ids[8], self.ids[10]]))
+
+    def test_upsert_replaces_and_delete_hides(self):
+        self.store.upsert([self.ids[3]], [self.vectors[50]], ["moved"])
+        self.assertEqual(self.store.count(), 100)
+        self.assertEqual(set(self.search(self.vectors[50], 2)), {self.ids[3], self.ids[50]})
+        self.store.delete([self.ids[50]])
+        self.assertEqual(self.search(self.vectors[50], 1), [self.ids[3]])
+        self.assertEqual(self.store.get(ids=[self.ids[3]])["documents"], ["moved"])
+
+    def test_compaction_keeps_results(self):
+        self.store.delete(self.ids[:40])
+        before = self.search(self.vectors[60], 5)
+        self.assertEqual(self.store.compact(), 40)
+        self.assertEqual(self.store.compact(), 0)
+        self.assertEqual(self.search(self.vectors[60], 5), before)
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, self.store._info()["vectors_file"])), 60 * 8 * 4)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith(".f32")],
+                         [self.store._info()["vectors_file"]])
+
+    def test_ivf_matches_exact_search(self):
+        self.store.build_ivf(lists=4)
+        self.store.nprobe = 4  # every list: the IVF result must equal the exact one
+        rows, _ = self.store.search_rows(self.vectors[11], 5)
+        exact, _ = self.store.search_rows(self.vectors[11], 5, exact=True)
+        self.assertEqual(rows.tolist(), exact.tolist())
+        # Rows added after the build are scanned exactly
+        self.store.upsert(["late"], [self.vectors[11] + 0.01], ["late"])
+        self.assertEqual(self.search(self.vectors[11], 2), [self.ids[11], "late"])
+
+    def test_ignores_uncommitted_rows_at_the_end_of_the_file(self):
+        # What another writer leaves between its pwrite and COMMIT, or after crashing there
+        with open(os.path.join(self.directory, self.store._info()["vectors_file"]), "ab") as f:
+            f.write(self.vectors[:10].tobytes())
+        self.assertEqual(self.search(self.vectors[5], 1), [self.ids[5]])
+        self.assertEqual(len(self.search(self.vectors[5], 200)), 100)
+
+
+def job_settings(**overrides):
+    return override_settings(JOBS={**settings.JOBS, **overrides})
+
+
+@job_settings(RETRY_BASE_SECONDS=5, MAX_ATTEMPTS=2, LEASE_SECONDS=60, RETENTION_SECONDS=3600)
+class JobQueueTests(TestCase):
+    def index_job(self, etag="etag-1"):
+        return jobs.enqueue_indexing("pdfs/ml/a.pdf", f'"{etag}"')
+
+    def run_next(self, handler):
+        job = jobs.claim_next("worker")
+        with mock.patch.dict(jobs.HANDLERS, {Job.KIND_INDEX: handler}):
+            jobs.run_job(job)
+        job.refresh_from_db()
+        return job
+
+    def test_identical_requests_join_the_active_job(self):
+        first = self.index_job()
+        self.assertEqual(self.index_job().id, first.id)
+        self.assertNotEqual(self.index_job("etag-2").id, first.id)
+        self.assertIsNone(jobs.enqueue_indexing("pdfs/ml/notes.txt", "etag"))
+
+    def test_finished_jobs_are_not_reused_for_new_work(self):
+        first = self.index_job()
+        self.run_next(lambda job: "{}")
+        second = self.index_job()
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(second.status, Job.QUEUED)
+
+    def test_cache_hits_reuse_the_finished_job(self):
+        first, created = jobs.enqueue(Job.KIND_STRUCTURE, "digest", "text", "v1", result="{}")
+        second, created_again = jobs.enqueue(Job.KIND_STRUCTURE, "digest", "text", "v1", result="{}")
+        self.assertEqual((created, created_again), (True, False))
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(first.status, Job.SUCCEEDED)
+
+    def test_success_stores_result_and_drops_input(self):
+        self.index_job()
+        job = self.run_next(lambda job: '{"chunks": 3}')
+        self.assertEqual((job.status, job.result, job.attempts, job.locked_by), (Job.SUCCEEDED, '{"chunks": 3}', 1, ""))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        self.index_job()
+
+        def fail(job):
+            raise RuntimeError("parse error")
+
+        job = self.run_next(fail)
+        self.assertEqual((job.status, job.error), (Job.QUEUED, "parse error"))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=4))
+        self.assertIsNone(jobs.claim_next("worker"))  # not due yet
+        Job.objects.update(run_after=timezone.now())
+        job = self.run_next(fail)
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_busy_provider_defers_without_using_an_attempt(self):
+        self.index_job()
+
+        def busy(job):
+            raise ServiceBusy("rate limited", 30)
+
+        job = self.run_next(busy)
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+
+    def test_expired_leases_are_requeued_or_failed(self):
+        self.index_job()
+        job = jobs.claim_next("dead-worker")
+        Job.objects.update(locked_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(jobs.claim_next("worker").id, job.id)  # requeued and claimed again
+        Job.objects.update(locked_at=timezone.now() - timedelta(seconds=61))
+        jobs.release_stale_jobs(timezone.now())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_retention_sweep_deletes_only_old_finished_jobs(self):
+        old, _ = jobs.enqueue(Job.KIND_STRUCTURE, "old", "", "v1", result="{}")
+        Job.objects.filter(id=old.id).update(finished_at=timezone.now() - timedelta(hours=2))
+        recent, _ = jobs.enqueue(Job.KIND_STRUCTURE, "recent", "", "v1", result="{}")
+        queued = self.index_job()
+        self.assertEqual(jobs.prune_finished_jobs(timezone.now()), 1)
+        self.assertEqual(set(Job.objects.values_list("id", flat=True)), {recent.id, queued.id})
+
+
+@job_settings(LEASE_SECONDS=1, HEARTBEAT_SECONDS=0.1)
+class JobLeaseTests(TransactionTestCase):
+    def test_heartbeat_keeps_a_long_job_leased(self):
+        jobs.enqueue_indexing("pdfs/ml/a.pdf", "etag")
+        job = jobs.claim_next("worker")
+
+        def slow(job):
+            time.sleep(1.5)
+            jobs.release_stale_jobs(timezone.now())  # what another worker's claim runs meanwhile
+            return Job.objects.get(id=job.id).status
+
+        with mock.patch.dict(jobs.HANDLERS, {Job.KIND_INDEX: slow}):
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.result, job.status, job.attempts), (Job.RUNNING, Job.SUCCEEDED, 1))
+
+
+class MapReduceSlotTests(SimpleTestCase):
+    def run_counting(self, coroutine_factory):
+        running, peak = 0, 0
+
+        async def call(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return item
+
+        result = asyncio.run(coroutine_factory(call))
+        return result, peak
+
+    @override_settings(LLM_MAX_CONCURRENCY=2)
+    def test_map_calls_share_the_llm_budget(self):
+        result, peak = self.run_counting(lambda call: arun_map(list(range(8)), call, parallelism=8))
+        self.assertEqual(result, list(range(8)))
+        self.assertEqual(peak, 2)
+
+    @override_settings(LLM_MAX_CONCURRENCY=3)
+    def test_reduce_calls_share_the_llm_budget(self):
+        async def combine(call, group):
+            return "".join([await call(part) for part in group])
+
+        parts = ["x" * 40] * 12
+        result, peak = self.run_counting(
+            lambda call: areduce_to_budget(parts, lambda group: combine(call, group), token_budget=20, parallelism=8))
+        self.assertEqual(result, ["x" * 480])
+        self.assertLessEqual(peak, 3)
+
+
+@mock_aws
+class BulkIngestTests(SimpleTestCase):
+    def setUp(self):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        from .benchmark import synthetic_pdf
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket="lms")
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/good.pdf", Body=synthetic_pdf("ml", 0, pages=2))
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/corrupt.pdf", Body=b"%PDF-1.4 not really a pdf")
+        self.embeddings = DeterministicFakeEmbedding(size=8)
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=500)
+        self.logged = []
+
+    def ingest(self):
+        store = NumpyVectorStore(self.embeddings, self.directory)
+        return bulk_ingest(self.s3, "lms", store, self.embeddings, self.splitter, self.directory,
+                           download_workers=2, parse_workers=1, log=self.logged.append)
+
+    def test_corrupt_pdf_is_skipped_and_retried_next_run(self):
+        stats = self.ingest()
+        self.assertEqual((stats["added"], stats["failed"]), (1, 1))
+        self.assertTrue(any("corrupt.pdf" in message for message in self.logged))
+        self.assertEqual(list(load_manifest(self.directory)["objects"]), ["pdfs/ml/good.pdf"])
+
+        stats = self.ingest()
+        self.assertEqual((stats["added"], stats["failed"]), (0, 1))
+
+    def test_manifest_keeps_stored_pdfs_when_the_run_aborts(self):
+        from .benchmark import synthetic_pdf
+        # One chunk per PDF, so each PDF is its own embedding call
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/good.pdf", Body=synthetic_pdf("ml", 0, pages=1))
+        self.s3.delete_object(Bucket="lms", Key="pdfs/ml/corrupt.pdf")
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/other.pdf", Body=synthetic_pdf("ml", 1, pages=1))
+        calls = []
+
+        def embed_documents(texts):
+            calls.append(texts)
+            if len(calls) > 1:
+                time.sleep(0.3)  # lets the first round be stored before the run aborts
+                raise RuntimeError("quota exceeded")
+            return [[0.1] * 8 for _ in texts]
+
+        embeddings = mock.Mock(embed_documents=embed_documents)
+        store = NumpyVectorStore(embeddings, self.directory)
+        with self.assertRaisesMessage(RuntimeError, "quota exceeded"):
+            bulk_ingest(self.s3, "lms", store, embeddings, self.splitter, self.directory,
+                        download_workers=1, parse_workers=1, embed_batch_size=1, embed_concurrency=1, log=self.logged.append)
+        self.assertEqual(len(load_manifest(self.directory)["objects"]), 1)
+
+
+@mock_aws
+@override_settings(UPLOADS={**settings.UPLOADS, "MULTIPART_THRESHOLD": 8 * 1024 * 1024, "PART_SIZE": 5 * 1024 * 1024})
+class PresignedUploadTests(SimpleTestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket="lms")
+        patcher = mock.patch("quiz_api.upload.s3_client", return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def presign(self, size, filename="notes.pdf"):
+        result = presign_upload(filename, "ml", size, bucket_name="lms")
+        self.assertTrue(result["status"], result)
+        return result
+
+    def test_single_put_upload(self):
+        result = self.presign(1024)
+        self.assertEqual((result["method"], result["key"]), ("PUT", "pdfs/ml/notes.pdf"))
+        self.s3.put_object(Bucket="lms", Key=result["key"], Body=b"x" * 1024)  # what the client PUTs to result["url"]
+
+        done = complete_upload(result["upload_token"], bucket_name="lms")
+        self.assertEqual((done["status"], done["key"], done["size"]), (True, "pdfs/ml/notes.pdf", 1024))
+        self.assertFalse(abort_upload(result["upload_token"], bucket_name="lms")["status"])
+
+    def test_multipart_upload(self):
+        size = 11 * 1024 * 1024
+        result = self.presign(size)
+        self.assertEqual((result["method"], len(result["parts"])), ("multipart", 3))
+        parts = []
+        for part in result["parts"]:
+            body = b"x" * min(result["part_size"], size - (part["part_number"] - 1) * result["part_size"])
+            response = self.s3.upload_part(Bucket="lms", Key=result["key"], UploadId=result["upload_id"],
+                                           PartNumber=part["part_number"], Body=body)
+            parts.append({"part_number": part["part_number"], "etag": response["ETag"]})
+
+        self.assertFalse(complete_upload(result["upload_token"], bucket_name="lms")["status"])  # parts missing
+        done = complete_upload(result["upload_token"], list(reversed(parts)), bucket_name="lms")
+        self.assertEqual((done["status"], done["size"]), (True, size))
+
+    def test_abort_multipart_upload(self):
+        result = self.presign(9 * 1024 * 1024)
+        self.assertTrue(abort_upload(result["upload_token"], bucket_name="lms")["status"])
+        self.assertNotIn("Uploads", self.s3.list_multipart_uploads(Bucket="lms"))
+
+    def test_only_presigned_uploads_are_accepted(self):
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/other.pdf", Body=b"x")
+        token = self.presign(1024)["upload_token"]
+        unsalted = signing.dumps({"key": "pdfs/ml/other.pdf", "upload_id": None})
+        for forged in (None, "", "pdfs/ml/other.pdf", unsalted, token[:-1] + ("A" if token[-1] != "A" else "B")):
+            result = complete_upload(forged, bucket_name="lms")
+            self.assertEqual((result["status"], result["error"]), (False, "Invalid or expired upload_token"))
+            self.assertFalse(abort_upload(forged, bucket_name="lms")["status"])
+
+    def test_tokens_expire(self):
+        token = self.presign(1024)["upload_token"]
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/notes.pdf", Body=b"x")
+        with override_settings(UPLOADS={**settings.UPLOADS, "TOKEN_MAX_AGE": -1}):
+            self.assertFalse(complete_upload(token, bucket_name="lms")["status"])
+
+
+class UploadViewTests(SimpleTestCase):
+    async def test_complete_rejects_a_bare_key(self):
+        response = await self.async_client.post("/api/uploads/complete/", {"key": "pdfs/ml/other.pdf"},
+                                                 content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "Invalid or expired upload_token")
+
+
+def mcq(question, difficulty=5):
+    return {"question": question, "options": {"A": "yes", "B": "no"}, "answer": "A", "difficulty": difficulty}
+
+
+class QuestionBankTests(TestCase):
+    QUESTIONS = [
+        "What does gradient descent minimise during training?",
+        "Which activation function outputs values between zero and one?",
+        "Why does dropout reduce overfitting in deep networks?",
+        "How does k-fold cross validation estimate generalisation error?",
+        "What problem does batch normalisation address?",
+        "When is precision a better metric than recall?",
+    ]
+
+    def setUp(self):
+        from langchain_core.documents import Document
+        self.docs = [Document("chunk", id="pdfs/ml/intro.pdf#0", metadata={"source": "pdfs/ml/intro.pdf", "page": 2})]
+        self.questions = iter(self.QUESTIONS)
+        self.generated = []
+        patcher = mock.patch.object(question_bank, "single_flight", lambda name: SingleFlight(name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate(self, n):
+        self.generated.append(n)
+        return [mcq(next(self.questions)) for _ in range(n)], self.docs
+
+    def serve(self, count, session_key, topic="Neural  Networks", course=None):
+        return question_bank.serve_quiz(topic, "Medium", count, self.generate, course=course, session_key=session_key)
+
+    def test_generates_only_the_shortfall(self):
+        first = self.serve(2, "alice")
+        self.assertEqual(self.generated, [2])
+        self.assertEqual([item["question"] for item in first], self.QUESTIONS[:2])
+
+        # Another session is served the banked questions; this one needs fresh ones
+        self.assertEqual(self.serve(2, "bob"), first)
+        second = self.serve(3, "alice")
+        self.assertEqual(self.generated, [2, 3])
+        self.assertFalse({item["id"] for item in first} & {item["id"] for item in second})
+        self.assertEqual(SeenMCQ.objects.filter(session_key="alice").count(), 5)
+
+    def test_rows_record_their_source(self):
+        self.serve(1, None, topic="  Neural NETWORKS ")
+        row = MCQ.objects.get()
+        self.assertEqual((row.topic, row.document.course, row.document.name), ("neural networks", "ml", "intro.pdf"))
+        self.assertEqual(list(row.chunks.values_list("vector_id", "page")), [("pdfs/ml/intro.pdf#0", 2)])
+        self.assertEqual(self.serve(1, "carol", course="ml")[0]["id"], row.id)
+        self.assertEqual(self.generated, [1])
+        self.serve(1, "carol", course="stats")
+        self.assertEqual(self.generated, [1, 1])
+
+    def test_near_duplicates_are_not_banked(self):
+        rows = question_bank.store_mcqs("ml", "Medium", [mcq(self.QUESTIONS[0]), mcq(self.QUESTIONS[1])], self.docs)
+        self.assertEqual(len(rows), 2)
+        again = [mcq(self.QUESTIONS[0].replace("What", "what").rstrip("?")), mcq(self.QUESTIONS[2]), mcq(self.QUESTIONS[2])]
+        self.assertEqual([row.question for row in question_bank.store_mcqs("ml", "Medium", again, self.docs)],
+                         [self.QUESTIONS[2]])
+        self.assertEqual(MCQ.objects.count(), 3)
+
+    async def test_async_variant_banks_and_marks_seen(self):
+        async def agenerate(n):
+            return self.generate(n)
+
+        first = await question_bank.aserve_quiz("ml", "Easy", 2, agenerate, session_key="dave")
+        second = await question_bank.aserve_quiz("ml", "Easy", 2, agenerate, session_key="dave")
+        self.assertEqual(self.generated, [2, 2])
+        self.assertEqual(len({item["id"] for item in first + second}), 4)
+
+    def test_difficulty_is_kept_inside_the_band(self):
+        rows = question_bank.store_mcqs("ml", "Hard", [mcq(self.QUESTIONS[0], 2), mcq(self.QUESTIONS[1], "?")], [])
+        self.assertEqual([row.difficulty for row in rows], [7, 8])
+        self.assertIsNone(rows[0].document)
+
+
+@mock_aws
+class IndexingTests(SimpleTestCase):
+    def setUp(self):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        from .benchmark import synthetic_pdf
+
+        self.synthetic_pdf = synthetic_pdf
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket="lms")
+        self.put("pdfs/ml/a.pdf", 0)
+        self.put("pdfs/bio/b.pdf", 1)
+        self.s3.put_object(Bucket="lms", Key="pdfs/ml/readme.txt", Body=b"not a pdf")
+        self.store = NumpyVectorStore(DeterministicFakeEmbedding(size=8), self.directory)
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+    def put(self, key, seed, pages=2):
+        self.s3.put_object(Bucket="lms", Key=key, Body=self.synthetic_pdf("ml", seed, pages=pages))
+
+    def sync(self):
+        with mock.patch("builtins.print"):
+            return indexing.sync_vector_index(self.s3, "lms", self.store, self.splitter, self.directory)
+
+    def test_sync_only_touches_changed_pdfs(self):
+        self.assertEqual(self.sync(), {"added": ["pdfs/bio/b.pdf", "pdfs/ml/a.pdf"], "updated": [], "removed": []})
+        manifest = load_manifest(self.directory)
+        self.assertEqual(manifest["version"], 1)
+        entry = manifest["objects"]["pdfs/ml/a.pdf"]
+        self.assertEqual(entry["ids"], indexing.chunk_ids("pdfs/ml/a.pdf", len(entry["ids"])))
+        self.assertEqual(self.store.count(), sum(len(e["ids"]) for e in manifest["objects"].values()))
+        metadata = self.store.get(ids=entry["ids"][:1])["metadatas"][0]
+        self.assertEqual((metadata["course"], metadata["document"]), ("ml", "a.pdf"))
+
+        self.assertEqual(self.sync(), {"added": [], "updated": [], "removed": []})
+        self.assertEqual(load_manifest(self.directory)["version"], 1)
+
+        self.put("pdfs/ml/a.pdf", 2, pages=1)
+        self.s3.delete_object(Bucket="lms", Key="pdfs/bio/b.pdf")
+        self.assertEqual(self.sync(), {"added": [], "updated": ["pdfs/ml/a.pdf"], "removed": ["pdfs/bio/b.pdf"]})
+        manifest = load_manifest(self.directory)
+        self.assertEqual((manifest["version"], list(manifest["objects"])), (2, ["pdfs/ml/a.pdf"]))
+        self.assertEqual(self.store.count(), len(manifest["objects"]["pdfs/ml/a.pdf"]["ids"]))
+
+    def test_index_key_adds_one_upload(self):
+        self.sync()
+        self.put("pdfs/ml/c.pdf", 3, pages=1)
+        result = indexing.index_key(self.s3, "lms", "pdfs/ml/c.pdf", self.store, self.splitter, self.directory)
+        self.assertEqual(result["change"], "added")
+        self.assertGreater(result["chunks"], 0)
+        self.assertEqual(load_manifest(self.directory)["version"], 2)
+        again = indexing.index_key(self.s3, "lms", "pdfs/ml/c.pdf", self.store, self.splitter, self.directory)
+        self.assertIsNone(again["change"])
+
+    def test_rebuilds_an_index_without_a_manifest(self):
+        self.store.upsert(["orphan"], [[0.5] * 8], ["from before the manifest"])
+        self.sync()
+        self.assertEqual(self.store.get(ids=["orphan"])["ids"], [])
+
+
+class ManifestTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_save_and_load(self):
+        self.assertEqual(load_manifest(self.directory)["objects"], {})
+        indexing.save_manifest(self.directory, {"version": 3, "objects": {"pdfs/a.pdf": {"ids": []}}})
+        manifest = load_manifest(self.directory)
+        self.assertEqual((manifest["version"], manifest["metadata_version"]), (3, 0))
+        self.assertEqual(os.listdir(self.directory), [indexing.MANIFEST_NAME])
+
+        with open(indexing.manifest_path(self.directory), "w") as f:
+            f.write("{truncated")
+        self.assertEqual(load_manifest(self.directory)["version"], 0)
+
+    def test_lock_is_reentrant_and_excludes_other_threads(self):
+        events = []
+        with indexing.manifest_lock(self.directory):
+            with indexing.manifest_lock(self.directory):
+                pass
+
+            def other():
+                with indexing.manifest_lock(self.directory):
+                    events.append("other")
+
+            thread = threading.Thread(target=other)
+            thread.start()
+            time.sleep(0.1)
+            events.append("holder")
+        thread.join(5)
+        self.assertEqual(events, ["holder", "other"])
+
+    def test_keys_and_tags(self):
+        self.assertEqual(indexing.course_key("ml", "a.pdf"), "pdfs/ml/a.pdf")
+        self.assertEqual(indexing.course_key(None, "a.pdf"), "pdfs/a.pdf")
+        self.assertEqual(indexing.chunk_metadata("pdfs/a.pdf")["course"], indexing.DEFAULT_COURSE)
+        self.assertEqual(indexing.key_from_chunk_id("pdfs/ml/a#b.pdf#12"), "pdfs/ml/a#b.pdf")
+        self.assertFalse(indexing.is_valid_course("../etc"))
+        self.assertEqual(indexing.scope_filter("ml", "a.pdf"), {"$and": [{"course": "ml"}, {"document": "a.pdf"}]})
+
+
+class PdfCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = PdfCache(self.directory, 1000)
+
+    def digest(self, n):
+        return f"{n:02d}" + "ab" * 31
+
+    def age(self, digest, seconds_ago):
+        path = self.cache._path(digest, "txt")
+        stamp = time.time() - seconds_ago
+        os.utime(path, (stamp, stamp))
+
+    def test_text_and_results_round_trip(self):
+        digest = self.digest(1)
+        self.assertIsNone(self.cache.get_text(digest))
+        self.cache.set_text(digest, "extracted")
+        self.cache.set_result(digest, "summary", "v1", {"text": "short"}, key="what is it?")
+        self.cache.set_result(digest, "summary", "v2", "newer prompt")
+        self.assertEqual(self.cache.get_text(digest), "extracted")
+        self.assertEqual(self.cache.get_result(digest, "summary", "v1", key="what is it?"), {"text": "short"})
+        self.assertIsNone(self.cache.get_result(digest, "summary", "v1", key="something else"))
+        self.assertEqual(self.cache.get_result(digest, "summary", "v2"), "newer prompt")
+
+    def test_size_is_tracked_without_walking(self):
+        self.cache.set_text(self.digest(1), "x" * 100)  # first write walks to learn the size
+        with mock.patch.object(self.cache, "_evict", wraps=self.cache._evict) as evict:
+            self.cache.set_text(self.digest(2), "x" * 200)
+            self.cache.set_text(self.digest(1), "x" * 50)  # overwrite: only the difference counts
+            self.assertEqual(self.cache._size, 250)
+            evict.assert_not_called()
+
+    def test_evicts_least_recently_used_below_the_limit(self):
+        for n in range(4):
+            self.cache.set_text(self.digest(n), "x" * 200)
+            self.age(self.digest(n), 100 - n)
+        self.cache.get_text(self.digest(0))  # reading refreshes it
+
+        self.cache.set_text(self.digest(4), "x" * 300)  # 1100 bytes > max_bytes
+        kept = [n for n in range(5) if self.cache.get_text(self.digest(n)) is not None]
+        self.assertEqual(kept, [0, 2, 3, 4])
+        self.assertEqual(self.cache._size, 1000 * 0.9)
+
+    def test_walk_resyncs_with_other_writers(self):
+        self.cache.set_text(self.digest(1), "x" * 100)
+        PdfCache(self.directory, 1000).set_text(self.digest(2), "x" * 800)  # another worker
+        self.cache.set_text(self.digest(3), "x" * 300)
+        self.assertEqual(self.cache._size, 400)  # unaware of the other write until the next walk
+        self.cache.set_text(self.digest(4), "x" * 700)
+        on_disk = sum(os.path.getsize(os.path.join(root, name))
+                      for root, _, names in os.walk(self.directory) for name in names)
+        self.assertEqual(self.cache._size, on_disk)
+        self.assertLessEqual(on_disk, 900)
+
+
+class CountingEmbedder:
+    """Embeds text as [len(text), 1.0], recording each call; fails with 429 while failures_left > 0."""
+
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures_left = failures
+
+    def _embed(self, texts):
+        self.calls.append(list(texts))
+        if self.failures_left:
+            self.failures_left -= 1
+            raise RuntimeError("429 Resource has been exhausted")
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_documents(self, texts):
+        return self._embed(texts)
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+    async def aembed_documents(self, texts):
+        return self._embed(texts)
+
+    async def aembed_query(self, text):
+        return self._embed([text])[0]
+
+
+class CachedEmbeddingsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "embeddings.sqlite3")
+        self.embedder = CountingEmbedder()
+
+    def cached(self, **kwargs):
+        return CachedEmbeddings(self.embedder, self.path, **kwargs)
+
+    def test_documents_are_deduplicated_and_persisted(self):
+        embeddings = self.cached(batch_size=2)
+        vectors = embeddings.embed_documents(["a", "bb", "a", "ccc"])
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0], [3.0, 1.0]])
+        self.assertEqual(self.embedder.calls, [["a", "bb"], ["ccc"]])
+
+        # A new process (same file) only embeds what it has not seen
+        again = self.cached()
+        self.assertEqual(again.embed_documents(["ccc", "dddd"]), [[3.0, 1.0], [4.0, 1.0]])
+        self.assertEqual(self.embedder.calls[-1], ["dddd"])
+        self.assertEqual((again.stats()["hits"], again.stats()["misses"]), (1, 1))
+
+    def test_namespaces_and_queries_are_kept_apart(self):
+        self.cached().embed_documents(["a"])
+        self.cached(namespace="other-model").embed_documents(["a"])
+        self.cached().embed_query("a")
+        self.assertEqual(self.embedder.calls, [["a"], ["a"], ["a"]])
+
+    def test_query_lru(self):
+        embeddings = self.cached(query_cache_size=2)
+        for text in ["q1", "q2", "q1", "q3", "q1", "q2"]:
+            embeddings.embed_query(text)
+        self.assertEqual([call[0] for call in self.embedder.calls], ["q1", "q2", "q3", "q2"])
+        self.assertEqual(embeddings.stats()["cached_queries"], 2)
+
+    def test_rate_limits_are_retried(self):
+        self.embedder.failures_left = 2
+        embeddings = self.cached(base_delay=0.001)
+        self.assertEqual(embeddings.embed_documents(["a"]), [[1.0, 1.0]])
+        self.assertEqual((embeddings.stats()["api_calls"], embeddings.stats()["retries"]), (3, 2))
+
+        self.embedder.failures_left = 5
+        with self.assertRaisesMessage(RuntimeError, "429"):
+            self.cached(base_delay=0.001, max_retries=1).embed_query("q")
+
+    def test_other_errors_are_not_retried(self):
+        embeddings = self.cached(base_delay=0.001)
+        with mock.patch.object(self.embedder, "embed_documents", side_effect=ValueError("bad input")):
+            with self.assertRaises(ValueError):
+                embeddings.embed_documents(["a"])
+        self.assertEqual(embeddings.stats()["retries"], 0)
+
+    def test_async_variants_share_the_cache(self):
+        embeddings = self.cached()
+        embeddings.embed_documents(["a"])
+        vectors = asyncio.run(embeddings.aembed_documents(["a", "bb"]))
+        asyncio.run(embeddings.aembed_query("q"))
+        embeddings.embed_query("q")
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0]])
+        self.assertEqual(self.embedder.calls, [["a"], ["bb"], ["q"]])
+
+
+def sentence_text(seed, sentences=12):
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "kappa", "lambda", "sigma"]
+    return " ".join(f"{words[(seed + i) % 10]} {words[(seed * 3 + i) % 10]} item{seed}x{i}." for i in range(sentences))
+
+
+class ContextBuilderTests(SimpleTestCase):
+    def doc(self, text, doc_id, page=1):
+        from langchain_core.documents import Document
+        return Document(text, id=doc_id, metadata={"source": doc_id.split("#")[0], "page": page})
+
+    def test_drops_near_duplicates(self):
+        text = sentence_text(1)
+        docs = [self.doc(text, "pdfs/a.pdf#0"), self.doc(text + " extra", "pdfs/b.pdf#0"),
+                self.doc(sentence_text(2), "pdfs/b.pdf#1")]
+        self.assertEqual([doc.id for doc in build_context(docs, 10000)], ["pdfs/a.pdf#0", "pdfs/b.pdf#1"])
+
+    def test_trims_splitter_overlap_on_the_same_page(self):
+        text = sentence_text(3, 60)
+        first, second = text[:700], text[500:]
+        kept = build_context([self.doc(first, "pdfs/a.pdf#0"), self.doc(second, "pdfs/a.pdf#1")], 10000, 0.95)
+        self.assertEqual(kept[0].page_content + " " + kept[1].page_content, first + " " + text[700:].lstrip())
+        self.assertEqual(trim_overlap(second, first), first[:500].rstrip())
+        self.assertEqual(trim_overlap("unrelated " * 10, first), first)
+
+    def test_packs_in_rank_order_within_the_budget(self):
+        docs = [self.doc(sentence_text(4, 10), "pdfs/a.pdf#0"), self.doc(sentence_text(5, 40), "pdfs/b.pdf#0"),
+                self.doc(sentence_text(6, 10), "pdfs/c.pdf#0")]
+        budget = estimate_tokens(docs[0].page_content) + estimate_tokens(docs[2].page_content)
+        self.assertEqual([doc.id for doc in build_context(docs, budget)], ["pdfs/a.pdf#0", "pdfs/c.pdf#0"])
+        self.assertEqual(build_context(docs, 10), [])
+
+    def test_reciprocal_rank_fusion(self):
+        self.assertEqual(reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]]), ["b", "a", "d", "c"])
+
+
+class BudgetedRetrieverTests(SimpleTestCase):
+    def setUp(self):
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+        self.store = NumpyVectorStore(self.embeddings, directory)
+        self.keyword_index = KeywordIndex(os.path.join(directory, "keyword_index.sqlite3"))
+        self.ids = [f"pdfs/{'ml' if i % 2 else 'bio'}/doc{i}.pdf#0" for i in range(6)]
+        texts = [sentence_text(i) + (" See section 4.2 on ReLU." if i == 3 else "") for i in range(6)]
+        metadatas = [{"source": key.split("#")[0], "page": 1, "course": key.split("/")[1],
+                      "document": key.split("/")[2].split("#")[0]} for key in self.ids]
+        self.store.upsert(self.ids, self.embeddings.embed_documents(texts), texts, metadatas)
+        self.keyword_index.add(self.ids, texts)
+
+    def retriever(self, **kwargs):
+        return BudgetedRetriever(vectorstore=self.store, keyword_index=self.keyword_index, max_chunks=4, **kwargs)
+
+    def test_lexical_lookups_skip_the_embedding(self):
+        with mock.patch.object(DeterministicFakeEmbedding, "embed_query", side_effect=AssertionError("embedded")):
+            docs = self.retriever().invoke("ReLU 4.2")
+        self.assertEqual([doc.id for doc in docs], [self.ids[3]])
+
+    def test_scoped_retrieval_and_budget(self):
+        docs = self.retriever().scoped(course="ml").invoke("alpha beta gamma")
+        self.assertTrue(docs)
+        self.assertTrue(all("/ml/" in doc.id for doc in docs))
+        small = self.retriever(token_budget=estimate_tokens(sentence_text(0))).invoke("alpha beta gamma")
+        self.assertEqual(len(small), 1)
+
+
+class FakeChatModel:
+    def __init__(self, reply="", error=None):
+        self.reply, self.error, self.prompts, self.cached = reply, error, [], []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        if self.error:
+            raise self.error
+        return mock.Mock(content=self.reply)
+
+    def create_cached_content(self, messages, ttl):
+        self.cached.append(messages)
+        return f"cachedContents/{len(self.cached)}"
+
+
+def conversation_settings(**overrides):
+    return override_settings(CONVERSATION={**settings.CONVERSATION, **overrides})
+
+
+@conversation_settings(MAX_TURNS=3, KEEP_TURNS=1, REUSE_THRESHOLD=0.8, IDLE_SECONDS=60, CONTEXT_CACHE_MIN_TOKENS=10)
+class ConversationTests(TestCase):
+    async def record(self, chat, llm, n):
+        for i in range(n):
+            await conversation.arecord_turn(llm, chat, f"question {i}", f"answer {i}")
+
+    async def test_old_turns_fold_into_the_summary(self):
+        chat = await conversation.aload("alice")
+        llm = FakeChatModel("Covered questions 0-2.")
+        await self.record(chat, llm, 3)
+        self.assertEqual(llm.prompts, [])
+        await self.record(chat, llm, 1)
+        self.assertEqual((chat.summary, [turn["user"] for turn in chat.turns]), ("Covered questions 0-2.", ["question 0"]))
+        self.assertIn("Student: question 2", llm.prompts[0])
+
+        saved = await conversation.aload("alice")
+        self.assertEqual(saved.summary, "Covered questions 0-2.")
+        self.assertEqual(len(conversation.history_messages(saved)), 4)
+
+    async def test_failed_summary_still_bounds_the_window(self):
+        chat = await conversation.aload("bob")
+        with mock.patch("builtins.print"):
+            await self.record(chat, FakeChatModel(error=RuntimeError("busy")), 5)
+        self.assertEqual((chat.summary, len(chat.turns)), ("", 3))
+
+    async def test_scope_change_and_idleness_start_over(self):
+        chat = await conversation.aload("carol", "ml")
+        await self.record(chat, FakeChatModel(), 1)
+        self.assertEqual(len((await conversation.aload("carol", "ml")).turns), 1)
+        self.assertEqual((await conversation.aload("carol", "bio")).turns, [])
+
+        await Conversation.objects.filter(session_key="carol").aupdate(updated_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual((await conversation.aload("carol", "ml")).turns, [])
+
+    async def test_follow_ups_are_rewritten(self):
+        chat = await conversation.aload("dave")
+        llm = FakeChatModel('"What is an example of overfitting in decision trees?"')
+        self.assertEqual(await conversation.arewrite_query(llm, chat, "give an example"), "give an example")
+        await self.record(chat, llm, 1)
+        self.assertEqual(await conversation.arewrite_query(llm, chat, "give an example"),
+                         "What is an example of overfitting in decision trees?")
+        question = "Explain how gradient boosting combines many weak learners into a strong model"
+        self.assertEqual(await conversation.arewrite_query(llm, chat, question), question)
+
+    def test_chunks_are_reused_while_the_topic_holds(self):
+        from langchain_core.documents import Document
+        chat = Conversation(session_key="erin")
+        self.assertFalse(conversation.can_reuse_chunks(chat, [1.0, 0.0], 1))
+        conversation.remember_chunks(chat, [Document("a", id="pdfs/a.pdf#0"), Document("b")], [1.0, 0.0], 1)
+        self.assertEqual(chat.chunk_ids, ["pdfs/a.pdf#0"])
+        self.assertTrue(conversation.can_reuse_chunks(chat, [0.9, 0.1], 1))
+        self.assertFalse(conversation.can_reuse_chunks(chat, [0.1, 0.9], 1))  # new topic
+        self.assertFalse(conversation.can_reuse_chunks(chat, [1.0, 0.0], 2))  # index changed since
+
+    async def test_context_cache_is_created_once_per_topic(self):
+        from langchain_core.messages import SystemMessage
+        chat = Conversation(session_key="frank")
+        llm = FakeChatModel()
+        self.assertIsNone(await conversation.acontext_cache(llm, chat, SystemMessage("short")))
+        prefix = SystemMessage("study material " * 20)
+        self.assertEqual(await conversation.acontext_cache(llm, chat, prefix), "cachedContents/1")
+        self.assertEqual(await conversation.acontext_cache(llm, chat, prefix), "cachedContents/1")
+        conversation.forget_chunks(chat)
+        self.assertEqual(await conversation.acontext_cache(llm, chat, prefix), "cachedContents/2")
+
+
+async def read_stream(response):
+    return b"".join([chunk async for chunk in response.streaming_content]).decode()
+
+
+class AsyncViewTests(TestCase):
+    async def post(self, path, data):
+        return await self.async_client.post(path, data, content_type="application/json")
+
+    async def test_chat_answers_and_reports_unavailability(self):
+        answer = mock.AsyncMock(return_value="Attention weighs tokens.")
+        with mock.patch.object(views, "aget_rag_response", answer):
+            response = await self.post("/api/chat/", {"prompt": "What is attention?", "course": "ml", "session_id": "s1"})
+        self.assertEqual(response.json(), {"status": "success", "response": "Attention weighs tokens."})
+        answer.assert_awaited_once_with("What is attention?", "ml", None, "s1")
+
+        self.assertEqual((await self.post("/api/chat/", {})).status_code, 400)
+        with mock.patch.object(views, "aget_rag_response", side_effect=PipelineWarming("warming up")):
+            response = await self.post("/api/chat/", {"prompt": "hi"})
+        self.assertEqual((response.status_code, response["Retry-After"], response.json()["status"]), (503, "5", "warming"))
+        with mock.patch.object(views, "aget_rag_response", side_effect=ServiceBusy("rate limited", 12.4)):
+            response = await self.post("/api/chat/", {"prompt": "hi"})
+        self.assertEqual((response.status_code, response["Retry-After"], response.json()["status"]), (503, "12", "busy"))
+
+    async def test_requests_are_served_concurrently(self):
+        async def slow_answer(*args):
+            await asyncio.sleep(0.3)
+            return "done"
+
+        with mock.patch.object(views, "aget_rag_response", slow_answer):
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(self.post("/api/chat/", {"prompt": f"q{i}", "session_id": f"s{i}"})
+                                               for i in range(4)))
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+    async def test_chat_streams_server_sent_events(self):
+        async def tokens(*args):
+            for token in ["Atten", "tion"]:
+                yield token
+
+        with mock.patch.object(views, "require_pipeline"), mock.patch.object(views, "astream_rag_response", tokens):
+            response = await self.post("/api/chat/", {"prompt": "hi", "stream": True, "session_id": "s1"})
+            body = await read_stream(response)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(body, 'data: {"token": "Atten"}\n\ndata: {"token": "tion"}\n\n'
+                               'event: done\ndata: {"status": "success"}\n\n')
+
+    async def test_quiz_validates_count(self):
+        quiz = mock.AsyncMock(return_value=[{"question": "q"}])
+        with mock.patch.object(views, "aget_rag_quiz", quiz):
+            self.assertEqual((await self.post("/api/quiz/", {"prompt": "ml", "count": "x"})).status_code, 400)
+            response = await self.post("/api/quiz/", {"prompt": "ml", "count": 100000, "session_id": "s1"})
+        self.assertEqual(response.json()["mcqs"], [{"question": "q"}])
+        quiz.assert_awaited_once_with("ml", None, None, "s1", settings.BULK_QUIZ["MAX_QUESTIONS"])
+
+    async def test_equation(self):
+        with mock.patch.object(views, "aget_curve_equation", mock.AsyncMock(return_value="y = x^2")):
+            response = await self.post("/api/equation/", {"curve_name": "parabola"})
+        self.assertEqual(response.json(), {"status": "success", "equation": "y = x^2"})
+
+    async def test_jobs_can_be_polled(self):
+        self.assertEqual((await self.async_client.get(f"/api/jobs/{uuid.uuid4()}/")).status_code, 404)
+        job, _ = await sync_to_async(jobs.enqueue)(Job.KIND_SUMMARY, "digest", "text", "v1", {"user_query": "q"})
+        response = await self.async_client.get(f"/api/jobs/{job.id}/result/")
+        self.assertEqual((response.status_code, response["Retry-After"]), (202, "2"))
+        await Job.objects.filter(id=job.id).aupdate(status=Job.SUCCEEDED, result="summary")
+        response = await self.async_client.get(f"/api/jobs/{job.id}/result/")
+        self.assertEqual(response.json()["result"], "summary")
+
+    async def test_upload_pdf_queues_one_job_per_pdf(self):
+        from .benchmark import synthetic_pdf
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(setattr, pdf_cache, "_cache", None)
+        pdf_cache._cache = None
+        pdf = synthetic_pdf("ml", 0, pages=1)
+
+        async def upload():
+            return await self.async_client.post("/api/upload_pdf/", {"file": SimpleUploadedFile("a.pdf", pdf)})
+
+        with override_settings(PDF_CACHE_DIR=directory):
+            first, second = await upload(), await upload()
+            self.assertEqual((first.status_code, first.json()["job"]["id"]), (202, second.json()["job"]["id"]))
+            self.assertEqual(first["Location"], first.json()["job"]["status_url"])
+            self.assertEqual((await self.async_client.post("/api/upload_pdf/", {})).status_code, 400)
@@ -1,12 +1,39 @@
+import math
 import os
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core import signing
 from dotenv import load_dotenv
+from .clients import s3_client
+from .indexing import course_key, is_valid_course
 
 # Load environment variables
 load_dotenv()
 
-def upload_file_to_s3(file_obj, bucket_name=None, object_name=None):
+# S3 allows at most 10,000 parts per multipart upload
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# complete_upload and abort_upload only act on uploads presign_upload signed for
+UPLOAD_TOKEN_SALT = 'quiz_api.upload'
+
+
+def transfer_config():
+    """Multipart settings for server-side uploads: large files go up in concurrent parts."""
+    options = settings.UPLOADS
+    return TransferConfig(
+        multipart_threshold=options['MULTIPART_THRESHOLD'],
+        multipart_chunksize=options['PART_SIZE'],
+        max_concurrency=options['CONCURRENCY'],
+        use_threads=True,
+    )
+
+
+def object_url(bucket_name, key):
+    return f"https://{bucket_name}.s3.amazonaws.com/{key}"
+
+def upload_file_to_s3(file_obj, bucket_name=None, object_name=None, course=None):
     """
     Upload a file to an S3 bucket
     
@@ -14,38 +41,39 @@ def upload_file_to_s3(file_obj, bucket_name=None, object_name=None):
     - file_obj: File object to upload
     - bucket_name: S3 bucket name (defaults to env variable)
     - object_name: S3 object name (defaults to original filename)
+    - course: Course the PDF belongs to; it is stored under pdfs/<course>/
     
     Returns:
-    - True if file was uploaded, else False
+    - dict with status, and url, key and etag if the file was uploaded
     """
-    # Get credentials from environment variables
-    aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
-    aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
     default_bucket = os.getenv('AWS_BUCKET_NAME')
 
     # Use default bucket if none specified
     if bucket_name is None:
         bucket_name = default_bucket
 
-    # Always upload to /pdfs folder
-    object_name = f"pdfs/{file_obj.name}"
+    if course and not is_valid_course(course):
+        return {
+            'status': False,
+            'error': f"Invalid course name: {course}",
+            'message': 'Failed to upload file'
+        }
 
-    # Create S3 client
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key
-    )
+    # Always upload to /pdfs folder, one sub-folder per course
+    object_name = course_key(course, file_obj.name)
 
     try:
-        # Upload file
-        s3_client.upload_fileobj(file_obj, bucket_name, object_name)
-        
-        # Generate URL for the uploaded file
-        url = f"https://{bucket_name}.s3.amazonaws.com/{object_name}"
+        # Upload file over the shared, pooled S3 client, in concurrent parts when it is large
+        client = s3_client()
+        extra_args = {'ContentType': file_obj.content_type} if getattr(file_obj, 'content_type', None) else None
+        client.upload_fileobj(file_obj, bucket_name, object_name, ExtraArgs=extra_args, Config=transfer_config())
+        etag = client.head_object(Bucket=bucket_name, Key=object_name)['ETag']
+
         return {
             'status': True,
-            'url': url,
+            'url': object_url(bucket_name, object_name),
+            'key': object_name,
+            'etag': etag.strip('"'),
             'message': 'File uploaded successfully'
         }
     except ClientError as e:
@@ -54,3 +82,120 @@ def upload_file_to_s3(file_obj, bucket_name=None, object_name=None):
             'error': str(e),
             'message': 'Failed to upload file'
         }
+
+
+def _upload_error(error, message):
+    return {'status': False, 'error': str(error), 'message': message}
+
+
+def upload_token(key, upload_id=None):
+    return signing.dumps({'key': key, 'upload_id': upload_id}, salt=UPLOAD_TOKEN_SALT)
+
+
+def read_upload_token(token):
+    """Returns (key, upload_id) from a token issued by presign_upload; raises signing.BadSignature otherwise."""
+    data = signing.loads(token or '', salt=UPLOAD_TOKEN_SALT, max_age=settings.UPLOADS['TOKEN_MAX_AGE'])
+    return data['key'], data['upload_id']
+
+
+def part_size_for(size):
+    """Part size for a presigned multipart upload: the configured size, grown to stay within MAX_PARTS."""
+    return max(settings.UPLOADS['PART_SIZE'], MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+
+
+def presign_upload(filename, course=None, size=None, content_type=None, bucket_name=None):
+    """Lets a client upload straight to S3, so the file never passes through the app server.
+
+    Small (or unsized) files get one presigned PUT URL. Files above the multipart
+    threshold get a multipart upload with one presigned URL per part; the client
+    PUTs the parts (in parallel if it likes) and then calls complete_upload with
+    each part's ETag. Either way the response carries an upload_token, the only
+    thing complete_upload and abort_upload accept to identify the upload.
+    """
+    options = settings.UPLOADS
+    bucket_name = bucket_name or os.getenv('AWS_BUCKET_NAME')
+    filename = os.path.basename(filename or "")
+    if not filename:
+        return _upload_error("A file name is required", 'Failed to prepare upload')
+    if course and not is_valid_course(course):
+        return _upload_error(f"Invalid course name: {course}", 'Failed to prepare upload')
+    if size is not None and not 0 < size <= options['MAX_SIZE']:
+        return _upload_error(f"File size must be between 1 and {options['MAX_SIZE']} bytes", 'Failed to prepare upload')
+
+    key = course_key(course, filename)
+    expires = options['PRESIGN_EXPIRES']
+    client = s3_client()
+    extra = {'ContentType': content_type} if content_type else {}
+    try:
+        if size is None or size <= options['MULTIPART_THRESHOLD']:
+            url = client.generate_presigned_url(
+                'put_object', Params={'Bucket': bucket_name, 'Key': key, **extra}, ExpiresIn=expires)
+            return {'status': True, 'method': 'PUT', 'key': key, 'url': url, 'expires_in': expires,
+                    'upload_token': upload_token(key)}
+
+        part_size = part_size_for(size)
+        upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=key, **extra)['UploadId']
+        parts = [
+            {
+                'part_number': number,
+                'url': client.generate_presigned_url(
+                    'upload_part',
+                    Params={'Bucket': bucket_name, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+                    ExpiresIn=expires),
+            }
+            for number in range(1, math.ceil(size / part_size) + 1)
+        ]
+        return {
+            'status': True, 'method': 'multipart', 'key': key, 'upload_id': upload_id,
+            'part_size': part_size, 'parts': parts, 'expires_in': expires,
+            'upload_token': upload_token(key, upload_id),
+        }
+    except ClientError as e:
+        return _upload_error(e, 'Failed to prepare upload')
+
+
+def complete_upload(token, parts=None, bucket_name=None):
+    """Finishes a presigned upload (assembling the parts of a multipart one) and confirms the object exists."""
+    bucket_name = bucket_name or os.getenv('AWS_BUCKET_NAME')
+    try:
+        key, upload_id = read_upload_token(token)
+    except signing.BadSignature:
+        return _upload_error("Invalid or expired upload_token", 'Failed to complete upload')
+    client = s3_client()
+    try:
+        if upload_id:
+            if not parts:
+                return _upload_error("parts (part_number and etag of each part) are required", 'Failed to complete upload')
+            client.complete_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(
+                    ({'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts),
+                    key=lambda part: part['PartNumber'])},
+            )
+        head = client.head_object(Bucket=bucket_name, Key=key)
+    except (ClientError, KeyError, TypeError, ValueError) as e:
+        return _upload_error(e, 'Failed to complete upload')
+    return {
+        'status': True,
+        'url': object_url(bucket_name, key),
+        'key': key,
+        'etag': head['ETag'].strip('"'),
+        'size': head['ContentLength'],
+        'message': 'File uploaded successfully'
+    }
+
+
+def abort_upload(token, bucket_name=None):
+    """Abandons a multipart upload so S3 stops storing (and billing for) its parts."""
+    bucket_name = bucket_name or os.getenv('AWS_BUCKET_NAME')
+    try:
+        key, upload_id = read_upload_token(token)
+    except signing.BadSignature:
+        return _upload_error("Invalid or expired upload_token", 'Failed to abort upload')
+    if not upload_id:
+        return _upload_error("Only multipart uploads can be aborted", 'Failed to abort upload')
+    try:
+        s3_client().abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+    except ClientError as e:
+        return _upload_error(e, 'Failed to abort upload')
+    return {'status': True, 'key': key, 'message': 'Upload aborted'}
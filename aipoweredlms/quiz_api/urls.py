@@ -4,9 +4,16 @@ from . import views
 urlpatterns = [
     path('chat/', views.chat_api, name='chat_api'),
     path('quiz/', views.quiz_api, name='quiz_api'),
+    path('quiz/bulk/', views.bulk_quiz_api, name='bulk_quiz_api'),
     path('upload_pdf/', views.upload_pdf, name='upload_pdf'),
     path('equation/', views.get_equation, name='get_equation'),
     path('upload_file/', views.upload_file, name='upload_file'),
+    path('uploads/presign/', views.presign_upload_api, name='presign_upload'),
+    path('uploads/complete/', views.complete_upload_api, name='complete_upload'),
+    path('uploads/abort/', views.abort_upload_api, name='abort_upload'),
     path('summarize_pdf/', views.summarize_pdf, name='summarize_pdf'),
+    path('rag_status/', views.rag_status, name='rag_status'),
+    path('jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<uuid:job_id>/result/', views.job_result, name='job_result'),
     path('', views.home, name='home'),
 ]
\ No newline at end of file
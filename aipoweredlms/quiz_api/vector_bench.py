@@ -0,0 +1,129 @@
+import json
+import os
+import resource
+import sys
+import time
+import numpy as np
+
+# Vector store benchmark on synthetic clustered embeddings: build time, query latency,
+# recall against exact search and resident memory per backend. Each phase runs in its
+# own interpreter (python -m quiz_api.vector_bench <phase> <params>) so memory figures
+# are not polluted by other runs; the bench_vectors command drives it.
+BACKENDS = ("numpy-flat", "numpy-ivf", "chroma")
+INSERT_BATCH = 5000  # below Chroma's maximum batch size
+CLUSTERS = 256
+NOISE = 1.0
+
+
+def corpus_centers(dim, seed=0):
+    return np.random.default_rng(seed).standard_normal((CLUSTERS, dim)).astype(np.float32)
+
+
+def synthetic_vectors(centers, start, count, seed=0):
+    """Normalized vectors around random cluster centers; the same (start, count) always gives the same rows."""
+    rng = np.random.default_rng([seed, start])
+    vectors = centers[rng.integers(0, len(centers), count)]
+    vectors = vectors + rng.standard_normal(vectors.shape, dtype=np.float32) * NOISE
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def memory():
+    """Current resident memory split into anonymous (heap) and file-backed (mmap/page cache) MB."""
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                usage[name] = round(int(value.split()[0]) / 1024, 1)
+    usage["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return {"rss_mb": usage.get("VmRSS"), "anon_mb": usage.get("RssAnon"),
+            "file_mb": usage.get("RssFile"), "peak_rss_mb": usage["peak_rss_mb"]}
+
+
+def open_store(backend, directory):
+    if backend.startswith("numpy"):
+        from .numpy_store import NumpyVectorStore
+        return NumpyVectorStore(None, directory)
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=directory)
+
+
+def build(backend, size, dim, queries, k, directory):
+    """Inserts size vectors in batches (plus the IVF index for numpy-ivf) and records exact top-k for the queries."""
+    centers = corpus_centers(dim)
+    query_vectors = synthetic_vectors(centers, 0, queries, seed=1)
+    truth_scores = np.full((queries, k), -np.inf, dtype=np.float32)
+    truth_rows = np.zeros((queries, k), dtype=np.int64)
+    store = open_store(backend, directory)
+    insert_seconds = 0.0
+
+    for start in range(0, size, INSERT_BATCH):
+        vectors = synthetic_vectors(centers, start, min(INSERT_BATCH, size - start))
+        # Exact neighbours, kept outside the timed part
+        scores = np.concatenate([truth_scores, query_vectors @ vectors.T], axis=1)
+        rows = np.concatenate([truth_rows, np.broadcast_to(np.arange(start, start + len(vectors)), (queries, len(vectors)))], axis=1)
+        best = np.argsort(-scores, axis=1)[:, :k]
+        truth_scores, truth_rows = np.take_along_axis(scores, best, 1), np.take_along_axis(rows, best, 1)
+
+        began = time.perf_counter()
+        store._collection.upsert(
+            ids=[f"c{row}" for row in range(start, start + len(vectors))],
+            embeddings=vectors,
+            documents=[f"chunk {row}" for row in range(start, start + len(vectors))],
+            metadatas=[{"source": f"pdfs/doc{row // 50}.pdf", "page": row % 50} for row in range(start, start + len(vectors))],
+        )
+        insert_seconds += time.perf_counter() - began
+
+    index_seconds = 0.0
+    if backend == "numpy-ivf":
+        began = time.perf_counter()
+        store.build_ivf()
+        index_seconds = time.perf_counter() - began
+
+    np.save(os.path.join(directory, "bench_queries.npy"), query_vectors)
+    np.save(os.path.join(directory, "bench_truth.npy"), truth_rows)
+    return {
+        "insert_seconds": round(insert_seconds, 2),
+        "index_seconds": round(index_seconds, 2),
+        "build_seconds": round(insert_seconds + index_seconds, 2),
+        "build_peak_rss_mb": memory()["peak_rss_mb"],
+        "disk_mb": round(sum(os.path.getsize(os.path.join(root, name))
+                             for root, _, names in os.walk(directory) for name in names) / 2 ** 20, 1),
+    }
+
+
+def query(backend, size, dim, queries, k, directory):
+    """Opens the built store like a freshly started worker and times top-k searches."""
+    query_vectors = np.load(os.path.join(directory, "bench_queries.npy"))
+    truth = np.load(os.path.join(directory, "bench_truth.npy"))
+    before = memory()
+    store = open_store(backend, directory)
+    store.similarity_search_by_vector(query_vectors[0].tolist(), k=k)  # opens files and caches
+
+    latencies, hits = [], 0
+    for vector, expected in zip(query_vectors, truth):
+        began = time.perf_counter()
+        found = store.similarity_search_by_vector(vector.tolist(), k=k)
+        latencies.append(time.perf_counter() - began)
+        hits += len({doc.id for doc in found} & {f"c{row}" for row in expected})
+
+    after = memory()
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+        f"recall_at_{k}": round(hits / (len(truth) * k), 4),
+        "rss_mb": after["rss_mb"],
+        "anon_mb": after["anon_mb"],
+        "file_mb": after["file_mb"],
+        "store_rss_mb": round(after["rss_mb"] - before["rss_mb"], 1),
+    }
+
+
+PHASES = {"build": build, "query": query}
+
+
+if __name__ == "__main__":
+    phase, params = sys.argv[1], json.loads(sys.argv[2])
+    print(json.dumps(PHASES[phase](**params)))
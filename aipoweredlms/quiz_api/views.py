@@ -1,18 +1,78 @@
 from django.http import JsonResponse
-from rest_framework.decorators import api_view
+from adrf.decorators import api_view
 from rest_framework.response import Response
-from .ragchat import get_rag_response, get_rag_quiz
-from .pptjson import extract_text_from_pdf, generate_json_with_gemini
+from asgiref.sync import sync_to_async
+from .ragchat import aget_rag_response, astream_rag_response, aget_rag_quiz, PipelineWarming, require_pipeline, warmup_status, cache_stats
+from .pptjson import extract_text_from_pdf, STRUCTURING_PROMPT_VERSION
 from rest_framework.decorators import parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
-from .equation import get_curve_equation
+from .equation import aget_curve_equation, astream_curve_equation
+from .upload import abort_upload, complete_upload, presign_upload, upload_file_to_s3
+from .summerization import astream_query_pdf_with_gemini, query_key as summary_query_key, QUERY_PROMPT_VERSION
+from .concurrency import llm_slot
+from .streaming import wants_stream, sse_response, tee_tokens, single_token
+from .pdf_cache import get_pdf_cache
+from .pdf_ingest import read_upload
+from .indexing import is_valid_course
+from .conversation import stats as conversation_stats
+from .structured_output import stats as structured_output_stats
+from .clients import ServiceBusy, client_stats
+from .single_flight import flight_stats
+from .jobs import enqueue, enqueue_indexing, describe
+from .models import Job
+from .bulk_quiz import aget_bulk_quiz, astream_bulk_quiz, parse_difficulties
 from django.conf import settings
-import os
-from .upload import upload_file_to_s3
-from .summerization import query_pdf_with_gemini
+import hashlib
+
+
+def load_upload_text(uploaded_file):
+    """Returns (sha256, text) for an upload, parsing it only if this PDF was never seen."""
+    digest = hashlib.sha256()
+    source = read_upload(uploaded_file, digest)
+    digest = digest.hexdigest()
+
+    cache = get_pdf_cache()
+    text = cache.get_text(digest)
+    if text is None:
+        text = extract_text_from_pdf(source)
+        if text:
+            cache.set_text(digest, text)
+    return digest, text
+
+
+async def extract_upload_text(uploaded_file):
+    """Hashes and parses an upload off the event loop."""
+    return await sync_to_async(load_upload_text, thread_sensitive=False)(uploaded_file)
+
+
+async def client_session_key(request):
+    """Identifies the client, so quizzes serve unseen questions and chat follows the conversation.
+
+    Clients can pass their own session_id; otherwise the Django session cookie is used.
+    """
+    session_id = request.data.get('session_id')
+    if session_id:
+        return str(session_id)[:64]
+    if not request.session.session_key:
+        await request.session.acreate()
+    return request.session.session_key
+
+
+def request_scope(request):
+    """Optional course / document (PDF file name) that retrieval is limited to."""
+    return request.data.get('course') or None, request.data.get('document') or None
+
+
+def unavailable_response(e):
+    """503 with a Retry-After: the RAG pipeline is still warming up, or Gemini is rate limited or failing."""
+    if isinstance(e, PipelineWarming):
+        return Response({'status': 'warming', 'message': str(e)}, status=503, headers={'Retry-After': '5'})
+    return Response({'status': 'busy', 'message': str(e)}, status=503,
+                    headers={'Retry-After': str(max(1, round(e.retry_after)))})
+
 
 @api_view(['POST'])
-def chat_api(request):
+async def chat_api(request):
     try:
         user_input = request.data.get('prompt')
         if not user_input:
@@ -21,12 +81,22 @@ def chat_api(request):
                 'message': 'No input provided'
             }, status=400)
 
-        chat_response = get_rag_response(user_input)
+        course, document = request_scope(request)
+        if wants_stream(request):
+            require_pipeline()
+            return sse_response(astream_rag_response(user_input, course, document, await client_session_key(request)))
+
+        session_key = await client_session_key(request)
+        async with llm_slot():
+            chat_response = await aget_rag_response(user_input, course, document, session_key)
         return Response({
             'status': 'success',
             'response': chat_response
         })
 
+    except (PipelineWarming, ServiceBusy) as e:
+        return unavailable_response(e)
+
     except Exception as e:
         return Response({
             'status': 'error',
@@ -34,7 +104,7 @@ def chat_api(request):
         }, status=500)
 
 @api_view(['POST'])
-def quiz_api(request):
+async def quiz_api(request):
     try:
         user_input = request.data.get('prompt')
         if not user_input:
@@ -43,12 +113,65 @@ def quiz_api(request):
                 'message': 'No input provided'
             }, status=400)
 
-        quiz_response = get_rag_quiz(user_input)
+        try:
+            count = int(request.data['count']) if request.data.get('count') else None
+        except ValueError:
+            return Response({'status': 'error', 'message': 'count must be a number'}, status=400)
+        if count is not None:
+            count = max(1, min(count, settings.BULK_QUIZ['MAX_QUESTIONS']))
+
+        course, document = request_scope(request)
+        session_key = await client_session_key(request)
+        # Holds an LLM slot only while generating; duplicates of an in-flight quiz just wait for it
+        quiz_response = await aget_rag_quiz(user_input, course, document, session_key, count)
         return Response({
             'status': 'success',
             'mcqs': quiz_response
         })
 
+    except (PipelineWarming, ServiceBusy) as e:
+        return unavailable_response(e)
+
+    except Exception as e:
+        return Response({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+
+@api_view(['POST'])
+async def bulk_quiz_api(request):
+    try:
+        topic = request.data.get('topic') or request.data.get('prompt')
+        if not topic:
+            return Response({
+                'status': 'error',
+                'message': 'No topic provided'
+            }, status=400)
+
+        try:
+            difficulties = parse_difficulties(request.data.get('difficulties'))
+            count = int(request.data.get('count', 50))
+        except ValueError as e:
+            return Response({'status': 'error', 'message': str(e)}, status=400)
+        count = max(1, min(count, settings.BULK_QUIZ['MAX_QUESTIONS']))
+        course, document = request_scope(request)
+
+        if wants_stream(request):
+            require_pipeline()
+            return sse_response(astream_bulk_quiz(topic, difficulties, count, course, document), field='batch', slot=False)
+
+        # Each batch holds its own LLM slot while it calls Gemini
+        mcqs = await aget_bulk_quiz(topic, difficulties, count, course, document)
+        return Response({
+            'status': 'success',
+            'count': len(mcqs),
+            'mcqs': mcqs
+        })
+
+    except (PipelineWarming, ServiceBusy) as e:
+        return unavailable_response(e)
+
     except Exception as e:
         return Response({
             'status': 'error',
@@ -58,57 +181,113 @@ def quiz_api(request):
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
-def upload_pdf(request):
+async def upload_pdf(request):
     try:
         pdf_file = request.FILES.get('file')
         if not pdf_file:
             return Response({'status': 'error', 'message': 'No file provided'}, status=400)
         
-        # Save the uploaded file temporarily
-        temp_pdf_path = os.path.join(settings.MEDIA_ROOT, pdf_file.name)
-        with open(temp_pdf_path, 'wb') as temp_pdf:
-            for chunk in pdf_file.chunks():
-                temp_pdf.write(chunk)
-        
-        # Extract text from the uploaded PDF
-        extracted_text = extract_text_from_pdf(temp_pdf_path)
+        # Extract text straight from the upload, without saving it under MEDIA_ROOT
+        digest, extracted_text = await extract_upload_text(pdf_file)
         if not extracted_text:
             return Response({'status': 'error', 'message': 'Failed to extract text'}, status=400)
         
-        # Generate structured JSON using Gemini AI
-        structured_json = generate_json_with_gemini(extracted_text)
-        
-        return Response({'status': 'success', 'data': structured_json})
+        # Repeated uploads of the same PDF reuse the earlier Gemini output
+        cache = get_pdf_cache()
+        structured_json = await sync_to_async(cache.get_result, thread_sensitive=False)(
+            digest, 'structure', STRUCTURING_PROMPT_VERSION)
+
+        # Generate structured JSON using Gemini AI on a background worker
+        job, _ = await sync_to_async(enqueue)(
+            Job.KIND_STRUCTURE, digest, extracted_text, STRUCTURING_PROMPT_VERSION, result=structured_json)
+        return job_response(job, 'data')
     except Exception as e:
         return Response({'status': 'error', 'message': str(e)}, status=500)
 
 @api_view(['POST'])
-def get_equation(request):
+async def get_equation(request):
     try:
         curve_name = request.data.get('curve_name')
-        equation = get_curve_equation(curve_name)
+        if wants_stream(request):
+            return sse_response(astream_curve_equation(curve_name))
+
+        equation = await aget_curve_equation(curve_name)
         return Response({'status': 'success', 'equation': equation})
+    except ServiceBusy as e:
+        return unavailable_response(e)
     except Exception as e:
         return Response({'status': 'error', 'message': str(e)}, status=500)
     
 @api_view(['POST'])
-def upload_file(request):
+async def upload_file(request):
     try:
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({'status': 'error', 'message': 'No file provided'}, status=400)
 
-        # Upload file to S3
-        upload_result = upload_file_to_s3(file_obj)
+        # Upload file to S3, under pdfs/<course>/ when a course is given
+        course = request.data.get('course') or None
+        if course and not is_valid_course(course):
+            return Response({'status': 'error', 'message': 'Invalid course name'}, status=400)
+        upload_result = await sync_to_async(upload_file_to_s3, thread_sensitive=False)(file_obj, course=course)
         if not upload_result['status']:
             return Response({'status': 'error', 'message': upload_result['error']}, status=500)
         
-        return Response({'status': 'success', 'url': upload_result['url']})
+        return Response({'status': 'success', 'url': upload_result['url'], 'key': upload_result['key'],
+                         'indexing': await indexing_job(upload_result)})
+    except Exception as e:
+        return Response({'status': 'error', 'message': str(e)}, status=500)
+
+
+async def indexing_job(upload_result):
+    """Queues incremental indexing of a finished upload; returns the job description (None for non-PDFs)."""
+    job = await sync_to_async(enqueue_indexing)(upload_result['key'], upload_result['etag'])
+    return describe(job) if job else None
+
+
+@api_view(['POST'])
+async def presign_upload_api(request):
+    """Presigned URL(s) for uploading a file straight to S3 (multipart above the configured size)."""
+    try:
+        try:
+            size = int(request.data['size']) if request.data.get('size') else None
+        except ValueError:
+            return Response({'status': 'error', 'message': 'size must be a number of bytes'}, status=400)
+        result = await sync_to_async(presign_upload, thread_sensitive=False)(
+            request.data.get('filename'), request.data.get('course') or None, size, request.data.get('content_type'))
+        if not result.pop('status'):
+            return Response({'status': 'error', 'message': result['error']}, status=400)
+        return Response({'status': 'success', **result})
+    except Exception as e:
+        return Response({'status': 'error', 'message': str(e)}, status=500)
+
+
+@api_view(['POST'])
+async def complete_upload_api(request):
+    """Completes a presigned upload and queues indexing of the new PDF."""
+    try:
+        result = await sync_to_async(complete_upload, thread_sensitive=False)(
+            request.data.get('upload_token'), request.data.get('parts'))
+        if not result['status']:
+            return Response({'status': 'error', 'message': result['error']}, status=400)
+        return Response({'status': 'success', 'url': result['url'], 'key': result['key'], 'size': result['size'],
+                         'indexing': await indexing_job(result)})
     except Exception as e:
         return Response({'status': 'error', 'message': str(e)}, status=500)
 
+
 @api_view(['POST'])
-def summarize_pdf(request):
+async def abort_upload_api(request):
+    try:
+        result = await sync_to_async(abort_upload, thread_sensitive=False)(request.data.get('upload_token'))
+        if not result['status']:
+            return Response({'status': 'error', 'message': result['error']}, status=400)
+        return Response({'status': 'success', 'key': result['key']})
+    except Exception as e:
+        return Response({'status': 'error', 'message': str(e)}, status=500)
+
+@api_view(['POST'])
+async def summarize_pdf(request):
     try:
         user_query = request.data.get('user_query')
         if not user_query:  
@@ -118,35 +297,92 @@ def summarize_pdf(request):
         if not pdf_file:
             return Response({'status': 'error', 'message': 'No file provided'}, status=400)
         
-        # Save the uploaded file temporarily
-        temp_pdf_path = os.path.join(settings.MEDIA_ROOT, pdf_file.name)
-        with open(temp_pdf_path, 'wb') as temp_pdf:
-            for chunk in pdf_file.chunks():
-                temp_pdf.write(chunk)
-        
-        # Extract text from the uploaded PDF    
-        extracted_text = extract_text_from_pdf(temp_pdf_path)
+        # Extract text straight from the upload, without saving it under MEDIA_ROOT
+        digest, extracted_text = await extract_upload_text(pdf_file)
         if not extracted_text:
             return Response({'status': 'error', 'message': 'Failed to extract text'}, status=400)
         
+        # The same question about the same PDF is answered from the cache
+        cache = get_pdf_cache()
+        query_key = summary_query_key(user_query)
+        summary = await sync_to_async(cache.get_result, thread_sensitive=False)(
+            digest, 'summary', QUERY_PROMPT_VERSION, query_key)
+
         # Generate summary using Gemini AI
-        summary = query_pdf_with_gemini(extracted_text, user_query)
-        
-        return Response({'status': 'success', 'summary': summary})
+        if wants_stream(request):
+            if summary is not None:
+                return sse_response(single_token(summary), slot=False)
+            return sse_response(tee_tokens(
+                astream_query_pdf_with_gemini(extracted_text, user_query),
+                lambda text: cache.set_result(digest, 'summary', QUERY_PROMPT_VERSION, text.strip(), query_key)),
+                slot=False)
+
+        job, _ = await sync_to_async(enqueue)(
+            Job.KIND_SUMMARY, digest, extracted_text, QUERY_PROMPT_VERSION,
+            {'user_query': user_query, 'query_key': query_key}, result=summary)
+        return job_response(job, 'summary')
     except Exception as e:
         return Response({'status': 'error', 'message': str(e)}, status=500)
 
 
+def job_response(job, result_field):
+    """202 with the job to poll, or 200 with the result when it is already done."""
+    if job.status == Job.SUCCEEDED:
+        return Response({'status': 'success', 'job': describe(job), result_field: job.result})
+    return Response({'status': 'accepted', 'job': describe(job)}, status=202,
+                    headers={'Location': describe(job)['status_url']})
+
+
+@api_view(['GET'])
+async def job_status(request, job_id):
+    job = await Job.objects.filter(id=job_id).afirst()
+    if job is None:
+        return Response({'status': 'error', 'message': 'Job not found'}, status=404)
+    return Response({'status': 'success', 'job': describe(job)})
+
+
+@api_view(['GET'])
+async def job_result(request, job_id):
+    job = await Job.objects.filter(id=job_id).afirst()
+    if job is None:
+        return Response({'status': 'error', 'message': 'Job not found'}, status=404)
+    if job.status == Job.SUCCEEDED:
+        return Response({'status': 'success', 'job': describe(job), 'result': job.result})
+    if job.status == Job.FAILED:
+        return Response({'status': 'error', 'job': describe(job), 'message': job.error}, status=500)
+    return Response({'status': 'pending', 'job': describe(job)}, status=202, headers={'Retry-After': '2'})
+
+
+@api_view(['GET'])
+def rag_status(request):
+    return Response({
+        'status': 'success',
+        'rag': warmup_status(),
+        'cache': cache_stats(),
+        'structured_output': structured_output_stats(),
+        'conversation': conversation_stats(),
+        'clients': client_stats(),
+        'single_flight': flight_stats(),
+    })
+
+
 # Optional: Add a home view
 def home(request):
     return JsonResponse({
         "message": "Welcome to AI Powered LMS API",
         "endpoints": {
-            "POST /api/chat/": "Submit prompt to chat system",
-            "POST /api/quiz/": "Generate quiz questions",
-            "POST /api/upload_pdf/": "Upload a PDF to extract structured JSON",
-            "POST /api/equation/": "Get the equation of a curve",
-            "POST /api/summerize_pdf/": "Summerize a PDF",
-            "POST /api/upload_file/": "Upload a file to S3"
+            "POST /api/chat/": "Submit prompt to chat system; follow-ups continue the session's conversation (optional session_id, course/document scope, add stream=true for server-sent events)",
+            "POST /api/quiz/": "Get quiz questions not yet seen in this session, from the question bank or freshly generated (optional course/document scope, count)",
+            "POST /api/quiz/bulk/": "Generate a question bank in parallel batches across difficulties (add stream=true to receive batches as they finish)",
+            "POST /api/upload_pdf/": "Upload a PDF to extract structured JSON (returns a job to poll)",
+            "POST /api/equation/": "Get the equation of a curve (add stream=true for server-sent events)",
+            "POST /api/summerize_pdf/": "Summerize a PDF (returns a job to poll, or add stream=true for server-sent events)",
+            "POST /api/upload_file/": "Upload a file to S3 (optional course); PDFs are then indexed in the background",
+            "POST /api/uploads/presign/": "Get presigned URL(s) to upload a file straight to S3 (multipart for large files)",
+            "POST /api/uploads/complete/": "Complete a presigned upload (its upload_token and, for multipart, part ETags) and queue indexing of the new PDF",
+            "POST /api/uploads/abort/": "Abort a presigned multipart upload (by its upload_token)",
+            "GET /api/rag_status/": "Check whether the knowledge base has finished warming up",
+            "GET /api/jobs/<id>/": "Check the status of a background job",
+            "GET /api/jobs/<id>/result/": "Fetch the result of a background job"
         }
     })
\ No newline at end of file